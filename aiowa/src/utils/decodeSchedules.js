@@ -0,0 +1,34 @@
+// Expands a /schedules?format=compact payload back into the regular
+// { schedules: [{ start, end, class, WFH, count, title, inOffice }] } shape.
+// Regular payloads are returned unchanged, so callers can always run responses through it.
+export function decodeSchedules(payload) {
+    if (!payload || payload.format !== "compact") {
+        return payload;
+    }
+
+    const roster = payload.roster.map((row) => {
+        const employee = {};
+        payload.fields.forEach((field, i) => {
+            employee[field] = row[i];
+        });
+        return employee;
+    });
+
+    const schedules = payload.schedules.map((slot) => {
+        // inOffice is a base64 bitmap; bit i is (byte[i >> 3] >> (i & 7)) & 1
+        const bits = atob(slot.inOffice);
+        const inOffice = [];
+        for (let i = 0; i < payload.in_office_size; i++) {
+            if ((bits.charCodeAt(i >> 3) >> (i & 7)) & 1) {
+                inOffice.push(roster[i]);
+            }
+        }
+        return {
+            ...slot,
+            WFH: slot.WFH.map((i) => roster[i]),
+            inOffice,
+        };
+    });
+
+    return { schedules };
+}
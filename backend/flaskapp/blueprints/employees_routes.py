@@ -1,13 +1,13 @@
 # employees_routes.py
 from flask import Blueprint
 from ..models.employees import EmployeesService, EmployeesController
-from ..extensions import supabase
+from ..extensions import supabase, org_chart, change_version
 
 # Initialize Blueprint
 employees_blueprint = Blueprint("employees", __name__)
 
 # Initialize Service and Controller
-employees_service = EmployeesService(supabase)
+employees_service = EmployeesService(supabase, org_chart)
 employees_controller = EmployeesController(employees_service)
 
 # Define routes
@@ -17,7 +17,11 @@ def get_employees():
 
 @employees_blueprint.route("/employees", methods=['PUT'])
 def update_employee():
-    return employees_controller.update_employee()
+    response, status_code = employees_controller.update_employee()
+    # Names and teams appear in the schedule and request listings
+    if status_code == 200:
+        change_version.bump()
+    return response, status_code
 
 @employees_blueprint.route("/getstaffid", methods=['GET'])
 def get_staff_id():
@@ -1,24 +1,33 @@
-from flask import Blueprint, jsonify, make_response
-from ..extensions import supabase  # Assuming you have initialized supabase
-from ..models.requests import RequestService, RequestController
+from flask import Blueprint, jsonify, make_response, request
+from ..extensions import supabase, org_chart, occupancy_summary, change_version, schedule_index, request_intervals  # Assuming you have initialized supabase
+from ..models.requests import RequestService, RequestController, APPROVAL_RPC, TEAM_QUEUE_VIEW
+from ..models.recurrence import RECURRENCE_RULES
+from ..models.approval_jobs import ApprovalJobService, ASYNC_APPROVAL
 from ..models.notification import notification_engine, notification_sender, supabase_access
+from ..models.outbox import NotificationOutbox, outbox_store, NOTIFICATION_OUTBOX
+from ..models.versioning import not_modified, with_etag
 
 
 requests_blueprint = Blueprint("requests", __name__)
 
 # Initialize services and controllers
-request_service = RequestService(supabase)
-request_controller = RequestController(request_service)
+request_service = RequestService(supabase, org_chart, occupancy_summary, schedule_index, approval_rpc=APPROVAL_RPC, team_queue_view=TEAM_QUEUE_VIEW, request_intervals=request_intervals, recurrence_rules=RECURRENCE_RULES)
+approval_jobs = ApprovalJobService(supabase, request_service, change_version, submit_rpc=APPROVAL_RPC)
+request_controller = RequestController(request_service, approval_jobs=approval_jobs if ASYNC_APPROVAL else None)
 notif_supabase = supabase_access(supabase)
 notif_engine = notification_engine(notif_supabase)
 notif_sender = notification_sender(notif_engine)
+# With NOTIFICATION_OUTBOX set the routes queue notifications and a dispatcher sends them (models/outbox.py)
+notification_outbox = NotificationOutbox(outbox_store(supabase), notif_sender) if NOTIFICATION_OUTBOX else None
+notifier = notification_outbox or notif_sender
 
 # Define routes
 @requests_blueprint.route("/withdraw_request/<int:request_id>", methods=['DELETE'])
 def withdraw_request(request_id: int):
     response, status_code = request_controller.withdraw_request(request_id)
     if "error" not in response.keys():
-        email = notif_sender.send_cancel(response["data"])
+        change_version.bump()
+        email = notifier.send_cancel(response["data"])
         response["email"] = email
     return make_response(jsonify(response), status_code)
 
@@ -26,7 +35,8 @@ def withdraw_request(request_id: int):
 def cancel_request(request_id: int):
     response, status_code = request_controller.cancel_request(request_id)
     if "error" not in response.keys():
-        email = notif_sender.send_withdraw(response["data"])
+        change_version.bump()
+        email = notifier.send_withdraw(response["data"])
         response["email"] = email
     return make_response(jsonify(response), status_code)
 
@@ -38,20 +48,31 @@ def get_staff_id():
 @requests_blueprint.route("/requests/", methods=['POST'])
 def create_request():
     response, status_code = request_controller.create_request()
-    if "error" not in response.keys():
-        code = notif_sender.send_create()
+    # 200 is a replayed Idempotency-Key: the request was already announced on its first attempt
+    if status_code == 201:
+        change_version.bump()
+        code = notifier.send_create(response)
         response["email"] = code
     return make_response(jsonify(response), status_code)
 
 @requests_blueprint.route("/requests/<int:staff_id>", methods=['GET'])
 def get_requests_by_staff(staff_id: int):
+    etag = change_version.etag()
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
     response, status_code = request_controller.get_requests_by_staff(staff_id)
-    return make_response(jsonify(response), status_code)
+    return with_etag(make_response(jsonify(response), status_code), etag)
 
 @requests_blueprint.route('/team/requests', methods=['GET'])
 def get_team_requests():
+    # The listing depends on who is asking, so the staff header is part of the ETag
+    etag = change_version.etag(request.headers.get('X-Staff-ID'))
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
     response, status_code = request_controller.get_team_requests()
-    return make_response(jsonify(response), status_code)
+    return with_etag(make_response(jsonify(response), status_code), etag)
 
 @requests_blueprint.route("/request/<request_id>", methods=['GET'])
 def get_selected_request(request_id):
@@ -62,14 +83,38 @@ def get_selected_request(request_id):
 def request_approve(request_id):
     response, status_code = request_controller.approve_request(request_id)
     if "error" not in response.keys():
-        email = notif_sender.send_approve(request_id)
+        change_version.bump()
+        email = notifier.send_approve(request_id)
         response["email"] = email
     return make_response(jsonify(response), status_code)
 
+# Progress of a background approval (ASYNC_APPROVAL), polled by the UI after a 202 from /approve
+@requests_blueprint.route("/jobs/<job_id>", methods=['GET'])
+def get_job(job_id):
+    response, status_code = approval_jobs.get_job(job_id)
+    return make_response(jsonify(response), status_code)
+
+# Runs a failed (or lost) background approval again
+@requests_blueprint.route("/jobs/<job_id>/retry", methods=['POST'])
+def retry_job(job_id):
+    response, status_code = approval_jobs.retry(job_id)
+    return make_response(jsonify(response), status_code)
+
+# Bulk approve/reject: {"decisions": [{request_id, decision: approve|reject, result_reason, approved_dates}, ...]}
+@requests_blueprint.route("/requests/decisions", methods=['POST'])
+def request_decisions():
+    response, status_code = request_controller.decide_requests()
+    decided = [item for item in response.get("results", []) if item["status"] == 200]
+    if decided:
+        change_version.bump()
+        response["email"] = notifier.send_decisions(decided)
+    return make_response(jsonify(response), status_code)
+
 @requests_blueprint.route("/request/<request_id>/reject", methods=['PUT'])
 def request_reject(request_id):
     response, status_code = request_controller.reject_request(request_id)
     if "error" not in response.keys():
-        email = notif_sender.send_reject(request_id)
+        change_version.bump()
+        email = notifier.send_reject(request_id)
         response["email"] = email
     return make_response(jsonify(response), status_code)
\ No newline at end of file
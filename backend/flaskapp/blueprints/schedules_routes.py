@@ -1,12 +1,16 @@
-from flask import Blueprint, jsonify, request
-from ..extensions import supabase  # Assuming supabase is initialized here
+from flask import Blueprint, Response, jsonify, make_response, request, stream_with_context
+from datetime import datetime
+from ..extensions import supabase, org_chart, occupancy_summary, change_version, schedule_index  # Assuming supabase is initialized here
 from ..models.schedules import SchedulesService
+from ..models.versioning import not_modified, with_etag
+from ..models.fanout import fan_out
+from ..models.recurrence import RECURRENCE_RULES
 
 # schedules_controller.py
 schedules_blueprint = Blueprint("schedules", __name__)
 
 # Initialize the service with the Supabase client
-schedules_service = SchedulesService(supabase)
+schedules_service = SchedulesService(supabase, org_chart, schedule_index=schedule_index, recurrence_rules=RECURRENCE_RULES)
 
 @schedules_blueprint.route("/")
 def test():
@@ -14,42 +18,132 @@ def test():
 
 
 
+# Employee filters matching each /schedules branch below, for get_roster_with_schedules
+def roster_filters(data):
+    if data["dept"] == "CEO":
+        return {"dept": "CEO"}
+    if data["dept"] == "all" and data["reporting_manager"] == "all":
+        return {}
+    if data["reporting_manager"] == "all":
+        return {"dept": data["dept"]}
+    if int(data["role"]) == 1 and int(data["reporting_manager"]) == schedules_service.get_ceo():
+        return {"reporting_manager": int(data["reporting_manager"]), "exclude_md": True}
+    return {"dept": data["dept"], "reporting_manager": int(data["reporting_manager"])}
+
+
+# get_rules filters matching the roster of a /schedules branch; the company-wide view reads every rule
+def rule_filters(data, roster):
+    if "staff_id" in data:
+        return {"staff_id": int(data["staff_id"])}
+    if data["dept"] == "all" and data["reporting_manager"] == "all":
+        return {}
+    return {"staff_ids": sorted({employee["Staff_ID"] for employee in roster.data or []})}
+
+
 @schedules_blueprint.route("/schedules", methods=['GET'])
 def get_schedules():
     data = request.args
 
-    CEO = schedules_service.get_ceo()
-    
+    # Optional start/end (YYYY-MM-DD, inclusive) limit the schedule rows to the visible calendar window
+    window = {}
+    for bound in ("start", "end"):
+        if data.get(bound):
+            try:
+                window[bound] = datetime.strptime(data[bound][:10], "%Y-%m-%d").strftime("%Y-%m-%d")
+            except ValueError:
+                return jsonify({"error": f"Invalid {bound} date, expected YYYY-MM-DD"}), 400
+
+    # Conditional GET: a client already holding this version gets a 304 before any schedule query runs
+    etag = change_version.etag()
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+    try:
+        return with_etag(make_response(build_schedules(data, window)), etag)
+    except TimeoutError as e:
+        return jsonify({"error": str(e)}), 504
+
+
+# Point queries on the schedule index:
+#   ?date=YYYY-MM-DD&time_slot=1             -> staff_ids away on that slot
+#   ?staff_id=..&start=..&end=..[&time_slot=] -> whether that person is away in the range
+@schedules_blueprint.route("/schedules/away", methods=['GET'])
+def get_away():
+    data = request.args
+    try:
+        if "staff_id" in data:
+            start = datetime.strptime(data["start"], "%Y-%m-%d").strftime("%Y-%m-%d")
+            end = datetime.strptime(data["end"], "%Y-%m-%d").strftime("%Y-%m-%d")
+            time_slot = int(data["time_slot"]) if data.get("time_slot") else None
+            away = schedules_service.is_away_between(int(data["staff_id"]), start, end, time_slot)
+            return jsonify({"staff_id": int(data["staff_id"]), "start": start, "end": end, "away": away}), 200
+        date = datetime.strptime(data["date"], "%Y-%m-%d").strftime("%Y-%m-%d")
+        time_slot = int(data["time_slot"])
+    except (KeyError, ValueError):
+        return jsonify({"error": "Expected date and time_slot, or staff_id, start and end (YYYY-MM-DD)"}), 400
+    return jsonify({"date": date, "time_slot": time_slot, "staff_ids": schedules_service.who_is_away(date, time_slot)}), 200
+
+
+def build_schedules(data, window):
+    # Calendar counts only (view=counts), served from the occupancy summary without reading schedule rows.
+    # The own-schedule and director-team views are not team-shaped and fall through to the full payload.
+    if data.get("view") == "counts" and "staff_id" not in data:
+        filters = roster_filters(data)
+        if "exclude_md" not in filters:
+            return jsonify(schedules_service.format_counts(occupancy_summary.get_counts(**filters, **window))[0])
+
+    # The roster and schedule queries in each branch are independent round trips, so they run concurrently
     if "staff_id" in data:
-        response = schedules_service.get_own_schedule(data["staff_id"])
-        allnames = schedules_service.get_schedules_by_reporting_manager(data["dept"], int(data["reporting_manager"]))
+        response, allnames = fan_out(
+            lambda: schedules_service.get_own_schedule(data["staff_id"], **window),
+            lambda: schedules_service.get_schedules_by_reporting_manager(data["dept"], int(data["reporting_manager"])))
+
+    # Roster and schedule rows in a single query (fetch=joined)
+    elif data.get("fetch") == "joined":
+        response = schedules_service.get_roster_with_schedules(**roster_filters(data), **window)
+        allnames = None
 
     # Special case for CEO department
     elif data["dept"] == "CEO":
-        allnames = schedules_service.get_all_employees_by_dept(data["dept"])
-        response = schedules_service.get_schedules_by_dept(data["dept"])
+        allnames, response = fan_out(
+            lambda: schedules_service.get_all_employees_by_dept(data["dept"]),
+            lambda: schedules_service.get_schedules_by_dept(data["dept"], **window))
 
     # Filter for all departments
     elif data["dept"] == "all" and data["reporting_manager"] == "all":
-        allnames = schedules_service.get_all_employees()
-        response = schedules_service.get_schedules_for_all_depts()
+        allnames, response = fan_out(
+            schedules_service.get_all_employees,
+            lambda: schedules_service.get_schedules_for_all_depts(**window))
 
     # Filter for all teams in a department
     elif data["reporting_manager"] == "all" and data["dept"] != "all":
-        allnames = schedules_service.get_all_employees_by_dept(data["dept"])
-        response = schedules_service.get_schedules_by_dept(data["dept"])
+        allnames, response = fan_out(
+            lambda: schedules_service.get_all_employees_by_dept(data["dept"]),
+            lambda: schedules_service.get_schedules_by_dept(data["dept"], **window))
 
     # Director team (special logic)
-    elif int(data["role"]) == 1 and int(data["reporting_manager"]) == CEO:
-        allnames = schedules_service.get_all_directors(data["reporting_manager"])
-        response = schedules_service.get_directors_schedules(data["reporting_manager"])
+    elif int(data["role"]) == 1 and int(data["reporting_manager"]) == schedules_service.get_ceo():
+        allnames, response = fan_out(
+            lambda: schedules_service.get_all_directors(data["reporting_manager"]),
+            lambda: schedules_service.get_directors_schedules(data["reporting_manager"], **window))
 
     # Filter by department and reporting manager
     else:
         print("here")
-        allnames = schedules_service.get_all_employees_by_reporting_manager(data["dept"], int(data["reporting_manager"]))
-        response = schedules_service.get_schedules_by_reporting_manager(data["dept"], int(data["reporting_manager"]))
+        allnames, response = fan_out(
+            lambda: schedules_service.get_all_employees_by_reporting_manager(data["dept"], int(data["reporting_manager"])),
+            lambda: schedules_service.get_schedules_by_reporting_manager(data["dept"], int(data["reporting_manager"]), **window))
+
+    # Recurring arrangements stored as rules (RECURRENCE_RULES), expanded over the window while formatting
+    rules = []
+    if schedules_service.recurrence_rules:
+        rules = schedules_service.get_rules(**window, **rule_filters(data, allnames if allnames is not None else response))
 
     # Format and return the schedule data
     # print(schedules_service.format_schedules(response, allnames)[0])
-    return jsonify(schedules_service.format_schedules(response, allnames)[0])
+    if data.get("format") == "compact":
+        return jsonify(schedules_service.format_schedules_compact(response, allnames, **window, rules=rules)[0])
+    if data.get("stream") == "true":
+        # Slot objects are serialised and sent one at a time instead of building the whole list first
+        return Response(stream_with_context(schedules_service.stream_schedules(response, allnames, **window, rules=rules)), mimetype="application/json")
+    return jsonify(schedules_service.format_schedules(response, allnames, **window, rules=rules)[0])
@@ -2,13 +2,13 @@
 from flask import Blueprint
 from ..models.teams import TeamsService, TeamsController
 from flask_supabase import Supabase
-from ..extensions import supabase
+from ..extensions import supabase, org_chart
 
 # Initialize Blueprint
 teams_blueprint = Blueprint("teams", __name__)
 
 # Initialize Service and Controller
-teams_service = TeamsService(supabase)
+teams_service = TeamsService(supabase, org_chart)
 teams_controller = TeamsController(teams_service)
 
 # Define routes
@@ -1,9 +1,30 @@
 from supabase import create_client, Client
 import os
 from dotenv import load_dotenv
+from .models.org_chart import OrgChartCache
+from .models.occupancy_summary import OccupancySummaryService
+from .models.versioning import ChangeVersion
+from .models.schedule_index import ScheduleIndex
+from .models.request_intervals import RequestIntervalIndex
+from .models.recurrence import RECURRENCE_RULES
 load_dotenv()
 url: str = os.environ.get("SUPABASE_URL")
 key: str = os.environ.get("SUPABASE_KEY")
 
 # Initialize the Supabase client
-supabase: Client = create_client(url, key)
\ No newline at end of file
+supabase: Client = create_client(url, key)
+
+# Shared Employee hierarchy cache for the services
+org_chart = OrgChartCache(supabase)
+
+# WFH counts per team and slot, kept in step with schedule writes
+occupancy_summary = OccupancySummaryService(supabase, org_chart)
+
+# Change counter behind the ETags on polled listings
+change_version = ChangeVersion(supabase)
+
+# In-process (date, time_slot) -> staff bitsets for point queries on the schedule table
+schedule_index = ScheduleIndex(supabase, recurrence_rules=RECURRENCE_RULES)
+
+# Per-staff date ranges of pending and approved requests, for overlap checks on new requests
+request_intervals = RequestIntervalIndex(supabase)
@@ -1,3 +1,4 @@
+import click
 from flask import Flask, jsonify, Blueprint, request, abort, current_app
 from flask_supabase import Supabase
 from datetime import datetime, timedelta
@@ -5,23 +6,50 @@ import os
 from flask_cors import CORS
 from .blueprints.schedules_routes import schedules_blueprint
 from .blueprints.employees_routes import employees_blueprint
-from .blueprints.requests_routes import requests_blueprint
+from .blueprints.requests_routes import requests_blueprint, notification_outbox, approval_jobs
 from .blueprints.teams_routes import teams_blueprint
 from .blueprints.auth_routes import auth_blueprint
+from .extensions import occupancy_summary
+from .models.outbox import start_dispatcher
+from .models.notification import send_stats
 
 def create_app():
     app = Flask(__name__)
     CORS(app, credentials=True ,resources={r"/*": {
-        "origins": "*", "allow_headers": ["Authorization", "Content-Type", "X-Staff-ID", "X-Role", "X-Dept"]}})  # Enable CORS for frontend origin
+        "origins": "*", "allow_headers": ["Authorization", "Content-Type", "X-Staff-ID", "X-Role", "X-Dept", "Idempotency-Key"]}})  # Enable CORS for frontend origin
 
     app.register_blueprint(schedules_blueprint)
     app.register_blueprint(employees_blueprint)
     app.register_blueprint(requests_blueprint)
     app.register_blueprint(teams_blueprint)
     app.register_blueprint(auth_blueprint)
+
+    @app.cli.command("occupancy-rebuild")
+    def occupancy_rebuild():
+        """Regenerate the occupancy summary table from the schedule rows."""
+        click.echo(f"Rebuilt occupancy summary: {occupancy_summary.rebuild()} rows")
+
+    @app.cli.command("approval-jobs-sweep")
+    @click.option("--failed", is_flag=True, help="Also run failed jobs again.")
+    def approval_jobs_sweep(failed):
+        """Restart background approvals that were lost (and failed ones with --failed)."""
+        click.echo(f"Restarted {approval_jobs.sweep(include_failed=failed)} approval jobs")
+
+    @app.cli.command("notify-drain")
+    def notify_drain():
+        """Send the notifications queued in the outbox."""
+        if notification_outbox is None:
+            click.echo("NOTIFICATION_OUTBOX is not set, notifications are sent inline")
+            return
+        sent, unsent = notification_outbox.drain()
+        stats = send_stats.snapshot()
+        click.echo(f"Sent {sent} notifications, {unsent} left for retry (SNS avg {stats['avg_ms']} ms, max {stats['max_ms']} ms)")
+
     return app
 
 app = create_app()
 
 if __name__ == '__main__': 
+    if notification_outbox is not None:
+        start_dispatcher(app, notification_outbox)
     app.run(debug=True, host="0.0.0.0")
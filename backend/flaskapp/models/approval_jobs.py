@@ -0,0 +1,232 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from postgrest.exceptions import APIError
+from dotenv import load_dotenv
+from .requests import MISSING_FUNCTION_CODES, NOT_PENDING_CODE
+load_dotenv()
+
+try:
+    from zappa.asynchronous import task as zappa_task
+except ImportError:  # zappa is only needed to deploy; local runs use the thread pool
+    zappa_task = None
+
+# Return 202 from /request/<id>/approve and write the schedule rows in the background
+ASYNC_APPROVAL = os.environ.get("ASYNC_APPROVAL", "false").lower() == "true"
+# Background workers for approval jobs outside Lambda
+APPROVAL_JOB_WORKERS = int(os.environ.get("APPROVAL_JOB_WORKERS", 2))
+# A queued or running job not updated for this many seconds is taken to be lost (a dead worker or a
+# Lambda invocation that timed out) and is started again; longer than the 15 minute Lambda limit
+APPROVAL_JOB_STALE_SECONDS = int(os.environ.get("APPROVAL_JOB_STALE_SECONDS", 960))
+JOB_FIELDS = "job_id, request_id, status, attempts, rows_written, rows_skipped, failed_chunks, error, created_at, updated_at"
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def executor():
+    # Kept apart from the fan-out pool so long materialisations never hold up request-time queries
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=APPROVAL_JOB_WORKERS, thread_name_prefix="approval-job")
+        return _executor
+
+
+def _run_job(job_id):
+    # Entry point in a fresh process (a Zappa async invocation), so it loads the app itself
+    from ..main import app
+    from ..blueprints.requests_routes import approval_jobs
+    with app.app_context():
+        approval_jobs.run(job_id)
+
+
+# In Lambda this is invoked asynchronously as its own Lambda event; elsewhere Zappa calls it inline
+run_job_async = zappa_task(_run_job) if zappa_task is not None else _run_job
+
+
+def dispatch(job_id):
+    if zappa_task is not None and os.environ.get("AWS_LAMBDA_FUNCTION_NAME"):
+        run_job_async(job_id)
+        return
+    app = current_app._get_current_object()
+    executor().submit(_run_in_app, app, job_id)
+
+
+def _run_in_app(app, job_id):
+    from ..blueprints.requests_routes import approval_jobs
+    with app.app_context():
+        approval_jobs.run(job_id)
+
+
+class ApprovalJobService:
+    # Records approvals straight away and writes their schedule rows in a background job, so approving
+    # a year-long recurring request takes as long as approving a single day. Jobs live in the approval_job
+    # table so any instance can run them and report on them.
+    def __init__(self, supabase, request_service, change_version=None, dispatch=dispatch, submit_rpc=False):
+        self.supabase = supabase
+        self.request_service = request_service
+        # Bumped again once the rows are written, so polled schedule views do not keep a pre-job ETag
+        self.change_version = change_version
+        self.dispatch = dispatch
+        # Approve and queue in one transaction through submit_approval_job; turned off if the function is missing
+        self.submit_rpc = submit_rpc
+
+    def _update_job(self, job_id, fields):
+        fields["updated_at"] = datetime.now(timezone.utc).isoformat()
+        return self.supabase.from_("approval_job").update(fields).eq("job_id", job_id)
+
+    @staticmethod
+    def _is_stale(job):
+        updated_at = datetime.fromisoformat(job["updated_at"])
+        return job["status"] in ("queued", "running") and \
+            datetime.now(timezone.utc) - updated_at > timedelta(seconds=APPROVAL_JOB_STALE_SECONDS)
+
+    @staticmethod
+    def _accepted(job):
+        return {
+            "message": "Request approved, schedule is being updated",
+            "job_id": job["job_id"],
+            "status_url": f"/jobs/{job['job_id']}"
+        }, 202
+
+    #marks the request approved and queues its schedule rows; ({job_id, status_url}, 202)
+    def submit(self, request_id, result_reason, approved_dates):
+        try:
+            job = None
+            if self.submit_rpc:
+                try:
+                    job = self.supabase.rpc("submit_approval_job", {
+                        "p_request_id": request_id,
+                        "p_result_reason": result_reason,
+                        "p_approved_dates": approved_dates or []
+                    }).execute().data
+                except APIError as e:
+                    if e.code == "P0002":
+                        return {"error": "Request not found"}, 404
+                    if e.code == NOT_PENDING_CODE:
+                        return {"error": e.message}, 409
+                    if e.code not in MISSING_FUNCTION_CODES:
+                        raise
+                    current_app.logger.warning("Database function submit_approval_job is not installed, using the Python path")
+                    self.submit_rpc = False
+            if job is None:
+                job, error = self._submit_python(request_id, result_reason, approved_dates)
+                if error is not None:
+                    return error
+
+            try:
+                self.dispatch(job["job_id"])
+            except Exception as e:
+                # The job is saved, so the next poll of /jobs/<job_id> or a sweep starts it once it is stale
+                current_app.logger.error("Failed to start approval job %s: %s", job["job_id"], str(e))
+            return self._accepted(job)
+        except Exception as e:
+            current_app.logger.error("Failed to queue approval of request %s: %s", request_id, str(e))
+            return {"error": str(e)}, 500
+
+    def _submit_python(self, request_id, result_reason, approved_dates):
+        # Only a pending request can be approved, and only once
+        response = self.supabase.from_("request").update({
+            "status": 1,  # Approved status
+            "result_reason": result_reason
+        }).eq("request_id", request_id).eq("status", 0).execute()
+        if not response.data:
+            existing = self.supabase.from_("request").select("request_id").eq("request_id", request_id).execute()
+            if not existing.data:
+                return None, ({"error": "Request not found"}, 404)
+            return None, ({"error": f"Request {request_id} is not pending"}, 409)
+
+        try:
+            job = self.supabase.from_("approval_job").insert({
+                "request_id": int(request_id),
+                "approved_dates": approved_dates or []
+            }).execute().data[0]
+        except Exception:
+            # Without a job nothing would write the schedule, so the request goes back to pending
+            self.supabase.from_("request").update({"status": 0, "result_reason": None}).eq("request_id", request_id).eq("status", 1).execute()
+            raise
+        return job, None
+
+    #writes the schedule rows for a queued job. A job that ran before (failed, or lost part way) first removes
+    #what that run wrote, so it can be run again; a failed run removes its own rows too.
+    def run(self, job_id):
+        try:
+            jobs = self.supabase.from_("approval_job").select("*").eq("job_id", job_id).execute().data
+            if not jobs or jobs[0]["status"] == "done":
+                return
+            job = jobs[0]
+            # Claimed against the row as read, so a second dispatch of the same job does nothing
+            claimed = self._update_job(job_id, {"status": "running", "attempts": job["attempts"] + 1}).eq("updated_at", job["updated_at"]).execute()
+            if not claimed.data:
+                return
+            if job["attempts"]:
+                self.request_service.discard_schedule([job["request_id"]])
+
+            requests = self.supabase.from_("request").select("*").eq("request_id", job["request_id"]).execute().data
+            if not requests:
+                self._update_job(job_id, {"status": "failed", "error": "Request not found"}).execute()
+                return
+            written = self.request_service.write_schedule(requests[0], job["approved_dates"])
+            if written["failed_chunks"]:
+                self.request_service.discard_schedule([job["request_id"]])
+
+            self._update_job(job_id, {
+                "status": "failed" if written["failed_chunks"] else "done",
+                "rows_written": 0 if written["failed_chunks"] else written["rows_written"],
+                "rows_skipped": written["rows_skipped"],
+                "failed_chunks": written["failed_chunks"] or None,
+                "error": None
+            }).execute()
+            if self.change_version is not None and not written["failed_chunks"] and (written["rows_written"] or "rule_id" in written):
+                self.change_version.bump()
+        except Exception as e:
+            current_app.logger.error("Approval job %s failed: %s", job_id, str(e))
+            self._update_job(job_id, {"status": "failed", "error": str(e)}).execute()
+
+    #puts a failed or stale job back in the queue and starts it; False if another caller got there first
+    def _requeue(self, job):
+        response = self._update_job(job["job_id"], {"status": "queued", "error": None}).eq("status", job["status"]).eq("updated_at", job["updated_at"]).execute()
+        if not response.data:
+            return False
+        self.dispatch(job["job_id"])
+        return True
+
+    def get_job(self, job_id):
+        try:
+            response = self.supabase.from_("approval_job").select(JOB_FIELDS).eq("job_id", job_id).execute()
+            if not response.data:
+                return {"error": "Job not found"}, 404
+            job = response.data[0]
+            # The UI polls while a job is queued or running, so a lost job is picked up again from here
+            if self._is_stale(job) and self._requeue(job):
+                job = {**job, "status": "queued"}
+            return job, 200
+        except Exception as e:
+            return {"error": str(e)}, 500
+
+    #runs a failed (or stale) job again; ({job_id, status_url}, 202)
+    def retry(self, job_id):
+        try:
+            response = self.supabase.from_("approval_job").select(JOB_FIELDS).eq("job_id", job_id).execute()
+            if not response.data:
+                return {"error": "Job not found"}, 404
+            job = response.data[0]
+            if job["status"] != "failed" and not self._is_stale(job):
+                return {"error": f"Job is {job['status']}"}, 409
+            if not self._requeue(job):
+                return {"error": "Job was picked up by another request"}, 409
+            return self._accepted(job)
+        except Exception as e:
+            current_app.logger.error("Failed to retry approval job %s: %s", job_id, str(e))
+            return {"error": str(e)}, 500
+
+    #requeues every stale job, and every failed one when include_failed is set; returns how many were started
+    def sweep(self, include_failed=False):
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=APPROVAL_JOB_STALE_SECONDS)).isoformat()
+        jobs = self.supabase.from_("approval_job").select(JOB_FIELDS).in_("status", ["queued", "running"]).lte("updated_at", cutoff).execute().data
+        if include_failed:
+            jobs += self.supabase.from_("approval_job").select(JOB_FIELDS).eq("status", "failed").execute().data
+        return sum(self._requeue(job) for job in jobs)
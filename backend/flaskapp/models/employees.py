@@ -2,8 +2,9 @@ from flask import jsonify, request
 
 
 class EmployeesService:
-    def __init__(self, supabase_client):
+    def __init__(self, supabase_client, org_chart=None):
         self.supabase = supabase_client
+        self.org_chart = org_chart
 
     def get_all_employees(self):
         response = self.supabase.from_('Employee').select("*").execute()
@@ -11,6 +12,9 @@ class EmployeesService:
 
     def update_employee(self, employee_id, form_data):
         response = self.supabase.from_('Employee').update(form_data).eq('Staff_ID', employee_id).execute()
+        # Names, departments and reporting lines may have changed
+        if self.org_chart is not None:
+            self.org_chart.invalidate()
         return response
 
     def get_staff_id_from_headers(self, staff_id):
@@ -0,0 +1,65 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_EXCEPTION
+from dotenv import load_dotenv
+load_dotenv()
+
+# Upper bound on concurrent Supabase round trips issued by one process
+SERVICE_POOL_WORKERS = int(os.environ.get("SERVICE_POOL_WORKERS", 8))
+# Seconds to wait for a fan-out before giving up with a TimeoutError. The timeout only frees the
+# caller: calls still queued are cancelled, but a call already running cannot be stopped and keeps
+# its worker until its query returns (bounded by the Supabase client's own request timeout), so
+# SERVICE_POOL_WORKERS should leave room for a few slow queries besides the widest fan-out.
+SERVICE_POOL_TIMEOUT = float(os.environ.get("SERVICE_POOL_TIMEOUT", 10))
+
+_executor = None
+_executor_lock = threading.Lock()
+_worker = threading.local()
+
+
+def executor():
+    # Created on first use so importing the services does not start threads
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=SERVICE_POOL_WORKERS, thread_name_prefix="service-pool")
+        return _executor
+
+
+def _run_in_context(context, call):
+    # Each call runs in a copy of the caller's context so current_app and request keep working
+    _worker.active = True
+    try:
+        return context.run(call)
+    finally:
+        _worker.active = False
+
+
+#runs the zero-argument callables concurrently (on pool, the shared service pool by default) and returns
+#their results in order. The first exception raised by any call is re-raised here; TimeoutError if they do not
+#all finish within timeout, in which case calls that already started keep running on the pool in the background.
+def fan_out(*calls, timeout=None, pool=None):
+    timeout = SERVICE_POOL_TIMEOUT if timeout is None else timeout
+    # A call already running on the pool runs nested fan-outs inline rather than waiting on its own workers
+    if len(calls) < 2 or getattr(_worker, "active", False):
+        return [call() for call in calls]
+
+    pool = pool or executor()
+    futures = [pool.submit(_run_in_context, contextvars.copy_context(), call) for call in calls]
+    done, pending = wait(futures, timeout=timeout, return_when=FIRST_EXCEPTION)
+    for future in futures:
+        if future in done and future.exception() is not None:
+            for other in pending:
+                other.cancel()
+            raise future.exception()
+    if pending:
+        for future in pending:
+            future.cancel()
+        raise TimeoutError(f"{len(pending)} of {len(calls)} queries did not finish within {timeout}s")
+    return [future.result() for future in futures]
+
+
+#fan_out of fn over items, results in item order
+def fan_out_map(fn, items, timeout=None):
+    return fan_out(*[lambda item=item: fn(item) for item in items], timeout=timeout)
@@ -1,10 +1,72 @@
+import logging
 import requests
 import os
+import threading
+import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from dotenv import load_dotenv
 load_dotenv()
 
 sns_url = os.environ.get("SNS_URL")
 topic = os.environ.get("TOPIC")
+# Seconds to connect to / wait for SNS on each publish
+SNS_CONNECT_TIMEOUT = float(os.environ.get("SNS_CONNECT_TIMEOUT", 3.05))
+SNS_READ_TIMEOUT = float(os.environ.get("SNS_READ_TIMEOUT", 10))
+# Kept-alive connections to SNS, enough for every service pool worker to publish at once
+SNS_POOL_SIZE = int(os.environ.get("SNS_POOL_SIZE", os.environ.get("SERVICE_POOL_WORKERS", 8)))
+# Retries of publishes SNS never accepted: failed connects, and 429 / 503 answers
+SNS_RETRIES = int(os.environ.get("SNS_RETRIES", 3))
+
+logger = logging.getLogger(__name__)
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def sns_session():
+    # One pooled keep-alive session per process, so warm instances skip the TCP and TLS handshake.
+    # A publish that may have reached SNS (read timeout, 5xx after sending) is not retried, since
+    # that could email twice.
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(total=SNS_RETRIES, connect=SNS_RETRIES, read=0, status=SNS_RETRIES, other=0,
+                          status_forcelist=(429, 503), allowed_methods=frozenset({"POST"}),
+                          backoff_factor=0.3, raise_on_status=False)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=SNS_POOL_SIZE, max_retries=retry)
+            _session = requests.Session()
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+class SendStats:
+    # Per-process SNS publish counts and latency, also logged per publish for CloudWatch
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.sent = 0
+        self.failed = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms, ok):
+        with self._lock:
+            if ok:
+                self.sent += 1
+            else:
+                self.failed += 1
+            self.total_ms += elapsed_ms
+            self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def snapshot(self):
+        with self._lock:
+            count = self.sent + self.failed
+            return {"sent": self.sent, "failed": self.failed,
+                    "avg_ms": round(self.total_ms / count, 1) if count else 0.0, "max_ms": round(self.max_ms, 1)}
+
+
+send_stats = SendStats()
 
 class supabase_access:
     def __init__(self,supabase):
@@ -34,6 +96,11 @@ class supabase_access:
         selected_request = request_response.data[0]
         return selected_request, 200
 
+    #get staff data for many staff in one query, keyed by Staff_ID
+    def get_staff_data_many(self, staffids):
+        employee_response = self.supabase.from_("Employee").select("*").in_("Staff_ID", list(staffids)).execute()
+        return {employee["Staff_ID"]: employee for employee in employee_response.data}
+
     #get manager data
     def get_manager_data(self, managerid):
         manager_response = self.supabase.from_("Employee").select("*").eq("Staff_ID", managerid).execute()
@@ -88,13 +155,34 @@ class notification_engine:
         email += f"Hi {staffname}, your request (ID: {selected_request["request_id"]}) from {selected_request["startdate"]} to {selected_request["enddate"]} has been rejected."
         return email, 200
 
-    def compose_create(self):
+    #compose one email covering a batch of approvals and rejections; items carry decision and data (request_id, staff_id, startdate, enddate)
+    def compose_decisions(self, items):
+        if not items:
+            return "No decisions to send", 500
+        employees = self.supabase_caller.get_staff_data_many({item["data"]["staff_id"] for item in items})
+
+        lines = []
+        for item in items:
+            data = item["data"]
+            employee = employees.get(data["staff_id"])
+            if employee is None:
+                continue
+            staffname = employee["Staff_FName"] + " " + employee["Staff_LName"]
+            outcome = "has been partially or fully approved. Please check your schedule for details." if item["decision"] == "approve" else "has been rejected."
+            lines.append(f"Hi {staffname}, your request (ID: {data["request_id"]}) from {data["startdate"]} to {data["enddate"]} {outcome}")
+        if not lines:
+            return "Error fetching staff", 500
+        return "\n\n".join(lines), 200
+
+    #selected_request is the row create_request inserted; without it the latest request is looked up
+    def compose_create(self, selected_request=None):
         email = ""
 
         #get request data
-        selected_request, status = self.supabase_caller.get_latest_req()
-        if int(status) != 200:
-            return "Error fetching request", 500
+        if selected_request is None:
+            selected_request, status = self.supabase_caller.get_latest_req()
+            if int(status) != 200:
+                return "Error fetching request", 500
         
         #get staff data
         staffid = selected_request["staff_id"]
@@ -163,85 +251,108 @@ class notification_engine:
             email += f"Hi {managername}, {staffname} has withdrawn a request (ID: {data["request_id"]}) from {data["startdate"]} to {data["enddate"]}. Please check requests for details."
             return email, 200
     
+    #one email per manager for a burst of create / cancel / withdraw notifications, built from the queued rows
+    #with one lookup for the staff and one for their managers; returns [(indices of the items covered, (email, status))]
+    def compose_digest(self, kind, items):
+        verbs = {"create": "sent", "cancel": "cancelled", "withdraw": "withdrawn"}
+        if kind not in verbs or not items:
+            return []
+        employees = self.supabase_caller.get_staff_data_many({item["staff_id"] for item in items})
+        managers = self.supabase_caller.get_staff_data_many({employee["Reporting_Manager"] for employee in employees.values()})
+
+        by_manager = {}
+        for index, item in enumerate(items):
+            employee = employees.get(item["staff_id"])
+            if employee is None or employee["Reporting_Manager"] not in managers:
+                continue
+            by_manager.setdefault(employee["Reporting_Manager"], []).append(index)
+
+        digests = []
+        for managerid, indices in by_manager.items():
+            manager = managers[managerid]
+            managername = manager["Staff_FName"] + " " + manager["Staff_LName"]
+            lines = []
+            for index in indices:
+                item = items[index]
+                employee = employees[item["staff_id"]]
+                staffname = employee["Staff_FName"] + " " + employee["Staff_LName"]
+                lines.append(f"- {staffname} has {verbs[kind]} a request (ID: {item["request_id"]}) from {item["startdate"]} to {item["enddate"]}.")
+            email = f"Hi {managername}, {len(indices)} request(s) were {verbs[kind]} since the last update:\n" + "\n".join(lines) + "\nPlease check requests for details."
+            digests.append((indices, (email, 200)))
+        return digests
+    
 class notification_sender:
     def __init__(self, notif_engine):
         self.notif_engine = notif_engine
-    
-    def send_approve(self, request_id):
-        email, status = self.notif_engine.compose_approve(request_id)
-        if int(status) == 500:
-            return email
+
+    #publishes email to the topic; 200, or "Email failed to send"
+    def publish(self, email):
         data = {
             "TopicArn": topic,
             "Message": email
         }
-        response = requests.post(sns_url, 
-                      data=data
-                     )
-        if response.status_code != 200:
+        started = time.perf_counter()
+        try:
+            response = sns_session().post(sns_url, data=data, timeout=(SNS_CONNECT_TIMEOUT, SNS_READ_TIMEOUT))
+            status_code = response.status_code
+        except requests.RequestException as e:
+            logger.error("SNS publish failed: %s", str(e))
+            status_code = None
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        send_stats.record(elapsed_ms, status_code == 200)
+        logger.info("SNS publish returned %s in %.1f ms", status_code, elapsed_ms)
+        if status_code != 200:
             return "Email failed to send"
-        return response.status_code
+        return status_code
+    
+    def send_approve(self, request_id):
+        email, status = self.notif_engine.compose_approve(request_id)
+        if int(status) == 500:
+            return email
+        return self.publish(email)
 
     
     def send_reject(self, request_id):
         email, status = self.notif_engine.compose_reject(request_id)
         if int(status) == 500:
             return email
-        data = {
-            "TopicArn": topic,
-            "Message": email
-        }
-        response = requests.post(sns_url, 
-                      data=data
-                     )
-        if response.status_code != 200:
-            return "Email failed to send"
-        return response.status_code
+        return self.publish(email)
     
-    def send_create(self):
-        email, status = self.notif_engine.compose_create()
+    def send_create(self, selected_request=None):
+        email, status = self.notif_engine.compose_create(selected_request)
         if int(status) == 500:
             return email
-        data = {
-            "TopicArn": topic,
-            "Message": email
-        }
-        response = requests.post(sns_url, 
-                      data=data
-                     )
-        if response.status_code != 200:
-            return "Email failed to send"
-        return response.status_code
+        return self.publish(email)
+
+    #one SNS message for a whole batch of decisions instead of one per request
+    def send_decisions(self, items):
+        email, status = self.notif_engine.compose_decisions(items)
+        if int(status) == 500:
+            return email
+        return self.publish(email)
 
     def send_withdraw(self, data):
         email, status = self.notif_engine.compose_withdraw(data)
         if int(status) == 500:
             return email
-        data = {
-            "TopicArn": topic,
-            "Message": email
-        }
-        response = requests.post(sns_url, 
-                      data=data
-                     )
-        if response.status_code != 200:
-            return "Email failed to send"
-        return response.status_code
+        return self.publish(email)
     
     def send_cancel(self, data):
         email, status = self.notif_engine.compose_cancel(data)
         if int(status) == 500:
             return email
-        data = {
-            "TopicArn": topic,
-            "Message": email
-        }
-        response = requests.post(sns_url, 
-                      data=data
-                     )
-        if response.status_code != 200:
-            return "Email failed to send"
-        return response.status_code
+        return self.publish(email)
 
         
 
+    #one SNS message per manager for queued items of one kind; returns [(indices of the items, result)]
+    def send_digest(self, kind, items):
+        results = []
+        covered = set()
+        for indices, (email, status) in self.notif_engine.compose_digest(kind, items):
+            results.append((indices, email if int(status) == 500 else self.publish(email)))
+            covered.update(indices)
+        missing = [index for index in range(len(items)) if index not in covered]
+        if missing:
+            results.append((missing, "Error fetching staff"))
+        return results
@@ -0,0 +1,65 @@
+class OccupancySummaryService:
+    # WFH counts per (dept, reporting_manager, date, time_slot), kept in step with the schedule table.
+    # Writes go through the bump_occupancy / rebuild_occupancy_summary functions in
+    # supabase/migrations so concurrent approvals and cancellations add up correctly.
+    # Counts are filed under the team an employee is in at write time; the employee_team_change
+    # trigger rebuilds the table when someone changes team. Python-path writes look the team up
+    # through org_chart, so one landing within ORG_CHART_TTL of a move can still use the old team
+    # until the next rebuild (flask occupancy-rebuild).
+    def __init__(self, supabase, org_chart=None):
+        self.supabase = supabase
+        self.org_chart = org_chart
+
+    def _team_of(self, staff_id):
+        if self.org_chart is not None:
+            employee = self.org_chart.get(staff_id)
+        else:
+            response = self.supabase.from_('Employee').select('Dept, Reporting_Manager').eq('Staff_ID', staff_id).execute()
+            employee = response.data[0] if response.data else None
+        if not employee:
+            return None
+        return employee["Dept"], employee["Reporting_Manager"]
+
+    #slots is an iterable of (date, time_slot) pairs belonging to staff_id; sign is 1 or -1
+    def _bump(self, staff_id, slots, sign):
+        team = self._team_of(staff_id)
+        if team is None:
+            return None
+        deltas = {}
+        for date, time_slot in slots:
+            deltas[(date, int(time_slot))] = deltas.get((date, int(time_slot)), 0) + sign
+        if not deltas:
+            return None
+        dept, reporting_manager = team
+        return self.supabase.rpc("bump_occupancy", {"deltas": [
+            {"dept": dept, "reporting_manager": reporting_manager, "date": date, "time_slot": time_slot, "delta": delta}
+            for (date, time_slot), delta in deltas.items()
+        ]}).execute()
+
+    def record_added(self, staff_id, slots):
+        return self._bump(staff_id, slots, 1)
+
+    def record_removed(self, staff_id, slots):
+        return self._bump(staff_id, slots, -1)
+
+    #regenerates the whole table from schedule rows, returns the number of summary rows written
+    def rebuild(self):
+        return self.supabase.rpc("rebuild_occupancy_summary", {}).execute().data
+
+    #WFH counts per (date, time_slot) summed over the matching teams, ordered by date then slot
+    def get_counts(self, dept=None, reporting_manager=None, start=None, end=None):
+        query = self.supabase.from_('occupancy_summary').select('date, time_slot, wfh_count').gt('wfh_count', 0)
+        if dept is not None:
+            query = query.eq('dept', dept)
+        if reporting_manager is not None:
+            query = query.eq('reporting_manager', reporting_manager)
+        if start:
+            query = query.gte('date', start)
+        if end:
+            query = query.lte('date', end)
+
+        counts = {}
+        for row in query.execute().data:
+            key = (row["date"], row["time_slot"])
+            counts[key] = counts.get(key, 0) + row["wfh_count"]
+        return [{"date": date, "time_slot": time_slot, "count": count} for (date, time_slot), count in sorted(counts.items())]
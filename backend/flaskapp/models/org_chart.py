@@ -0,0 +1,79 @@
+import os
+import threading
+import time
+from dotenv import load_dotenv
+load_dotenv()
+
+ORG_CHART_TTL = int(os.environ.get("ORG_CHART_TTL", 300))
+
+
+def _as_id(staff_id):
+    # Staff IDs arrive as ints from the database and as strings from headers and query args
+    try:
+        return int(staff_id)
+    except (TypeError, ValueError):
+        return None
+
+
+class CachedResponse:
+    # Stands in for a supabase APIResponse so callers can keep reading .data
+    def __init__(self, data):
+        self.data = data
+
+
+class OrgChartCache:
+    # Process-level copy of the Employee hierarchy, loaded lazily and refreshed after ttl seconds
+    def __init__(self, supabase, ttl=ORG_CHART_TTL):
+        self.supabase = supabase
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        # (employees, by_id, reports), replaced as a whole on reload so readers never see a partial one
+        self._snapshot = None
+        self._loaded_at = None
+
+    def _load(self):
+        response = self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position, Reporting_Manager, Role').execute()
+        employees = list(response.data)
+        by_id = {}
+        reports = {}
+        for employee in employees:
+            by_id[employee["Staff_ID"]] = employee
+            reports.setdefault(employee["Reporting_Manager"], []).append(employee)
+        self._snapshot = (employees, by_id, reports)
+        self._loaded_at = time.monotonic()
+
+    #the current (employees, by_id, reports), reloaded first when expired; callers read only from what it returns
+    def _ensure_loaded(self):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+                self._load()
+            return self._snapshot
+
+    #call after writes to the Employee table so the next read reloads
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    def employees(self):
+        employees, _, _ = self._ensure_loaded()
+        return employees
+
+    def get(self, staff_id):
+        _, by_id, _ = self._ensure_loaded()
+        return by_id.get(_as_id(staff_id))
+
+    def ceo_id(self):
+        for employee in self.employees():
+            if employee["Position"] == "MD":
+                return int(employee["Staff_ID"])
+        raise LookupError("No employee with position MD")
+
+    def direct_reports(self, manager_id):
+        _, _, reports = self._ensure_loaded()
+        return list(reports.get(_as_id(manager_id), []))
+
+    def dept_roster(self, dept):
+        return [employee for employee in self.employees() if employee["Dept"] == dept]
+
+    def position_roster(self, position):
+        return [employee for employee in self.employees() if employee["Position"] == position]
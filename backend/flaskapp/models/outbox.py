@@ -0,0 +1,286 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from datetime import datetime, timedelta, timezone
+from flask import current_app
+from postgrest.exceptions import APIError
+from dotenv import load_dotenv
+from .fanout import fan_out
+load_dotenv()
+
+# Where queued notifications are kept: "" sends them inline as before, "sqlite" (single dev server)
+# or "supabase" (shared by every Lambda instance)
+NOTIFICATION_OUTBOX = os.environ.get("NOTIFICATION_OUTBOX", "").lower()
+NOTIFICATION_OUTBOX_PATH = os.environ.get("NOTIFICATION_OUTBOX_PATH", "notification_outbox.sqlite3")
+# Notifications sent per drain and at once
+NOTIFY_BATCH_SIZE = int(os.environ.get("NOTIFY_BATCH_SIZE", 50))
+# Attempts before a notification is marked failed; retry n waits NOTIFY_BACKOFF_SECONDS * 2 ** (n - 1)
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", 5))
+NOTIFY_BACKOFF_SECONDS = float(os.environ.get("NOTIFY_BACKOFF_SECONDS", 30))
+# A claimed notification not finished within this many seconds (e.g. the dispatcher died) is claimed again
+NOTIFY_CLAIM_TIMEOUT = float(os.environ.get("NOTIFY_CLAIM_TIMEOUT", 300))
+# Seconds to wait for one drain's sends, and between drains of the dev server thread
+NOTIFY_DRAIN_TIMEOUT = float(os.environ.get("NOTIFY_DRAIN_TIMEOUT", 60))
+NOTIFY_INTERVAL = float(os.environ.get("NOTIFY_INTERVAL", 5))
+# Concurrent sends per drain, on a pool of their own so slow SNS calls never hold the service pool's workers
+NOTIFY_WORKERS = int(os.environ.get("NOTIFY_WORKERS", 8))
+# The notification_sender methods an outbox row can be delivered with
+NOTIFICATION_KINDS = ("approve", "reject", "create", "decisions", "withdraw", "cancel")
+# Digest mode: manager-bound notifications queued within the same window of this many seconds (aligned to
+# the epoch, so 86400 is one digest a day at 00:00 UTC) go out together as one message per manager; 0 is off
+NOTIFY_DIGEST_WINDOW = int(os.environ.get("NOTIFY_DIGEST_WINDOW", 0))
+# The kinds sent to the requester's manager, which digest mode coalesces
+DIGEST_KINDS = ("create", "withdraw", "cancel")
+
+
+_send_executor = None
+_send_executor_lock = threading.Lock()
+
+
+def send_executor():
+    # Created on first drain, like the service pool
+    global _send_executor
+    with _send_executor_lock:
+        if _send_executor is None:
+            _send_executor = ThreadPoolExecutor(max_workers=NOTIFY_WORKERS, thread_name_prefix="notification-sender")
+        return _send_executor
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+def _window_end(now, window):
+    # Everything queued in one window shares a due time, so a single drain claims the whole burst
+    epoch = now.timestamp()
+    return datetime.fromtimestamp(epoch - epoch % window + window, timezone.utc)
+
+
+class SupabaseOutboxStore:
+    # notification_outbox table (supabase/migrations); rows are claimed with claim_notifications,
+    # which skips rows another dispatcher has locked
+    def __init__(self, supabase):
+        self.supabase = supabase
+        self.claim_rpc = True
+
+    def add(self, kind, payload, due=None):
+        row = {"kind": kind, "payload": payload}
+        if due is not None:
+            row["next_attempt_at"] = due.isoformat()
+        return self.supabase.from_("notification_outbox").insert(row).execute().data[0]["id"]
+
+    def claim(self, limit):
+        if self.claim_rpc:
+            try:
+                return self.supabase.rpc("claim_notifications", {"p_limit": limit, "p_claim_timeout": NOTIFY_CLAIM_TIMEOUT}).execute().data
+            except APIError as e:
+                if e.code not in ("PGRST202", "42883"):
+                    raise
+                current_app.logger.warning("Database function claim_notifications is not installed, claiming without row locks")
+                self.claim_rpc = False
+        now = _now()
+        stale = now - timedelta(seconds=NOTIFY_CLAIM_TIMEOUT)
+        # Due rows, and rows whose dispatcher did not finish them within NOTIFY_CLAIM_TIMEOUT
+        rows = self.supabase.from_("notification_outbox").select("*").or_(
+            f'and(status.eq.pending,next_attempt_at.lte."{now.isoformat()}"),'
+            f'and(status.eq.sending,claimed_at.lte."{stale.isoformat()}")').order("id").limit(limit).execute().data
+        if rows:
+            self.supabase.from_("notification_outbox").update({"status": "sending", "claimed_at": now.isoformat()}).in_("id", [row["id"] for row in rows]).execute()
+        return [{**row, "attempts": row["attempts"] + 1} for row in rows]
+
+    def finish(self, outbox_id, fields):
+        self.supabase.from_("notification_outbox").update(fields).eq("id", outbox_id).execute()
+
+
+class SqliteOutboxStore:
+    # Local file for a single dev server; every call opens its own connection so any thread can use it
+    def __init__(self, path=NOTIFICATION_OUTBOX_PATH):
+        self.path = path
+        with self._connect() as connection:
+            connection.execute("""
+                create table if not exists notification_outbox (
+                    id integer primary key autoincrement,
+                    kind text not null,
+                    payload text not null,
+                    status text not null default 'pending',
+                    attempts integer not null default 0,
+                    next_attempt_at text not null,
+                    claimed_at text,
+                    last_error text,
+                    sent_at text
+                )""")
+
+    def _connect(self):
+        # Autocommit, so each statement outside an explicit transaction stands on its own
+        return closing(sqlite3.connect(self.path, timeout=30, isolation_level=None))
+
+    def add(self, kind, payload, due=None):
+        with self._connect() as connection:
+            return connection.execute("insert into notification_outbox (kind, payload, next_attempt_at) values (?, ?, ?)",
+                                      (kind, json.dumps(payload), (due or _now()).isoformat())).lastrowid
+
+    def claim(self, limit):
+        now = _now()
+        stale = (now - timedelta(seconds=NOTIFY_CLAIM_TIMEOUT)).isoformat()
+        with self._connect() as connection:
+            # The write lock is taken up front so two dispatchers cannot claim the same rows
+            connection.execute("begin immediate")
+            try:
+                rows = connection.execute("""
+                    select id, kind, payload, attempts from notification_outbox
+                    where (status = 'pending' and next_attempt_at <= ?) or (status = 'sending' and claimed_at <= ?)
+                    order by id limit ?""", (now.isoformat(), stale, limit)).fetchall()
+                connection.executemany("update notification_outbox set status = 'sending', claimed_at = ?, attempts = attempts + 1 where id = ?",
+                                       [(now.isoformat(), row[0]) for row in rows])
+                connection.execute("commit")
+            except Exception:
+                connection.execute("rollback")
+                raise
+        return [{"id": row[0], "kind": row[1], "payload": json.loads(row[2]), "attempts": row[3] + 1} for row in rows]
+
+    def finish(self, outbox_id, fields):
+        with self._connect() as connection:
+            connection.execute(f"update notification_outbox set {', '.join(f'{name} = ?' for name in fields)} where id = ?",
+                               (*fields.values(), outbox_id))
+
+    #rows with a status, for inspection in tests and from the shell
+    def rows(self, status=None):
+        with self._connect() as connection:
+            connection.row_factory = sqlite3.Row
+            query = "select * from notification_outbox" + (" where status = ?" if status else "") + " order by id"
+            return [dict(row) for row in connection.execute(query, (status,) if status else ())]
+
+
+class NotificationOutbox:
+    # Stands in for notification_sender in the routes: each send_* records the notification and returns
+    # "queued" instead of calling SNS, and drain() later delivers queued notifications through the real
+    # sender with retries and exponential backoff. The routes write the record right after their own
+    # change, not in the same transaction, so a crash between the two can still lose a notification.
+    def __init__(self, store, sender, digest_window=NOTIFY_DIGEST_WINDOW):
+        self.store = store
+        self.sender = sender
+        self.digest_window = digest_window
+
+    def _digested(self, row):
+        return self.digest_window > 0 and row["kind"] in DIGEST_KINDS and isinstance(row["payload"], dict)
+
+    def enqueue(self, kind, payload):
+        try:
+            due = None
+            if self._digested({"kind": kind, "payload": payload}):
+                due = _window_end(_now(), self.digest_window)
+            self.store.add(kind, payload, due)
+            return "queued"
+        except Exception as e:
+            # Better late than never: without the outbox the notification is sent inline as before
+            current_app.logger.error("Failed to queue %s notification, sending it now: %s", kind, str(e))
+            return getattr(self.sender, "send_" + kind)(payload)
+
+    def send_approve(self, request_id):
+        return self.enqueue("approve", request_id)
+
+    def send_reject(self, request_id):
+        return self.enqueue("reject", request_id)
+
+    def send_create(self, selected_request=None):
+        return self.enqueue("create", selected_request)
+
+    def send_decisions(self, items):
+        return self.enqueue("decisions", items)
+
+    def send_withdraw(self, data):
+        return self.enqueue("withdraw", data)
+
+    def send_cancel(self, data):
+        return self.enqueue("cancel", data)
+
+    def _deliver(self, row):
+        try:
+            if row["kind"] not in NOTIFICATION_KINDS:
+                raise ValueError(f"Unknown notification kind {row['kind']}")
+            result = getattr(self.sender, "send_" + row["kind"])(row["payload"])
+            error = None if result == 200 else str(result)
+        except Exception as e:
+            error = str(e)
+        return [self._finish(row, error)]
+
+    #one send_digest for rows of one kind; each row is finished with the outcome of its manager's message
+    def _deliver_digest(self, rows):
+        try:
+            results = self.sender.send_digest(rows[0]["kind"], [row["payload"] for row in rows])
+        except Exception as e:
+            results = [(list(range(len(rows))), str(e))]
+        return [self._finish(rows[i], None if result == 200 else str(result)) for indices, result in results for i in indices]
+
+    def _finish(self, row, error):
+        if error is None:
+            self.store.finish(row["id"], {"status": "sent", "attempts": row["attempts"], "sent_at": _now().isoformat(), "last_error": None})
+            return True
+        if row["attempts"] >= NOTIFY_MAX_ATTEMPTS:
+            current_app.logger.error("Giving up on notification %s after %d attempts: %s", row["id"], row["attempts"], error)
+            self.store.finish(row["id"], {"status": "failed", "attempts": row["attempts"], "last_error": error})
+        else:
+            delay = NOTIFY_BACKOFF_SECONDS * 2 ** (row["attempts"] - 1)
+            self.store.finish(row["id"], {"status": "pending", "attempts": row["attempts"], "last_error": error,
+                                          "next_attempt_at": (_now() + timedelta(seconds=delay)).isoformat()})
+        return False
+
+    #delivers due notifications until none are left (or max_batches batches); returns (sent, not sent)
+    def drain(self, batch_size=None, max_batches=None):
+        sent = unsent = batches = 0
+        while max_batches is None or batches < max_batches:
+            rows = self.store.claim(batch_size or NOTIFY_BATCH_SIZE)
+            if not rows:
+                break
+            # Sends go out concurrently; a send that outlives the timeout is claimed again after NOTIFY_CLAIM_TIMEOUT
+            calls = [lambda row=row: self._deliver(row) for row in rows if not self._digested(row)]
+            digests = {}
+            for row in rows:
+                if self._digested(row):
+                    digests.setdefault(row["kind"], []).append(row)
+            calls += [lambda group=group: self._deliver_digest(group) for group in digests.values()]
+            delivered = [ok for results in fan_out(*calls, timeout=NOTIFY_DRAIN_TIMEOUT, pool=send_executor()) for ok in results]
+            sent += sum(delivered)
+            unsent += len(delivered) - sum(delivered)
+            batches += 1
+        return sent, unsent
+
+
+def outbox_store(supabase, mode=NOTIFICATION_OUTBOX):
+    if mode == "supabase":
+        return SupabaseOutboxStore(supabase)
+    if mode == "sqlite":
+        return SqliteOutboxStore()
+    raise ValueError(f"NOTIFICATION_OUTBOX must be sqlite or supabase, not {mode!r}")
+
+
+def start_dispatcher(app, outbox, interval=NOTIFY_INTERVAL):
+    # Background drain loop for the dev server; Lambda drains on a Zappa schedule instead (drain_scheduled)
+    def loop():
+        while True:
+            with app.app_context():
+                try:
+                    outbox.drain()
+                except Exception as e:
+                    app.logger.error("Notification drain failed: %s", str(e))
+            time.sleep(interval)
+    thread = threading.Thread(target=loop, name="notification-dispatcher", daemon=True)
+    thread.start()
+    return thread
+
+
+def drain_scheduled(event, context):
+    # Zappa scheduled event (zappa_settings.json), which fires every minute whether or not the outbox is on;
+    # without NOTIFICATION_OUTBOX it returns before loading the app, otherwise it loads it like any fresh Lambda invocation
+    if not NOTIFICATION_OUTBOX:
+        return None
+    from ..main import app
+    from ..blueprints.requests_routes import notification_outbox
+    if notification_outbox is None:
+        return None
+    with app.app_context():
+        return notification_outbox.drain()
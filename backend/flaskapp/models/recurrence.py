@@ -0,0 +1,101 @@
+import os
+from datetime import date, timedelta
+from dotenv import load_dotenv
+load_dotenv()
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional; expand_weekly falls back to per-weekday strides
+    np = None
+
+# Days after the earliest approved date that a recurring request repeats for
+RECURRING_HORIZON_DAYS = int(os.environ.get("RECURRING_HORIZON_DAYS", 365))
+# Store approved recurring requests as one schedule_rule row, expanded per date window on read
+RECURRENCE_RULES = os.environ.get("RECURRENCE_RULES", "false").lower() == "true"
+
+
+def _parse(value):
+    return value if isinstance(value, date) else date.fromisoformat(value[:10])
+
+
+#every date from the earliest approved date to the end of the horizon (inclusive) falling on an
+#approved weekday, as sorted YYYY-MM-DD strings. end caps the horizon; holidays are left out.
+def expand_weekly(approved_dates, horizon_days=RECURRING_HORIZON_DAYS, end=None, holidays=(), engine=None):
+    starts = {_parse(value) for value in approved_dates}
+    if not starts:
+        return []
+    first = min(starts)
+    last = first + timedelta(days=horizon_days)
+    if end is not None:
+        last = min(last, _parse(end))
+    if last < first:
+        return []
+    return _expand(first, last, {start.weekday() for start in starts}, holidays, engine)
+
+
+#the schedule_rule fields for a recurring request approved on approved_dates: bit d of weekday_mask is
+#weekday d (Monday = 0), repeating from the earliest approved date to the end of the horizon
+def weekly_rule(approved_dates, horizon_days=RECURRING_HORIZON_DAYS, end=None):
+    starts = {_parse(value) for value in approved_dates}
+    if not starts:
+        return None
+    first = min(starts)
+    last = first + timedelta(days=horizon_days)
+    if end is not None:
+        last = min(last, _parse(end))
+    return {
+        "weekday_mask": sum(1 << weekday for weekday in {start.weekday() for start in starts}),
+        "startdate": first.isoformat(),
+        "enddate": last.isoformat(),
+        "exceptions": []
+    }
+
+
+#the dates of a schedule_rule row that fall within start..end (inclusive, either may be None),
+#as sorted YYYY-MM-DD strings; dates listed in the rule's exceptions are left out
+def expand_rule(rule, start=None, end=None, engine=None):
+    first = _parse(rule["startdate"])
+    last = _parse(rule["enddate"])
+    if start is not None:
+        first = max(first, _parse(start))
+    if end is not None:
+        last = min(last, _parse(end))
+    if last < first:
+        return []
+    weekdays = {weekday for weekday in range(7) if rule["weekday_mask"] >> weekday & 1}
+    return _expand(first, last, weekdays, rule.get("exceptions") or (), engine)
+
+
+#the schedule rows (staff_id, date, time_slot, request_id) a rule stands for within start..end;
+#a full-day rule (time_slot 3) gives an AM and a PM row per date
+def rule_rows(rule, start=None, end=None, engine=None):
+    slots = (1, 2) if int(rule["time_slot"]) == 3 else (int(rule["time_slot"]),)
+    return [{"staff_id": rule["staff_id"], "date": date, "time_slot": slot, "request_id": rule["request_id"]}
+            for date in expand_rule(rule, start, end, engine) for slot in slots]
+
+
+def _expand(first, last, weekdays, holidays, engine):
+    if not weekdays:
+        return []
+    holidays = {_parse(value) for value in holidays}
+
+    if engine is None:
+        engine = "numpy" if np is not None else "python"
+    if engine == "numpy":
+        return _expand_numpy(first, last, weekdays, holidays)
+    return _expand_python(first, last, weekdays, holidays)
+
+
+def _expand_numpy(first, last, weekdays, holidays):
+    # busday arithmetic with the approved weekdays as the week mask
+    weekmask = [weekday in weekdays for weekday in range(7)]
+    days = np.arange(np.datetime64(first), np.datetime64(last + timedelta(days=1)), dtype="datetime64[D]")
+    holidays = np.array(sorted(holidays), dtype="datetime64[D]")
+    return np.datetime_as_string(days[np.is_busday(days, weekmask=weekmask, holidays=holidays)]).tolist()
+
+
+def _expand_python(first, last, weekdays, holidays):
+    # One stride of 7 days per weekday, then merged back into date order
+    span = (last - first).days
+    offsets = sorted(offset for weekday in weekdays for offset in range((weekday - first.weekday()) % 7, span + 1, 7))
+    return [day.isoformat() for day in (first + timedelta(days=offset) for offset in offsets) if day not in holidays]
@@ -0,0 +1,122 @@
+import os
+import threading
+import time
+from bisect import bisect_right
+from dotenv import load_dotenv
+load_dotenv()
+
+REQUEST_INTERVALS_TTL = int(os.environ.get("REQUEST_INTERVALS_TTL", 300))
+# PostgREST caps each response, so the request table is read in pages of this size
+REQUEST_INTERVALS_PAGE_SIZE = 1000
+# Requests that still hold their dates: pending and approved
+ACTIVE_STATUSES = (0, 1)
+
+
+def _slots(time_slot):
+    # Full-day requests (3) cover both the AM (1) and PM (2) slots
+    time_slot = int(time_slot)
+    return {1, 2} if time_slot == 3 else {time_slot}
+
+
+class StaffIntervals:
+    # One staff member's active requests as (startdate, enddate, request_id, time_slot), sorted by startdate.
+    # max_end[i] is the latest enddate among the first i + 1 intervals, so an overlap query is a bisect
+    # on startdate followed by a walk back that stops as soon as nothing earlier can reach the new start.
+    def __init__(self):
+        self.starts = []
+        self.intervals = []
+        self.max_end = []
+
+    def _rebuild_max_end(self, start_at):
+        for i in range(start_at, len(self.intervals)):
+            end = self.intervals[i][1]
+            self.max_end[i] = max(end, self.max_end[i - 1]) if i else end
+
+    def add(self, interval):
+        i = bisect_right(self.starts, interval[0])
+        self.starts.insert(i, interval[0])
+        self.intervals.insert(i, interval)
+        self.max_end.insert(i, interval[1])
+        self._rebuild_max_end(i)
+
+    def remove(self, request_id):
+        for i, interval in enumerate(self.intervals):
+            if interval[2] == request_id:
+                del self.starts[i], self.intervals[i], self.max_end[i]
+                self._rebuild_max_end(i)
+                return True
+        return False
+
+    def overlapping(self, start, end, time_slot):
+        slots = _slots(time_slot)
+        found = []
+        i = bisect_right(self.starts, end) - 1
+        while i >= 0 and self.max_end[i] >= start:
+            interval = self.intervals[i]
+            if interval[1] >= start and _slots(interval[3]) & slots:
+                found.append(interval[2])
+            i -= 1
+        return sorted(found)
+
+
+class RequestIntervalIndex:
+    # In-process index of each staff member's pending and approved request date ranges, for rejecting
+    # overlapping requests at creation without reading their request history. Updated in place on
+    # create / reject / withdraw / cancel and reloaded after ttl seconds to pick up other instances' writes.
+    def __init__(self, supabase, ttl=REQUEST_INTERVALS_TTL):
+        self.supabase = supabase
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        self._staff = {}
+        self._owner = {}
+
+    def _load(self):
+        self._staff = {}
+        self._owner = {}
+        offset = 0
+        while True:
+            page = self.supabase.from_('request').select('request_id, staff_id, startdate, enddate, time_slot').in_('status', list(ACTIVE_STATUSES)).order('request_id').range(offset, offset + REQUEST_INTERVALS_PAGE_SIZE - 1).execute().data
+            for row in page:
+                self._add_row(row)
+            if len(page) < REQUEST_INTERVALS_PAGE_SIZE:
+                break
+            offset += REQUEST_INTERVALS_PAGE_SIZE
+        self._loaded_at = time.monotonic()
+
+    def _ensure_loaded(self):
+        if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+            self._load()
+
+    def _add_row(self, row):
+        request_id, staff_id = int(row["request_id"]), int(row["staff_id"])
+        if request_id in self._owner:
+            return
+        self._owner[request_id] = staff_id
+        self._staff.setdefault(staff_id, StaffIntervals()).add((row["startdate"][:10], row["enddate"][:10], request_id, int(row["time_slot"])))
+
+    #row is a request row (request_id, staff_id, startdate, enddate, time_slot) that is now pending or approved
+    def add(self, row):
+        with self._lock:
+            if self._loaded_at is not None:
+                self._add_row(row)
+
+    #the request no longer holds its dates (rejected, withdrawn or cancelled)
+    def remove(self, request_id):
+        with self._lock:
+            staff_id = self._owner.pop(int(request_id), None)
+            if staff_id is not None:
+                self._staff[staff_id].remove(int(request_id))
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_at = None
+
+    #request_ids of staff_id's active requests sharing a date and time slot with startdate..enddate (YYYY-MM-DD, inclusive)
+    def overlapping(self, staff_id, startdate, enddate, time_slot):
+        with self._lock:
+            self._ensure_loaded()
+            intervals = self._staff.get(int(staff_id))
+            if intervals is None:
+                return []
+            return intervals.overlapping(startdate[:10], enddate[:10], time_slot)
@@ -1,43 +1,145 @@
 from flask import request, abort, current_app
 from datetime import datetime, timedelta
+import os
+import time
+from dotenv import load_dotenv
+from postgrest.exceptions import APIError
+from .recurrence import RECURRING_HORIZON_DAYS, expand_weekly, rule_rows, weekly_rule
+load_dotenv()
+
+# Schedule rows per bulk insert when approving a request
+SCHEDULE_INSERT_CHUNK_SIZE = int(os.environ.get("SCHEDULE_INSERT_CHUNK_SIZE", 500))
+# Approve and reject through the approve_request / reject_request database functions
+APPROVAL_RPC = os.environ.get("APPROVAL_RPC", "true").lower() == "true"
+# PostgREST (schema cache) and Postgres codes for a database function that does not exist
+MISSING_FUNCTION_CODES = ("PGRST202", "42883")
+# ...and for a table or view that does not exist
+MISSING_RELATION_CODES = ("PGRST205", "42P01")
+# SQLSTATE the approve_request / reject_request functions raise for a request that is not pending
+NOT_PENDING_CODE = "PT409"
+# Approval queue through the manager_request_queue view instead of an in_() over direct reports
+TEAM_QUEUE_VIEW = os.environ.get("TEAM_QUEUE_VIEW", "true").lower() == "true"
+# Seconds a staff member's right to view team requests is cached for when there is no org chart cache,
+# and how many staff members are remembered at most
+TEAM_ACCESS_TTL = int(os.environ.get("TEAM_ACCESS_TTL", 300))
+TEAM_ACCESS_MAX = int(os.environ.get("TEAM_ACCESS_MAX", 1024))
+# Most decisions accepted by one bulk approve/reject call
+BULK_DECISIONS_MAX = int(os.environ.get("BULK_DECISIONS_MAX", 200))
+# What create_request does with a request overlapping the staff member's pending or approved ones: "reject" or "flag"
+REQUEST_OVERLAP = os.environ.get("REQUEST_OVERLAP", "reject")
+# Columns a request listing can be projected to with ?fields=
+REQUEST_FIELDS = ("request_id", "staff_id", "reason", "status", "startdate", "enddate", "time_slot", "request_type", "result_reason")
+# Largest page a listing will return
+REQUEST_PAGE_MAX = 200
+# PostgREST caps each response, so slots already held are read in pages of this size
+HELD_PAGE_SIZE = 1000
+
+
+def listing_options(args):
+    # Pagination, filters and projection for the request listings, from query args:
+    #   limit (page size; enables pagination), cursor (request_id to continue after),
+    #   status, start/end (YYYY-MM-DD; requests overlapping the range), fields (comma-separated)
+    # Raises ValueError on bad input; returns None when none are given so the listings keep their old shape.
+    if not any(key in args for key in ("limit", "cursor", "status", "start", "end", "fields")):
+        return None
+    options = {"limit": None, "cursor": None, "status": None, "start": None, "end": None, "fields": None}
+    if args.get("limit"):
+        options["limit"] = int(args["limit"])
+        if not 1 <= options["limit"] <= REQUEST_PAGE_MAX:
+            raise ValueError(f"limit must be between 1 and {REQUEST_PAGE_MAX}")
+    if args.get("cursor"):
+        options["cursor"] = int(args["cursor"])
+    if args.get("status"):
+        options["status"] = int(args["status"])
+    for bound in ("start", "end"):
+        if args.get(bound):
+            options[bound] = datetime.strptime(args[bound], "%Y-%m-%d").strftime("%Y-%m-%d")
+    if args.get("fields"):
+        fields = [field.strip() for field in args["fields"].split(",") if field.strip()]
+        unknown = [field for field in fields if field not in REQUEST_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        # request_id is the keyset, so it is always returned
+        options["fields"] = ["request_id"] + [field for field in fields if field != "request_id"]
+    return options
 
 class RequestService:
-    def __init__(self, supabase_client):
+    def __init__(self, supabase_client, org_chart=None, occupancy_summary=None, schedule_index=None, approval_rpc=False, team_queue_view=False, request_intervals=None, recurrence_rules=False):
         self.supabase = supabase_client
+        # Hierarchy lookups are served from the shared OrgChartCache when one is given
+        self.org_chart = org_chart
+        # Schedule writes are mirrored into the occupancy summary when one is given
+        self.occupancy_summary = occupancy_summary
+        # ...and into the in-process schedule index when one is given
+        self.schedule_index = schedule_index
+        # Approve, reject and cancel run as one database transaction each when set; turned off if the functions are missing
+        self.approval_rpc = approval_rpc
+        # The pending queue is one query on manager_request_queue when set; turned off if the view is missing
+        self.team_queue_view = team_queue_view
+        # staff_id -> (can view team requests: True / False / None when unknown, checked at), oldest first;
+        # only used without an org chart, which already holds the Role and Position
+        self._team_access = {}
+        # New requests are checked against the RequestIntervalIndex of active requests when one is given
+        self.request_intervals = request_intervals
+        # Approved recurring requests are stored as one schedule_rule row instead of a row per date when set
+        self.recurrence_rules = recurrence_rules
     
+    #the fields of a deleted request row returned to the routes for notifications
+    @staticmethod
+    def _deleted_request(row):
+        return {"request_id": row["request_id"], "staff_id": row["staff_id"], "startdate": row["startdate"], "enddate": row["enddate"]}
+
     def withdraw_request(self, request_id):
         try:
-            data = self.supabase.from_("request").select().eq("request_id", request_id).execute()
-            staff_id = data.data[0]['staff_id']
-            startdate = data.data[0]['startdate']
-            enddate = data.data[0]['enddate']
+            # The delete returns the removed row, so no read beforehand
             response = self.supabase.from_("request").delete().eq("request_id", request_id).execute()
             
             if not response.data:
                 abort(404, description="Request not found.")
 
+            if self.request_intervals is not None:
+                self.request_intervals.remove(response.data[0]["request_id"])
+
             return {"message": "Request cancel successful", 
-                    "data": {"request_id": request_id, "staff_id": staff_id, "startdate": startdate, "enddate": enddate}}, 200 
+                    "data": self._deleted_request(response.data[0])}, 200 
 
         except Exception as e:
             return {"error": str(e)}, 500
 
     def cancel_request(self, request_id):
         try:
-            data = self.supabase.from_("request").select().eq("request_id", request_id).execute()
-            staff_id = data.data[0]['staff_id']
-            startdate = data.data[0]['startdate']
-            enddate = data.data[0]['enddate']
+            if self.approval_rpc:
+                # Request and schedule rows are deleted (and the occupancy summary updated) in one transaction
+                result, error = self._request_rpc("cancel_request", {"p_request_id": request_id})
+                if error is not None:
+                    return error
+                if result is not None:
+                    if self.schedule_index is not None:
+                        self.schedule_index.remove(result["schedule"])
+                    if self.request_intervals is not None:
+                        self.request_intervals.remove(result["request"]["request_id"])
+                    return {"message": "Request withdrawn successful",
+                            "data": self._deleted_request(result["request"])}, 200
+
+            # The rule goes first, since deleting the request cascades to it
+            deleted_rules = []
+            if self.recurrence_rules:
+                deleted_rules = self.supabase.from_("schedule_rule").delete().eq("request_id", request_id).execute().data or []
 
             response = self.supabase.from_("request").delete().eq("request_id", request_id).execute()
+            if not response.data:
+                abort(404, description="Request not found.")
+            deleted_request = self._deleted_request(response.data[0])
+
             response2 = self.supabase.from_("schedule").delete().eq("request_id", request_id).execute()
-            
+            deleted_schedule = (response2.data or []) + [row for rule in deleted_rules for row in rule_rows(rule)]
 
-            if not response.data or not response2.data:
-                abort(404, description="Request not found.")
+            self._record_removed(deleted_schedule)
+            if self.request_intervals is not None:
+                self.request_intervals.remove(deleted_request["request_id"])
 
             return {"message": "Request withdrawn successful",
-                    "data":{"request_id": request_id, "staff_id": staff_id, "startdate": startdate, "enddate": enddate}}, 200
+                    "data": deleted_request}, 200
 
         except Exception as e:
             return {"error": str(e)}, 500
@@ -53,13 +155,22 @@ class RequestService:
         
         return {"message": "CORS is working", "staff_id": staff_id, "access_token": access_token}, 200
 
-    def create_request(self, form_data):
+    #idempotency_key comes from the client's Idempotency-Key header; a retry with the same key
+    #returns the request the first attempt created, with 200 instead of 201
+    def create_request(self, form_data, idempotency_key=None):
         # Validate input
         if not form_data:
             return {"error": "No request data provided"}, 400
         try:
-            # Insert new request into the Supabase database
-            response = self.supabase.from_("request").insert({
+            overlapping = self.overlapping_requests(form_data)
+            if overlapping and REQUEST_OVERLAP == "reject":
+                # A retry overlaps the request its first attempt created
+                replayed = self._replayed_request(form_data, idempotency_key)
+                if replayed is not None:
+                    return replayed, 200
+                return {"error": "Request overlaps existing requests", "overlapping_requests": overlapping}, 409
+
+            row = {
                 "staff_id": form_data.get('staffid'),
                 "reason": form_data.get("reason"),
                 "status": form_data.get("status"),
@@ -67,29 +178,95 @@ class RequestService:
                 "enddate": form_data.get("enddate"),
                 "time_slot": form_data.get("time_slot"),
                 "request_type": form_data.get("request_type"),
-            }).execute()
+            }
+            if idempotency_key:
+                row["idempotency_key"] = idempotency_key
+
+            # Insert new request into the Supabase database
+            try:
+                response = self.supabase.from_("request").insert(row).execute()
+            except APIError as e:
+                # The unique (staff_id, idempotency_key) index turns a concurrent retry into a replay
+                replayed = self._replayed_request(form_data, idempotency_key) if e.code == "23505" else None
+                if replayed is None:
+                    raise
+                return replayed, 200
 
             # Check for errors in the response
             if response is None:
                 current_app.logger.error("Database insert error")
                 return {"error": "Failed to insert data into the database"}, 500
 
+            created = response.data[0]
+            if self.request_intervals is not None:
+                self.request_intervals.add(created)
+            if overlapping:
+                created = {**created, "overlapping_requests": overlapping}
+
             # If everything is fine, return the inserted request
-            return response.data[0], 201
+            return created, 201
         except Exception as e:
             current_app.logger.error("An error occurred: %s", str(e))
             return {"error": str(e)}, 500
 
-    def get_requests_by_staff(self, staff_id):
+    #the request an earlier attempt with this Idempotency-Key created, or None
+    def _replayed_request(self, form_data, idempotency_key):
+        if not idempotency_key:
+            return None
+        response = self.supabase.from_("request").select("*").eq("staff_id", form_data.get('staffid')).eq("idempotency_key", idempotency_key).execute()
+        return response.data[0] if response.data else None
+
+    #request_ids of the staff member's pending or approved requests sharing a date and slot with the new one
+    def overlapping_requests(self, form_data):
+        if self.request_intervals is None:
+            return []
+        try:
+            return self.request_intervals.overlapping(form_data["staffid"], form_data["startdate"], form_data["enddate"], form_data["time_slot"])
+        except (KeyError, TypeError, ValueError):
+            # Incomplete requests are left to the database to reject
+            return []
+
+    def _select_requests(self, options, source="request"):
+        if options is None or options["fields"] is None:
+            return self.supabase.from_(source).select("*")
+        return self.supabase.from_(source).select(", ".join(options["fields"]))
+
+    #applies the listing filters and, when paginated, the request_id keyset; returns the rows or a page
+    def _list_requests(self, query, options):
+        if options is None:
+            return query.execute()
+        if options["status"] is not None:
+            query = query.eq("status", options["status"])
+        if options["start"] is not None:
+            query = query.gte("enddate", options["start"])
+        if options["end"] is not None:
+            query = query.lte("startdate", options["end"])
+        if options["limit"] is None:
+            return query.order("request_id").execute()
+        if options["cursor"] is not None:
+            query = query.gt("request_id", options["cursor"])
+        # One extra row tells whether there is a next page
+        response = query.order("request_id").limit(options["limit"] + 1).execute()
+        if response is None:
+            return None
+        rows = response.data[:options["limit"]]
+        next_cursor = rows[-1]["request_id"] if len(response.data) > options["limit"] else None
+        return {"requests": rows, "next_cursor": next_cursor}
+
+    def get_requests_by_staff(self, staff_id, options=None):
         try:
             # Retrieve requests for the specified staff_id from the Supabase database
-            response = self.supabase.from_("request").select("*").eq("staff_id", staff_id).execute()
+            response = self._list_requests(self._select_requests(options).eq("staff_id", staff_id), options)
 
             # Check for errors in the response
             if response is None:
                 current_app.logger.error("Database query error")
                 return {"error": "Failed to retrieve data from the database"}, 500
 
+            # A page is returned as is, even when empty
+            if isinstance(response, dict):
+                return response, 200
+
             # If no requests found, return a 404
             if not response.data:
                 return {"error": "No requests found for this staff ID"}, 404
@@ -100,34 +277,94 @@ class RequestService:
             current_app.logger.error("An error occurred: %s", str(e))
             return {"error": str(e)}, 500
     
-    def get_team_requests(self, staff_id):
+    #whether staff_id may view team requests (Role 1 or Role 3 + Manager/Director), None if unknown
+    def can_view_team_requests(self, staff_id):
+        # The org chart is in memory and reloads (or is invalidated) on its own, so its answer is never stale here
+        if self.org_chart is not None:
+            return self._team_access_of(self.org_chart.get(staff_id))
+
+        key = str(staff_id)
+        cached = self._team_access.get(key)
+        if cached is not None and time.monotonic() - cached[1] <= TEAM_ACCESS_TTL:
+            return cached[0]
+
         # Query for the current user's role and position based on staff_id
         user_response = self.supabase.from_('Employee').select('Role, Position').eq('Staff_ID', staff_id).execute()
-        
-        if not user_response.data:
-            return {"error": "User not found"}, 404
-
-        current_user = user_response.data[0]
+        allowed = self._team_access_of(user_response.data[0] if user_response.data else None)
+
+        self._team_access.pop(key, None)
+        self._team_access[key] = (allowed, time.monotonic())
+        while len(self._team_access) > TEAM_ACCESS_MAX:
+            del self._team_access[next(iter(self._team_access))]
+        return allowed
+
+    @staticmethod
+    def _team_access_of(current_user):
+        if not current_user:
+            return None
         role = current_user['Role']
         position = current_user['Position'].lower()
+        return (role == 1 or role == 3) and ('manager' in position or 'director' in position)
 
-        # Check if the user is eligible to view team requests (Role 1 or Role 3 + Manager/Director)
-        if (role == 1 or role == 3) and ('manager' in position or 'director' in position):
-            # Fetch the staff members who report to this Manager/Director from the Employee table
-            response = self.supabase.from_('Employee').select('Staff_ID').eq('Reporting_Manager', staff_id).execute()
+    def _has_team(self, staff_id):
+        if self.org_chart is not None:
+            return bool(self.org_chart.direct_reports(staff_id))
+        return bool(self.supabase.from_('Employee').select('Staff_ID').eq('Reporting_Manager', staff_id).limit(1).execute().data)
 
-            if response.data:
-                team_member_ids = [member['Staff_ID'] for member in response.data]
+    def get_team_requests(self, staff_id, options=None):
+        allowed = self.can_view_team_requests(staff_id)
+        if allowed is None:
+            return {"error": "User not found"}, 404
 
-                # Retrieve requests of staff belonging to the logged-in user's team where status = 0
-                requests_response = self.supabase.from_("request").select("*").in_("staff_id", team_member_ids).eq("status", 0).execute()
-                return requests_response.data, 200
-            else:
-                return [], 404
-        else:
+        # Check if the user is eligible to view team requests (Role 1 or Role 3 + Manager/Director)
+        if not allowed:
             # User not authorized to view team requests
             return [], 401
 
+        if self.team_queue_view:
+            # One round trip: the view joins each request to its requester's reporting manager
+            query = self._select_requests(options, "manager_request_queue").eq("reporting_manager", staff_id)
+            if options is None or options["status"] is None:
+                query = query.eq("status", 0)
+            try:
+                requests_response = self._list_requests(query, options)
+            except APIError as e:
+                if e.code not in MISSING_RELATION_CODES:
+                    raise
+                current_app.logger.warning("manager_request_queue view is not installed, querying direct reports instead")
+                self.team_queue_view = False
+            else:
+                if isinstance(requests_response, dict):
+                    rows = requests_response["requests"]
+                    first_page = options["cursor"] is None
+                else:
+                    rows = requests_response = requests_response.data
+                    first_page = True
+                # Same answer as the direct-reports query below for a manager with no team
+                if not rows and first_page and not self._has_team(staff_id):
+                    return [], 404
+                return requests_response, 200
+
+        # Fetch the staff members who report to this Manager/Director from the Employee table
+        if self.org_chart is not None:
+            team_members = self.org_chart.direct_reports(staff_id)
+        else:
+            team_members = self.supabase.from_('Employee').select('Staff_ID').eq('Reporting_Manager', staff_id).execute().data
+
+        if team_members:
+            team_member_ids = [member['Staff_ID'] for member in team_members]
+
+            # Retrieve requests of staff belonging to the logged-in user's team where status = 0 (unless filtered otherwise)
+            query = self._select_requests(options).in_("staff_id", team_member_ids)
+            if options is None or options["status"] is None:
+                query = query.eq("status", 0)
+            requests_response = self._list_requests(query, options)
+            if isinstance(requests_response, dict):
+                return requests_response, 200
+            return requests_response.data, 200
+        else:
+            return [], 404
+
     def get_selected_request(self, request_id):
         # Retrieve selected request by request_id
         request_response = self.supabase.from_("request").select("*").eq("request_id", request_id).execute()
@@ -138,63 +375,246 @@ class RequestService:
         selected_request = request_response.data[0]
         return selected_request, 200
 
-    def calculate_recurring_dates(self, approved_dates):
+    #dates a recurring request repeats on: every approved weekday for horizon_days after the earliest approved date
+    def calculate_recurring_dates(self, approved_dates, horizon_days=RECURRING_HORIZON_DAYS, end_date=None, holidays=()):
         if not approved_dates:
             return []
-        
-        date_list = []
-        earliest_date = min([datetime.strptime(date, '%Y-%m-%d') for date in approved_dates])
-        end_date = earliest_date + timedelta(days=365)
-
-        approved_weekdays = [date.weekday() for date in [datetime.strptime(date, '%Y-%m-%d') for date in approved_dates]]
+        return expand_weekly(approved_dates, horizon_days, end_date, holidays)
+
+    #schedule rows for a request, two per date (time_slot 1 and 2) for full-day requests
+    def schedule_rows(self, staff_id, dates, time_slot, request_id):
+        time_slot_int = int(time_slot) if isinstance(time_slot, (int, float, str)) and str(time_slot).isdigit() else time_slot
+        if time_slot_int == 3:
+            slots = [1, 2]
+        elif time_slot_int in [1, 2]:
+            slots = [time_slot_int]
+        else:
+            return []
+        return [{"staff_id": staff_id, "date": date, "time_slot": slot, "request_id": request_id} for date in dates for slot in slots]
+
+    #schedule rows still to be written for a request, and how many were asked for
+    def _new_schedule_rows(self, staff_id, dates, time_slot, request_id):
+        rows = self.schedule_rows(staff_id, dates, time_slot, request_id)
+        requested = len(rows)
+        # Repeated dates, and slots the staff member already has a schedule row for, are not written again
+        rows = list({(row["date"], row["time_slot"]): row for row in rows}.values())
+        held = self._held(rows)
+        rows = [row for row in rows if self._slot(row) not in held]
+        return rows, requested
+
+    @staticmethod
+    def _slot(row):
+        return (int(row["staff_id"]), str(row["date"])[:10], int(row["time_slot"]))
+
+    #the (staff_id, date, time_slot) slots among rows that their staff member already holds, through a schedule
+    #row or (when recurrence_rules is set) a rule. Read from the database rather than the schedule index, which
+    #may not have seen other instances' writes yet, since writes and occupancy counts depend on the answer
+    def _held(self, rows):
+        if not rows:
+            return set()
+        staff_ids = list({int(row["staff_id"]) for row in rows})
+        start = min(str(row["date"])[:10] for row in rows)
+        end = max(str(row["date"])[:10] for row in rows)
+        held = self._pages(lambda query: query.in_("staff_id", staff_ids).gte("date", start).lte("date", end),
+                           "schedule", "staff_id, date, time_slot", "schedule_id")
+        if self.recurrence_rules:
+            rules = self._pages(lambda query: query.in_("staff_id", staff_ids).lte("startdate", end).gte("enddate", start),
+                                "schedule_rule", "*", "rule_id")
+            held = held + [row for rule in rules for row in rule_rows(rule, start, end)]
+        return {self._slot(row) for row in held} & {self._slot(row) for row in rows}
+
+    #every row of table matching where(query), read in pages ordered by the unique key
+    def _pages(self, where, table, columns, key):
+        rows = []
+        while True:
+            page = where(self.supabase.from_(table).select(columns)).order(key).range(len(rows), len(rows) + HELD_PAGE_SIZE - 1).execute().data or []
+            rows.extend(page)
+            if len(page) < HELD_PAGE_SIZE:
+                return rows
+
+    #one bulk insert per chunk of rows (any mix of staff and requests); returns (written rows, failed chunks, failed rows)
+    def _insert_schedule_rows(self, rows, chunk_size=None):
+        chunk_size = chunk_size or SCHEDULE_INSERT_CHUNK_SIZE
+        written = []
+        failed_chunks = []
+        failed_rows = []
+        for index, start in enumerate(range(0, len(rows), chunk_size)):
+            chunk = rows[start:start + chunk_size]
+            try:
+                response = self.supabase.from_("schedule").insert(chunk).execute()
+                error = None if response is not None else "No response"
+            except Exception as e:
+                error = str(e)
+
+            if error is not None:
+                current_app.logger.error("Failed to create schedule entries %s to %s (chunk %d): %s", chunk[0]["date"], chunk[-1]["date"], index, error)
+                failed_chunks.append({"chunk": index, "start_date": chunk[0]["date"], "end_date": chunk[-1]["date"], "rows": len(chunk), "error": error})
+                failed_rows.extend(chunk)
+            else:
+                written.extend(chunk)
+
+        self._record_added(written)
+        return written, failed_chunks, failed_rows
+
+    #mirrors newly scheduled rows into the schedule index, and the counted ones (all of them unless given)
+    #into the occupancy summary, grouped by staff
+    def _record_added(self, rows, counted=None):
+        counted = rows if counted is None else counted
+        if self.occupancy_summary is not None and counted:
+            by_staff = {}
+            for row in counted:
+                by_staff.setdefault(row["staff_id"], []).append((row["date"], row["time_slot"]))
+            self._update_occupancy(self.occupancy_summary.record_added, by_staff)
+        if self.schedule_index is not None and rows:
+            self.schedule_index.add(rows)
+
+    #takes removed schedule rows back out of the schedule index, and out of the occupancy summary (grouped by
+    #staff) unless another schedule row or rule still holds the slot
+    def _record_removed(self, rows):
+        if self.schedule_index is not None and rows:
+            self.schedule_index.remove(rows)
+        if self.occupancy_summary is not None and rows:
+            try:
+                held = self._held(rows)
+            except Exception as e:
+                current_app.logger.error("Failed to update the occupancy summary, run flask occupancy-rebuild: %s", str(e))
+                return
+            by_staff = {}
+            for row in {self._slot(row): row for row in rows}.values():
+                if self._slot(row) not in held:
+                    by_staff.setdefault(row["staff_id"], []).append((row["date"], row["time_slot"]))
+            self._update_occupancy(self.occupancy_summary.record_removed, by_staff)
+
+    #applies {staff_id: [(date, time_slot)]} with record_added or record_removed. The schedule change has already
+    #committed by now, so a failure is logged rather than raised; flask occupancy-rebuild repairs the summary
+    def _update_occupancy(self, record, by_staff):
+        for staff_id, slots in by_staff.items():
+            try:
+                record(staff_id, slots)
+            except Exception as e:
+                current_app.logger.error("Failed to update the occupancy summary for staff %s, run flask occupancy-rebuild: %s", staff_id, str(e))
+
+    #deletes every schedule row (and rule) the requests wrote, so an approval that failed part way leaves nothing
+    #behind; returns the deleted rows, with rules expanded
+    def discard_schedule(self, request_ids):
+        request_ids = list(request_ids)
+        deleted = []
+        try:
+            if self.recurrence_rules:
+                rules = self.supabase.from_("schedule_rule").delete().in_("request_id", request_ids).execute().data or []
+                deleted.extend(row for rule in rules for row in rule_rows(rule))
+            deleted.extend(self.supabase.from_("schedule").delete().in_("request_id", request_ids).execute().data or [])
+        except Exception as e:
+            current_app.logger.error("Failed to remove the schedule entries of requests %s: %s", request_ids, str(e))
+        self._record_removed(deleted)
+        return deleted
+
+    #one insert for every rule; returns (written rule rows, error or None)
+    def _insert_schedule_rules(self, rules):
+        if not rules:
+            return [], None
+        # Slots the staff member already holds are not counted again in the occupancy summary
+        held = self._held([row for rule in rules for row in rule_rows(rule)])
+        try:
+            written = self.supabase.from_("schedule_rule").insert(rules).execute().data
+        except Exception as e:
+            current_app.logger.error("Failed to create schedule rules for requests %s: %s", [rule["request_id"] for rule in rules], str(e))
+            return [], str(e)
+        rows = [row for rule in written for row in rule_rows(rule)]
+        self._record_added(rows, [row for row in {self._slot(row): row for row in rows}.values() if self._slot(row) not in held])
+        return written, None
+
+    #stores a recurring request as one schedule_rule row; same result shape as create_schedule_entries, plus the rule_id
+    def create_schedule_rule(self, staff_id, approved_dates, time_slot, request_id):
+        rule = weekly_rule(approved_dates)
+        if rule is None:
+            return {"rows_written": 0, "rows_skipped": 0, "failed_chunks": []}
+        written, error = self._insert_schedule_rules([{**rule, "request_id": request_id, "staff_id": staff_id, "time_slot": int(time_slot)}])
+        if error is not None:
+            return {"rows_written": 0, "rows_skipped": 0, "failed_chunks": [
+                {"chunk": 0, "start_date": rule["startdate"], "end_date": rule["enddate"], "rows": 1, "error": error}]}
+        return {"rows_written": 0, "rows_skipped": 0, "failed_chunks": [], "rule_id": written[0]["rule_id"]}
+
+    #writes the approved schedule of a request_data row, as a rule for recurring requests when recurrence_rules is set
+    def write_schedule(self, request_data, approved_dates):
+        staff_id = request_data['staff_id']
+        time_slot = request_data['time_slot']
+        request_id = request_data['request_id']
+        if request_data['request_type'] == 2:  # Recurring
+            if self.recurrence_rules:
+                return self.create_schedule_rule(staff_id, approved_dates or [], time_slot, request_id)
+            return self.create_schedule_entries(staff_id, self.calculate_recurring_dates(approved_dates), time_slot, request_id)
+        return self.create_schedule_entries(staff_id, approved_dates, time_slot, request_id)  # Ad-hoc
+
+    #writes the rows with one bulk insert per chunk; returns how many rows were written, skipped as already scheduled, and which chunks failed
+    def create_schedule_entries(self, staff_id, dates, time_slot, request_id, chunk_size=None):
+        rows, requested = self._new_schedule_rows(staff_id, dates, time_slot, request_id)
+        written, failed_chunks, _ = self._insert_schedule_rows(rows, chunk_size)
+        return {"rows_written": len(written), "rows_skipped": requested - len(rows), "failed_chunks": failed_chunks}
+
+    #True if staff_id already holds the slot through a schedule row or (when recurrence_rules is set) a rule;
+    #a read-only point query, so answered from the index when one is given
+    def is_scheduled(self, staff_id, date, time_slot):
+        if self.schedule_index is not None:
+            return self.schedule_index.is_away(staff_id, date, time_slot)
+        return bool(self._held([{"staff_id": staff_id, "date": date, "time_slot": time_slot}]))
+
+    #calls a database function, returning (data, None) or (None, (error, status)); (None, None) when it does not exist
+    def _request_rpc(self, name, params):
+        try:
+            return self.supabase.rpc(name, params).execute().data, None
+        except APIError as e:
+            if e.code in MISSING_FUNCTION_CODES:
+                current_app.logger.warning("Database function %s is not installed, using the Python path", name)
+                self.approval_rpc = False
+                return None, None
+            if e.code == "P0002":
+                return None, ({"error": "Request not found"}, 404)
+            if e.code == NOT_PENDING_CODE:
+                return None, ({"error": e.message}, 409)
+            return None, ({"error": e.message}, 500)
 
-        current_date = earliest_date
-        while current_date <= end_date:
-            if current_date.weekday() in approved_weekdays:
-                date_list.append(current_date.strftime('%Y-%m-%d'))
-            current_date += timedelta(days=1)
+    def approve_request(self, request_id, result_reason, approved_dates):
+        if self.approval_rpc:
+            params = {
+                "p_request_id": request_id,
+                "p_result_reason": result_reason,
+                "p_approved_dates": approved_dates or [],
+                "p_horizon_days": RECURRING_HORIZON_DAYS
+            }
+            if self.recurrence_rules:
+                # Only sent when set, so databases without schedule_rule keep working with rules off
+                params["p_recurrence_rule"] = True
+            result, error = self._request_rpc("approve_request", params)
+            if error is not None:
+                return error
+            if result is not None:
+                # The function already updated the occupancy summary in the same transaction;
+                # for a rule, "schedule" holds its expanded rows rather than rows it wrote
+                if self.schedule_index is not None:
+                    self.schedule_index.add(result["schedule"])
+                if result.get("rule"):
+                    return {"message": "Request approved successfully", "rows_written": 0, "rule_id": result["rule"]["rule_id"]}, 200
+                return {"message": "Request approved successfully", "rows_written": len(result["schedule"])}, 200
+        return self._approve_request_python(request_id, result_reason, approved_dates)
 
-        return date_list
+    def reject_request(self, request_id, result_reason):
+        response_data, status_code = self._reject_request(request_id, result_reason)
+        # A rejected request no longer holds its dates
+        if status_code == 200 and self.request_intervals is not None:
+            self.request_intervals.remove(request_id)
+        return response_data, status_code
 
-    def create_schedule_entries(self, staff_id, dates, time_slot, request_id):
-        for date in dates:
-            time_slot_int = int(time_slot) if isinstance(time_slot, (int, float, str)) and str(time_slot).isdigit() else time_slot
-            
-            if time_slot_int == 3:
-                # Insert first record with time_slot as 1
-                response1 = self.supabase.from_("schedule").insert({
-                    "staff_id": staff_id,
-                    "date": date,
-                    "time_slot": 1,
-                    "request_id": request_id
-                }).execute()
-
-                if response1 is None:
-                    current_app.logger.error("Failed to create schedule entry for date %s with time_slot 1", date)
-
-                # Insert second record with time_slot as 2
-                response2 = self.supabase.from_("schedule").insert({
-                    "staff_id": staff_id,
-                    "date": date,
-                    "time_slot": 2,
-                    "request_id": request_id
-                }).execute()
-
-                if response2 is None:
-                    current_app.logger.error("Failed to create schedule entry for date %s with time_slot 2", date)
-            elif time_slot_int in [1, 2]:
-                # Insert single record for other time_slot values
-                response = self.supabase.from_("schedule").insert({
-                    "staff_id": staff_id,
-                    "date": date,
-                    "time_slot": time_slot_int,
-                    "request_id": request_id
-                }).execute()
-
-        # if response is None:
-        #     current_app.logger.error("Failed to create schedule entry for date %s", date)
+    def _reject_request(self, request_id, result_reason):
+        if self.approval_rpc:
+            result, error = self._request_rpc("reject_request", {"p_request_id": request_id, "p_result_reason": result_reason})
+            if error is not None:
+                return error
+            if result is not None:
+                return {"message": "Request rejected successfully"}, 200
+        return self._reject_request_python(request_id, result_reason)
 
-    def approve_request(self, request_id, result_reason, approved_dates):
+    def _approve_request_python(self, request_id, result_reason, approved_dates):
         try:
             # Retrieve request data
             request_response = self.supabase.from_("request").select("*").eq("request_id", request_id).execute()
@@ -203,36 +623,44 @@ class RequestService:
                 abort(404, description="Request not found.")
 
             request_data = request_response.data[0]
-            staff_id = request_data['staff_id']
-            request_type = request_data['request_type']
-            time_slot = request_data['time_slot']
-            requestId = request_data['request_id']
-
-            if request_type == 2:  # Recurring
-                recurring_dates = self.calculate_recurring_dates(approved_dates)
-                self.create_schedule_entries(staff_id, recurring_dates, time_slot, requestId)
-            else:  # Ad-hoc
-                self.create_schedule_entries(staff_id, approved_dates, time_slot, requestId)
-
-            self.supabase.from_("request").update({
+            # Same rule as the approve_request function: only a pending request can be decided
+            if request_data["status"] != 0:
+                return {"error": f"Request {request_id} is not pending"}, 409
+            written = self.write_schedule(request_data, approved_dates)
+
+            # The request stays pending when part of its schedule could not be written, and the part that was is removed
+            if written["failed_chunks"]:
+                self.discard_schedule([request_id])
+                return {"error": "Failed to create some schedule entries", **written, "rows_written": 0}, 500
+
+            response = self.supabase.from_("request").update({
                 "status": 1,  # Approved status
                 "result_reason": result_reason
-            }).eq("request_id", request_id).execute()
+            }).eq("request_id", request_id).eq("status", 0).execute()
+
+            # Decided by someone else while the schedule was being written
+            if not response.data:
+                self.discard_schedule([request_id])
+                return {"error": f"Request {request_id} is not pending"}, 409
 
-            return {"message": "Request approved successfully"}, 200
+            if "rule_id" in written:
+                return {"message": "Request approved successfully", "rows_written": 0, "rule_id": written["rule_id"]}, 200
+            return {"message": "Request approved successfully", "rows_written": written["rows_written"]}, 200
 
         except Exception as e:
             return {"error": str(e)}, 500
 
-    def reject_request(self, request_id, result_reason):
+    def _reject_request_python(self, request_id, result_reason):
         try:
             response = self.supabase.from_("request").update({
                 "status": -1,  # Rejected status
                 "result_reason": result_reason
-            }).eq("request_id", request_id).execute()
+            }).eq("request_id", request_id).eq("status", 0).execute()
 
             if not response.data:
-                abort(404, description="Request not found.")
+                if not self.supabase.from_("request").select("request_id").eq("request_id", request_id).execute().data:
+                    abort(404, description="Request not found.")
+                return {"error": f"Request {request_id} is not pending"}, 409
 
             return {"message": "Request rejected successfully"}, 200
 
@@ -240,9 +668,155 @@ class RequestService:
             return {"error": str(e)}, 500
 
 
+    #approves and rejects many requests together: one read of the requests, one chunked bulk insert of every
+    #approved schedule row and one status update per (status, result_reason). Returns one result per item, in order.
+    def decide_requests(self, decisions):
+        results = [None] * len(decisions)
+        valid = {}
+        for i, item in enumerate(decisions):
+            try:
+                request_id = int(item["request_id"])
+                if item.get("decision") not in ("approve", "reject"):
+                    raise ValueError
+            except (KeyError, TypeError, ValueError, AttributeError):
+                results[i] = {"request_id": item.get("request_id") if isinstance(item, dict) else None, "status": 400,
+                              "error": "Each item needs a request_id and a decision of approve or reject"}
+            else:
+                valid[i] = (request_id, item)
+
+        ids = list({request_id for request_id, _ in valid.values()})
+        requests_by_id = {}
+        if ids:
+            requests_by_id = {row["request_id"]: row for row in self.supabase.from_("request").select("*").in_("request_id", ids).execute().data}
+
+        schedule_rows = []
+        schedule_rules = []
+        scheduled = set()
+        rows_per_request = {}
+        wanted = {}
+        seen = set()
+        for i, (request_id, item) in valid.items():
+            request_data = requests_by_id.get(request_id)
+            if request_data is None:
+                results[i] = {"request_id": request_id, "status": 404, "error": "Request not found"}
+                continue
+            if request_id in seen:
+                results[i] = {"request_id": request_id, "status": 409, "error": "Request appears more than once in the batch"}
+                continue
+            seen.add(request_id)
+            if request_data["status"] != 0:
+                results[i] = {"request_id": request_id, "status": 409, "error": "Request is not pending"}
+                continue
+            if item["decision"] == "approve":
+                approved_dates = item.get("approved_dates") or []
+                if request_data["request_type"] == 2 and self.recurrence_rules:
+                    rule = weekly_rule(approved_dates)
+                    if rule is not None:
+                        schedule_rules.append({**rule, "request_id": request_id, "staff_id": request_data["staff_id"], "time_slot": int(request_data["time_slot"])})
+                    rows_per_request[request_id] = 0
+                    continue
+                dates = self.calculate_recurring_dates(approved_dates) if request_data["request_type"] == 2 else approved_dates
+                rows = list({self._slot(row): row for row in self.schedule_rows(request_data["staff_id"], dates, request_data["time_slot"], request_id)}.values())
+                wanted[request_id] = rows
+                # Two requests of the same staff member in one batch do not write the same slot twice
+                rows = [row for row in rows if self._slot(row) not in scheduled]
+                scheduled.update(self._slot(row) for row in rows)
+                schedule_rows.extend(rows)
+                rows_per_request[request_id] = 0
+
+        # Slots already held are left out with one lookup for the whole batch
+        held = self._held(schedule_rows)
+        schedule_rows = [row for row in schedule_rows if self._slot(row) not in held]
+        for row in schedule_rows:
+            rows_per_request[row["request_id"]] += 1
+
+        # Every approved request's rows share the same chunked bulk insert
+        _, _, failed_rows = self._insert_schedule_rows(schedule_rows)
+        failed_ids = {row["request_id"] for row in failed_rows}
+        # A request's rows can span chunks, so the ones that did land are removed again
+        if failed_ids:
+            self.discard_schedule(failed_ids)
+        # ...and every recurring rule shares one insert
+        _, error = self._insert_schedule_rules(schedule_rules)
+        if error is not None:
+            failed_ids.update(rule["request_id"] for rule in schedule_rules)
+
+        updates = {}
+        for i, (request_id, item) in valid.items():
+            if results[i] is not None:
+                continue
+            if request_id in failed_ids:
+                # The request stays pending when part of its schedule could not be written
+                results[i] = {"request_id": request_id, "status": 500, "error": "Failed to create some schedule entries"}
+                continue
+            status = 1 if item["decision"] == "approve" else -1
+            updates.setdefault((status, item.get("result_reason")), []).append(i)
+
+        for (status, result_reason), items in updates.items():
+            update_ids = [valid[i][0] for i in items]
+            error = None
+            try:
+                # Only still-pending requests are updated, so a request decided by a concurrent batch is left alone
+                response = self.supabase.from_("request").update({"status": status, "result_reason": result_reason}).in_("request_id", update_ids).eq("status", 0).execute()
+                updated = {row["request_id"] for row in response.data}
+            except Exception as e:
+                current_app.logger.error("Failed to update requests %s: %s", update_ids, str(e))
+                error = str(e)
+                updated = set()
+            # Approvals that did not take keep no schedule
+            if status == 1 and len(updated) < len(update_ids):
+                self.discard_schedule([request_id for request_id in update_ids if request_id not in updated])
+            for i in items:
+                request_id = valid[i][0]
+                if error is not None:
+                    results[i] = {"request_id": request_id, "status": 500, "error": error}
+                    continue
+                if request_id not in updated:
+                    results[i] = {"request_id": request_id, "status": 409, "error": "Request is not pending"}
+                    continue
+                request_data = requests_by_id[request_id]
+                result = {"request_id": request_id, "status": 200, "decision": valid[i][1]["decision"],
+                          "data": {"request_id": request_id, "staff_id": request_data["staff_id"], "startdate": request_data["startdate"], "enddate": request_data["enddate"]}}
+                if status == 1:
+                    result.update({"message": "Request approved successfully", "rows_written": rows_per_request[request_id]})
+                else:
+                    result["message"] = "Request rejected successfully"
+                    if self.request_intervals is not None:
+                        self.request_intervals.remove(request_id)
+                results[i] = result
+
+        self._restore_shared_slots(results, valid, wanted, schedule_rows, held)
+        return results
+
+    #a slot two approvals in one batch share is written once, for the first; when that one is not approved after all
+    #its rows are gone, so the slot is written again for an approved request that also asked for it
+    def _restore_shared_slots(self, results, valid, wanted, schedule_rows, held):
+        approved = {}
+        for i, (request_id, item) in valid.items():
+            if item["decision"] == "approve" and results[i]["status"] == 200 and request_id in wanted:
+                approved[request_id] = i
+        lost = {self._slot(row) for row in schedule_rows if row["request_id"] not in approved}
+        rows = []
+        for request_id in approved:
+            for row in wanted[request_id]:
+                if self._slot(row) in lost and self._slot(row) not in held:
+                    lost.discard(self._slot(row))
+                    rows.append(row)
+        if not rows:
+            return
+
+        written, _, failed_rows = self._insert_schedule_rows(rows)
+        for row in written:
+            results[approved[row["request_id"]]]["rows_written"] += 1
+        for request_id in {row["request_id"] for row in failed_rows}:
+            # The request is already approved; report the slots it is missing rather than hide them
+            results[approved[request_id]].update({"status": 500, "error": "Request approved, but some schedule entries could not be written"})
+
 class RequestController:
-    def __init__(self, request_service):
+    def __init__(self, request_service, approval_jobs=None):
         self.request_service = request_service
+        # When given, approvals return 202 and their schedule rows are written by a background job
+        self.approval_jobs = approval_jobs
 
     def withdraw_request(self, request_id):
         try:
@@ -269,7 +843,7 @@ class RequestController:
     def create_request(self):
         form_data = request.json
         try:
-            response_data, status_code = self.request_service.create_request(form_data)
+            response_data, status_code = self.request_service.create_request(form_data, request.headers.get("Idempotency-Key"))
             return response_data, status_code
         except Exception as e:
             # Handle the exception and log the error
@@ -277,7 +851,11 @@ class RequestController:
             return {"error": str(e)}, 500
 
     def get_requests_by_staff(self, staff_id):
-        response_data, status_code = self.request_service.get_requests_by_staff(staff_id)
+        try:
+            options = listing_options(request.args)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        response_data, status_code = self.request_service.get_requests_by_staff(staff_id, options)
         return response_data, status_code
 
     def get_team_requests(self):
@@ -285,7 +863,11 @@ class RequestController:
         if not staff_id:
             return {"error": "Staff ID is required"}, 400
 
-        response_data, status_code = self.request_service.get_team_requests(staff_id)
+        try:
+            options = listing_options(request.args)
+        except ValueError as e:
+            return {"error": str(e)}, 400
+        response_data, status_code = self.request_service.get_team_requests(staff_id, options)
         return response_data, status_code
 
     def get_selected_request(self, request_id):
@@ -296,6 +878,8 @@ class RequestController:
         try:
             result_reason = request.json.get('result_reason')
             approved_dates = request.json.get('approved_dates')
+            if self.approval_jobs is not None:
+                return self.approval_jobs.submit(request_id, result_reason, approved_dates)
             response_data, status_code = self.request_service.approve_request(request_id, result_reason, approved_dates)
             return response_data, status_code
         except Exception as e:
@@ -303,6 +887,19 @@ class RequestController:
             current_app.logger.error("An error occurred: %s", str(e))
             return {"error": str(e)}, 500
 
+    def decide_requests(self):
+        body = request.get_json(silent=True)
+        decisions = body.get("decisions") if isinstance(body, dict) else body
+        if not isinstance(decisions, list) or not decisions:
+            return {"error": "Expected a non-empty list of decisions"}, 400
+        if len(decisions) > BULK_DECISIONS_MAX:
+            return {"error": f"At most {BULK_DECISIONS_MAX} decisions per batch"}, 400
+        try:
+            return {"results": self.request_service.decide_requests(decisions)}, 200
+        except Exception as e:
+            current_app.logger.error("An error occurred: %s", str(e))
+            return {"error": str(e)}, 500
+
     def reject_request(self, request_id):
         try:
             result_reason = request.json.get('result_reason')
@@ -0,0 +1,171 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left, insort
+from dotenv import load_dotenv
+from .recurrence import rule_rows
+load_dotenv()
+
+SCHEDULE_INDEX_TTL = int(os.environ.get("SCHEDULE_INDEX_TTL", 60))
+# PostgREST caps each response, so the schedule table is read in pages of this size
+SCHEDULE_INDEX_PAGE_SIZE = 1000
+
+logger = logging.getLogger(__name__)
+
+
+class _IndexState:
+    # The lookups of one load of the index, updated in place by add/remove
+    def __init__(self):
+        self.positions = {}
+        self.staff = []
+        self.slots = {}
+        self.dates = {}
+        self.slot_dates = {}
+        self.counts = {}
+
+    def _position(self, staff_id):
+        if staff_id not in self.positions:
+            self.positions[staff_id] = len(self.staff)
+            self.staff.append(staff_id)
+        return self.positions[staff_id]
+
+    # Duplicate rows are counted so removing one copy keeps the slot marked
+    def add_row(self, row):
+        staff_id, slot = int(row["staff_id"]), (row["date"], int(row["time_slot"]))
+        key = (staff_id, slot)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        if self.counts[key] == 1:
+            self.slots[slot] = self.slots.get(slot, 0) | (1 << self._position(staff_id))
+            insort(self.dates.setdefault(staff_id, []), slot[0])
+            insort(self.slot_dates.setdefault((staff_id, slot[1]), []), slot[0])
+
+    def remove_row(self, row):
+        staff_id, slot = int(row["staff_id"]), (row["date"], int(row["time_slot"]))
+        key = (staff_id, slot)
+        if key not in self.counts:
+            return
+        self.counts[key] -= 1
+        if self.counts[key] == 0:
+            del self.counts[key]
+            self.slots[slot] &= ~(1 << self.positions[staff_id])
+            for dates in (self.dates[staff_id], self.slot_dates[(staff_id, slot[1])]):
+                del dates[bisect_left(dates, slot[0])]
+
+
+class ScheduleIndex:
+    # In-process index over the schedule table for point queries without a round trip:
+    #   (date, time_slot) -> bitset of staff positions  ("who is away on this slot", O(1))
+    #   staff_id (and staff_id, time_slot) -> sorted list of dates  ("is this person away between A and B", O(log n))
+    # It is updated in place as schedule rows are written or deleted here, and reloaded after
+    # ttl seconds to pick up writes made by other instances. Only the first read waits for a load;
+    # later reloads run on a background thread while readers keep using the current state.
+    def __init__(self, supabase, ttl=SCHEDULE_INDEX_TTL, recurrence_rules=False):
+        self.supabase = supabase
+        self.ttl = ttl
+        # schedule_rule rows are expanded into the index alongside the schedule rows when set
+        self.recurrence_rules = recurrence_rules
+        self._lock = threading.Lock()
+        self._state = None
+        self._loaded_at = None
+        self._refreshing = False
+
+    #a fresh state read from the tables; runs without the lock
+    def _read(self):
+        state = _IndexState()
+        for row in self._pages('schedule', 'staff_id, date, time_slot', 'schedule_id'):
+            state.add_row(row)
+        if self.recurrence_rules:
+            for rule in self._pages('schedule_rule', '*', 'rule_id'):
+                for row in rule_rows(rule):
+                    state.add_row(row)
+        return state
+
+    # Pages are ordered by a unique key, since without an order PostgREST pages can skip or repeat rows
+    def _pages(self, table, columns, key):
+        offset = 0
+        while True:
+            page = self.supabase.from_(table).select(columns).order(key).range(offset, offset + SCHEDULE_INDEX_PAGE_SIZE - 1).execute().data
+            yield from page
+            if len(page) < SCHEDULE_INDEX_PAGE_SIZE:
+                break
+            offset += SCHEDULE_INDEX_PAGE_SIZE
+
+    #call with the lock held; returns the current state, loading it first if there is none yet
+    def _ensure_loaded(self):
+        if self._state is None:
+            self._state = self._read()
+            self._loaded_at = time.monotonic()
+        elif time.monotonic() - self._loaded_at > self.ttl and not self._refreshing:
+            self._refreshing = True
+            threading.Thread(target=self._refresh, name="schedule-index-refresh", daemon=True).start()
+        return self._state
+
+    def _refresh(self):
+        try:
+            state = self._read()
+        except Exception as e:
+            # The current state is kept and the next read past the ttl tries again
+            logger.error("Failed to reload the schedule index: %s", str(e))
+            with self._lock:
+                self._refreshing = False
+            return
+        # Rows written here while the tables were being read may be missing until the next reload
+        with self._lock:
+            self._state = state
+            self._loaded_at = time.monotonic()
+            self._refreshing = False
+
+    #rows are schedule rows (dicts with staff_id, date, time_slot) just written to the table
+    def add(self, rows):
+        with self._lock:
+            if self._state is not None:
+                for row in rows:
+                    self._state.add_row(row)
+
+    #rows are schedule rows just deleted from the table
+    def remove(self, rows):
+        with self._lock:
+            if self._state is not None:
+                for row in rows:
+                    self._state.remove_row(row)
+
+    #the next read loads the tables again before answering
+    def invalidate(self):
+        with self._lock:
+            self._state = None
+
+    def away_bits(self, date, time_slot):
+        with self._lock:
+            return self._ensure_loaded().slots.get((date, int(time_slot)), 0)
+
+    #staff_ids away on the slot, in the order they were first indexed
+    def away_on(self, date, time_slot):
+        with self._lock:
+            state = self._ensure_loaded()
+            bits = state.slots.get((date, int(time_slot)), 0)
+            away = []
+            position = 0
+            while bits:
+                if bits & 1:
+                    away.append(state.staff[position])
+                bits >>= 1
+                position += 1
+            return away
+
+    def is_away(self, staff_id, date, time_slot):
+        with self._lock:
+            state = self._ensure_loaded()
+            position = state.positions.get(int(staff_id))
+            return position is not None and bool(state.slots.get((date, int(time_slot)), 0) >> position & 1)
+
+    #True if staff_id has any schedule row dated start..end inclusive (YYYY-MM-DD), optionally for one time_slot
+    def is_away_between(self, staff_id, start, end, time_slot=None):
+        with self._lock:
+            state = self._ensure_loaded()
+            if time_slot is None:
+                dates = state.dates.get(int(staff_id), [])
+            else:
+                dates = state.slot_dates.get((int(staff_id), int(time_slot)), [])
+            i = bisect_left(dates, start)
+            return i < len(dates) and dates[i] <= end
@@ -1,91 +1,171 @@
+import base64
+from flask import current_app
+from .org_chart import CachedResponse
+from .recurrence import rule_rows
+
+
 class SchedulesService:
-    def __init__(self, supabase):
+    # Column order of the roster rows in format=compact responses
+    COMPACT_FIELDS = ["staff_id", "staff_fname", "staff_lname", "dept", "position"]
+
+    def __init__(self, supabase, org_chart=None, schedule_index=None, recurrence_rules=False):
         self.supabase = supabase
+        # Roster and hierarchy lookups are served from the shared OrgChartCache when one is given
+        self.org_chart = org_chart
+        # Point queries on schedule rows are served from the in-process ScheduleIndex when one is given
+        self.schedule_index = schedule_index
+        # Recurring WFH is also read from schedule_rule rows, expanded over the requested window, when set
+        self.recurrence_rules = recurrence_rules
+
+    #staff_ids with a schedule row on the slot
+    def who_is_away(self, date, time_slot):
+        if self.schedule_index is not None:
+            return self.schedule_index.away_on(date, time_slot)
+        response = self.supabase.from_('schedule').select('staff_id').eq('date', date).eq('time_slot', int(time_slot)).execute()
+        rows = response.data + [row for rule in self.get_rules(date, date) for row in rule_rows(rule, date, date)]
+        return list(dict.fromkeys(row["staff_id"] for row in rows if int(row["time_slot"]) == int(time_slot)))
+
+    #True if staff_id has a schedule row dated start..end inclusive, optionally for one time_slot
+    def is_away_between(self, staff_id, start, end, time_slot=None):
+        if self.schedule_index is not None:
+            return self.schedule_index.is_away_between(staff_id, start, end, time_slot)
+        query = self.supabase.from_('schedule').select('schedule_id').eq('staff_id', staff_id).gte('date', start).lte('date', end)
+        if time_slot is not None:
+            query = query.eq('time_slot', int(time_slot))
+        if query.limit(1).execute().data:
+            return True
+        return any(time_slot is None or row["time_slot"] == int(time_slot)
+                   for rule in self.get_rules(start, end, staff_id) for row in rule_rows(rule, start, end))
+
+    #schedule_rule rows overlapping start..end (inclusive, either may be None), optionally for one staff member;
+    #always [] unless recurrence_rules is set
+    def get_rules(self, start=None, end=None, staff_id=None, staff_ids=None):
+        if not self.recurrence_rules:
+            return []
+        if staff_ids is not None and not staff_ids:
+            return []
+        query = self.supabase.from_('schedule_rule').select('*')
+        if start:
+            query = query.gte('enddate', start)
+        if end:
+            query = query.lte('startdate', end)
+        if staff_id is not None:
+            query = query.eq('staff_id', staff_id)
+        if staff_ids is not None:
+            query = query.in_('staff_id', list(staff_ids))
+        return query.execute().data
 
     
-    def get_own_schedule(self,staff_id):
-        return self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position, schedule!inner(schedule_id, staff_id, date, time_slot)').eq('Staff_ID', staff_id).execute()
+    def get_own_schedule(self,staff_id, start=None, end=None):
+        query = self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position, schedule!inner(schedule_id, staff_id, date, time_slot)').eq('Staff_ID', staff_id)
+        return self._within_window(query, start, end).execute()
     
     #for special logic for CEO and directors
     def get_ceo(self):
+        if self.org_chart is not None:
+            return self.org_chart.ceo_id()
         return int(self.supabase.from_('Employee').select('Staff_ID').eq("Position", "MD").execute().data[0]["Staff_ID"])
 
     #for all depts filter
     def get_all_employees(self):
+        if self.org_chart is not None:
+            return CachedResponse(self.org_chart.employees())
         return self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position').execute()
 
-    def get_schedules_for_all_depts(self):
-        return self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position, schedule!inner(schedule_id, staff_id, date, time_slot)').execute()
+    def get_schedules_for_all_depts(self, start=None, end=None):
+        query = self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position, schedule!inner(schedule_id, staff_id, date, time_slot)')
+        return self._within_window(query, start, end).execute()
 
     #for dept specified, all teams filter
     def get_all_employees_by_dept(self, dept):
+        if self.org_chart is not None:
+            return CachedResponse(self.org_chart.dept_roster(dept))
         return self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position').eq("Dept", dept).execute()
     
-    def get_schedules_by_dept(self, dept):
-        return self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position, schedule!inner(schedule_id, staff_id, date, time_slot)').eq("Dept", dept).execute()
+    def get_schedules_by_dept(self, dept, start=None, end=None):
+        query = self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position, schedule!inner(schedule_id, staff_id, date, time_slot)').eq("Dept", dept)
+        return self._within_window(query, start, end).execute()
 
     #for teams filter
-    def get_schedules_by_reporting_manager(self, dept, reporting_manager):
-        return self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position, schedule!inner(schedule_id, staff_id, date, time_slot)').eq("Dept", dept).eq("Reporting_Manager", reporting_manager).execute()
+    def get_schedules_by_reporting_manager(self, dept, reporting_manager, start=None, end=None):
+        query = self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position, schedule!inner(schedule_id, staff_id, date, time_slot)').eq("Dept", dept).eq("Reporting_Manager", reporting_manager)
+        return self._within_window(query, start, end).execute()
 
     def get_all_employees_by_reporting_manager(self, dept, reporting_manager):
+        if self.org_chart is not None:
+            return CachedResponse([employee for employee in self.org_chart.direct_reports(reporting_manager) if employee["Dept"] == dept])
         return self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position').eq("Dept", dept).eq("Reporting_Manager", reporting_manager).execute()
     
     #for directors team
     def get_all_directors(self, reporting_manager):
-        return self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position').eq("Reporting_Manager", reporting_manager).neq("Postion", "MD").execute()
+        if self.org_chart is not None:
+            return CachedResponse([employee for employee in self.org_chart.direct_reports(reporting_manager) if employee["Position"] != "MD"])
+        return self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position').eq("Reporting_Manager", reporting_manager).neq("Position", "MD").execute()
     
-    def get_directors_schedules(self, reporting_manager):
-        return self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position, schedule!inner(schedule_id, staff_id, date, time_slot)').eq("Reporting_Manager", reporting_manager).neq("Postion", "MD").execute()
+    def get_directors_schedules(self, reporting_manager, start=None, end=None):
+        query = self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position, schedule!inner(schedule_id, staff_id, date, time_slot)').eq("Reporting_Manager", reporting_manager).neq("Position", "MD")
+        return self._within_window(query, start, end).execute()
+
+    #roster and its schedule rows in one query; the left embed keeps staff with no rows in the window
+    def get_roster_with_schedules(self, dept=None, reporting_manager=None, exclude_md=False, start=None, end=None):
+        query = self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position, schedule(schedule_id, staff_id, date, time_slot)')
+        if dept is not None:
+            query = query.eq("Dept", dept)
+        if reporting_manager is not None:
+            query = query.eq("Reporting_Manager", reporting_manager)
+        if exclude_md:
+            query = query.neq("Position", "MD")
+        return self._within_window(query, start, end).execute()
+
+    #date window on the embedded schedule rows, bounds are inclusive YYYY-MM-DD strings
+    def _within_window(self, query, start, end):
+        if start:
+            query = query.gte("schedule.date", start)
+        if end:
+            query = query.lte("schedule.date", end)
+        return query
     
     #for data transform
-    def format_schedules(self, response, allnames):
+    #allnames may be omitted when response comes from get_roster_with_schedules, whose rows are the roster
+    #rules are schedule_rule rows (get_rules) whose dates in the window are added to the WFH lists
+    def format_schedules(self, response, allnames=None, start=None, end=None, rules=None):
         try:
             responselist = list(response.data)
         except:
             return {"code": 404, "message": "No data or bad data"}, 404
+        return {"schedules": list(self._slot_objects(responselist, response if allnames is None else allnames, start, end, rules))}, 200
 
-        # Process the schedule data
-        schedulelist = []
-        for i in range(len(responselist)):
-            for j in range(len(responselist[i]["schedule"])):
-                schedulelist.append({
-                    "dept": responselist[i]["Dept"],
-                    "staff_fname": responselist[i]["Staff_FName"],
-                    "staff_lname": responselist[i]["Staff_LName"],
-                    "date": responselist[i]["schedule"][j]["date"],
-                    "schedule_id": responselist[i]["schedule"][j]["schedule_id"],
-                    "time_slot": responselist[i]["schedule"][j]["time_slot"],
-                    "staff_id": responselist[i]["Staff_ID"],
-                    "position": responselist[i]["Position"],
-                    "dept": responselist[i]["Dept"]
-                })
-
-        # Compress the list of schedules to create a NameList for each datetime
-        dict1 = {}
-        for item in schedulelist:
-            temp = {
-                "Date": item["date"],
-                "Time_Slot": item["time_slot"],
-                "Name_List": [{"staff_id": item["staff_id"], "staff_fname": item["staff_fname"], "staff_lname": item["staff_lname"], "dept": item["dept"], "position": item["position"]}]
-            }
-            if (item["date"], item["time_slot"]) not in dict1:
-                dict1[(item["date"], item["time_slot"])] = temp
-            else:
-                dict1[(item["date"], item["time_slot"])]["Name_List"].append({"staff_id": item["staff_id"], "staff_fname": item["staff_fname"], "staff_lname": item["staff_lname"], "dept": item["dept"], "position": item["position"]})
+    #same document as format_schedules, yielded as JSON text one slot object at a time
+    def stream_schedules(self, response, allnames=None, start=None, end=None, rules=None):
+        try:
+            responselist = list(response.data)
+        except:
+            yield self._dumps({"code": 404, "message": "No data or bad data"})
+            return
+        yield '{"schedules":['
+        for i, slot in enumerate(self._slot_objects(responselist, response if allnames is None else allnames, start, end, rules)):
+            yield ("," if i else "") + self._dumps(slot)
+        yield "]}\n"
+
+    @staticmethod
+    def _dumps(obj):
+        return current_app.json.dumps(obj, separators=(",", ":"))
+
+    #yields the frontend slot objects; inOffice lists are built per slot so callers can stream them out
+    def _slot_objects(self, responselist, allnames, start, end, rules=None):
+        dict1, wfh_keys = self._group_by_slot(responselist, start, end, rules, allnames.data)
 
         # Convert data into the final format for frontend
-        returnlist = []
-        allnamelist = [{"staff_id": employee["Staff_ID"], "staff_fname": employee["Staff_FName"], "staff_lname": employee["Staff_LName"], "dept": employee["Dept"], "position": employee["Position"]} for employee in allnames.data]
+        allnamelist = [self._name_entry(employee) for employee in allnames.data]
+        allnamekeys = [self._name_key(employee) for employee in allnamelist]
 
         for key in dict1:
             time_slot_data = dict1[key]
-            time_slot_label = "AM" if time_slot_data["Time_Slot"] == 1 else "PM"
-            time_start = f'{time_slot_data["Date"]} 09:00' if time_slot_label == "AM" else f'{time_slot_data["Date"]} 14:00'
-            time_end = f'{time_slot_data["Date"]} 13:00' if time_slot_label == "AM" else f'{time_slot_data["Date"]} 18:00'
-            in_office = [employee for employee in allnamelist if employee not in time_slot_data["Name_List"]]
+            time_slot_label, time_start, time_end = self._slot_times(time_slot_data["Date"], time_slot_data["Time_Slot"])
+            slot_keys = wfh_keys[key]
+            in_office = [employee for employee, name_key in zip(allnamelist, allnamekeys) if name_key not in slot_keys]
 
-            returnlist.append({
+            yield {
                 "start": time_start,
                 "end": time_end,
                 "class": time_slot_label,
@@ -93,5 +173,136 @@ class SchedulesService:
                 "count": len(time_slot_data["Name_List"]),
                 "title": len(time_slot_data["Name_List"]),
                 "inOffice": in_office
+            }
+
+    #format=compact: the roster is sent once as rows of COMPACT_FIELDS, each slot's WFH is a list of
+    #roster indices and inOffice is a base64 bitmap over the first in_office_size roster rows
+    #(bit i is (byte[i >> 3] >> (i & 7)) & 1). aiowa/src/utils/decodeSchedules.js expands it back.
+    def format_schedules_compact(self, response, allnames=None, start=None, end=None, rules=None):
+        try:
+            responselist = list(response.data)
+        except:
+            return {"code": 404, "message": "No data or bad data"}, 404
+        if allnames is None:
+            allnames = response
+
+        dict1, wfh_keys = self._group_by_slot(responselist, start, end, rules, allnames.data)
+        allnamelist = [self._name_entry(employee) for employee in allnames.data]
+        allnamekeys = [self._name_key(employee) for employee in allnamelist]
+
+        # WFH staff missing from allnames (e.g. on the own-schedule view) are appended after it
+        roster = list(allnamekeys)
+        index_of = {}
+        for i, name_key in enumerate(allnamekeys):
+            index_of.setdefault(name_key, i)
+
+        returnlist = []
+        for key in dict1:
+            time_slot_data = dict1[key]
+            time_slot_label, time_start, time_end = self._slot_times(time_slot_data["Date"], time_slot_data["Time_Slot"])
+            wfh = []
+            for name in time_slot_data["Name_List"]:
+                name_key = self._name_key(name)
+                if name_key not in index_of:
+                    index_of[name_key] = len(roster)
+                    roster.append(name_key)
+                wfh.append(index_of[name_key])
+            slot_keys = wfh_keys[key]
+            in_office = self._pack_bits([name_key not in slot_keys for name_key in allnamekeys])
+
+            returnlist.append({
+                "start": time_start,
+                "end": time_end,
+                "class": time_slot_label,
+                "WFH": wfh,
+                "count": len(wfh),
+                "title": len(wfh),
+                "inOffice": base64.b64encode(in_office).decode("ascii")
+            })
+        return {
+            "format": "compact",
+            "fields": self.COMPACT_FIELDS,
+            "roster": [list(name_key) for name_key in roster],
+            "in_office_size": len(allnamekeys),
+            "schedules": returnlist
+        }, 200
+
+    @staticmethod
+    def _pack_bits(flags):
+        packed = bytearray((len(flags) + 7) // 8)
+        for i, flag in enumerate(flags):
+            if flag:
+                packed[i >> 3] |= 1 << (i & 7)
+        return bytes(packed)
+
+    def _group_by_slot(self, responselist, start, end, rules=None, roster=()):
+        # Compress the schedule rows to create a NameList for each datetime.
+        # wfh_keys mirrors each NameList as a set so the inOffice filter below
+        # is a hash lookup instead of a scan over the NameList.
+        dict1 = {}
+        wfh_keys = {}
+
+        def add(name, name_key, date, time_slot):
+            key = (date, time_slot)
+            if key not in dict1:
+                dict1[key] = {
+                    "Date": date,
+                    "Time_Slot": time_slot,
+                    "Name_List": []
+                }
+                wfh_keys[key] = set()
+            dict1[key]["Name_List"].append(dict(name))
+            wfh_keys[key].add(name_key)
+
+        for employee in responselist:
+            name = self._name_entry(employee)
+            name_key = self._name_key(name)
+            for slot in employee["schedule"]:
+                if (start and slot["date"] < start) or (end and slot["date"] > end):
+                    continue
+                add(name, name_key, slot["date"], slot["time_slot"])
+
+        # Recurring rules are expanded over the window only; staff outside this view's rows and roster are left out
+        if rules:
+            names = {}
+            for employee in list(responselist) + list(roster):
+                names.setdefault(employee["Staff_ID"], self._name_entry(employee))
+            for rule in rules:
+                name = names.get(rule["staff_id"])
+                if name is None:
+                    continue
+                name_key = self._name_key(name)
+                for row in rule_rows(rule, start, end):
+                    if name_key not in wfh_keys.get((row["date"], row["time_slot"]), ()):
+                        add(name, name_key, row["date"], row["time_slot"])
+        return dict1, wfh_keys
+
+    #count-only slot objects (no WFH/inOffice lists) from OccupancySummaryService.get_counts rows
+    def format_counts(self, counts):
+        returnlist = []
+        for row in counts:
+            time_slot_label, time_start, time_end = self._slot_times(row["date"], row["time_slot"])
+            returnlist.append({
+                "start": time_start,
+                "end": time_end,
+                "class": time_slot_label,
+                "count": row["count"],
+                "title": row["count"]
             })
         return {"schedules": returnlist}, 200
+
+    @staticmethod
+    def _slot_times(date, time_slot):
+        time_slot_label = "AM" if time_slot == 1 else "PM"
+        time_start = f'{date} 09:00' if time_slot_label == "AM" else f'{date} 14:00'
+        time_end = f'{date} 13:00' if time_slot_label == "AM" else f'{date} 18:00'
+        return time_slot_label, time_start, time_end
+
+    @staticmethod
+    def _name_entry(employee):
+        return {"staff_id": employee["Staff_ID"], "staff_fname": employee["Staff_FName"], "staff_lname": employee["Staff_LName"], "dept": employee["Dept"], "position": employee["Position"]}
+
+    @staticmethod
+    def _name_key(name):
+        # Hashable stand-in for a name entry; two entries compare equal exactly when their keys do
+        return (name["staff_id"], name["staff_fname"], name["staff_lname"], name["dept"], name["position"])
@@ -1,10 +1,19 @@
 from flask import jsonify, request, abort, make_response
+from .fanout import fan_out_map
 
 class TeamsService:
-    def __init__(self, supabase_client):
+    def __init__(self, supabase_client, org_chart=None):
         self.supabase = supabase_client
+        # Staff and manager lookups are served from the shared OrgChartCache when one is given
+        self.org_chart = org_chart
 
     def get_staff_by_department(self, department):
+        if self.org_chart is not None:
+            if department == "CEO":
+                return self.org_chart.position_roster('Director')
+            elif department != "All":
+                return self.org_chart.dept_roster(department)
+            return self.org_chart.employees()
         staff_query = self.supabase.from_('Employee').select('Staff_ID, Staff_FName, Staff_LName, Dept, Position, Reporting_Manager')
         if department == "CEO":
             staff_query = staff_query.eq("Position", 'Director')
@@ -14,6 +23,11 @@ class TeamsService:
         return response.data
 
     def get_manager_name(self, manager_id):
+        if self.org_chart is not None:
+            manager = self.org_chart.get(manager_id)
+            if manager:
+                return f"{manager['Staff_FName']} {manager['Staff_LName']}"
+            return "Unknown"
         manager_response = self.supabase.from_('Employee').select('Staff_FName, Staff_LName').eq('Staff_ID', manager_id).execute()
         if manager_response.data:
             manager_fname = manager_response.data[0]['Staff_FName']
@@ -66,6 +80,13 @@ class TeamsController:
         positions_set = set(item['Position'] for item in staff_data)
         positions_list = list(positions_set)
 
+        # Manager names are looked up concurrently, one query per distinct manager
+        manager_ids = list(dict.fromkeys(item['Reporting_Manager'] for item in staff_data))
+        try:
+            manager_names = dict(zip(manager_ids, fan_out_map(self.teams_service.get_manager_name, manager_ids)))
+        except TimeoutError as e:
+            return make_response(jsonify({"error": str(e)}), 504)
+
         teams_by_manager = {}
         for item in staff_data:
             manager_id = item['Reporting_Manager']
@@ -75,9 +96,8 @@ class TeamsController:
             position = item['Position']
 
             if manager_id not in teams_by_manager:
-                manager_name = self.teams_service.get_manager_name(manager_id)
                 teams_by_manager[manager_id] = {
-                    "manager_name": manager_name,
+                    "manager_name": manager_names[manager_id],
                     "teams": {}
                 }
 
@@ -0,0 +1,47 @@
+import hashlib
+from flask import Response, current_app, request
+
+
+class ChangeVersion:
+    # Database-wide change counter behind the ETags on polled listings.
+    # Every mutating endpoint bumps it, so an unchanged version means unchanged listings.
+    # It lives in the change_version table (supabase/migrations) so all Lambda instances agree.
+    def __init__(self, supabase):
+        self.supabase = supabase
+
+    def current(self):
+        try:
+            return self.supabase.from_('change_version').select('version').eq('id', 1).execute().data[0]['version']
+        except Exception as e:
+            current_app.logger.error("Failed to read change version: %s", str(e))
+            return None
+
+    def bump(self):
+        try:
+            return self.supabase.rpc('bump_change_version', {}).execute().data
+        except Exception as e:
+            current_app.logger.error("Failed to bump change version: %s", str(e))
+            return None
+
+    #strong ETag for the current request at the current version, or None when the version is unavailable
+    def etag(self, *parts):
+        version = self.current()
+        if version is None:
+            return None
+        key = repr((version, request.full_path) + parts)
+        return hashlib.sha256(key.encode()).hexdigest()
+
+
+def not_modified(etag):
+    # 304 for a conditional GET whose If-None-Match already names this ETag, otherwise None
+    if etag is not None and request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
+
+
+def with_etag(response, etag):
+    if etag is not None and response.status_code == 200:
+        response.set_etag(etag)
+    return response
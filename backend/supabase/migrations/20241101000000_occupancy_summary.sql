@@ -0,0 +1,41 @@
+-- WFH counts per team and slot, maintained incrementally by the API
+-- (OccupancySummaryService in flaskapp/models/occupancy_summary.py).
+
+create table if not exists public.occupancy_summary (
+    dept text not null,
+    reporting_manager integer not null,
+    date date not null,
+    time_slot integer not null,
+    wfh_count integer not null default 0,
+    primary key (dept, reporting_manager, date, time_slot)
+);
+
+-- deltas: [{"dept", "reporting_manager", "date", "time_slot", "delta"}, ...], one entry per key
+create or replace function public.bump_occupancy(deltas jsonb)
+returns void
+language sql
+as $$
+    insert into public.occupancy_summary (dept, reporting_manager, date, time_slot, wfh_count)
+    select d->>'dept', (d->>'reporting_manager')::integer, (d->>'date')::date, (d->>'time_slot')::integer, (d->>'delta')::integer
+    from jsonb_array_elements(deltas) as d
+    on conflict (dept, reporting_manager, date, time_slot)
+    do update set wfh_count = public.occupancy_summary.wfh_count + excluded.wfh_count;
+$$;
+
+create or replace function public.rebuild_occupancy_summary()
+returns integer
+language plpgsql
+as $$
+declare
+    written integer;
+begin
+    delete from public.occupancy_summary where true;
+    insert into public.occupancy_summary (dept, reporting_manager, date, time_slot, wfh_count)
+    select e."Dept", e."Reporting_Manager", s.date, s.time_slot, count(*)
+    from public.schedule s
+    join public."Employee" e on e."Staff_ID" = s.staff_id
+    group by e."Dept", e."Reporting_Manager", s.date, s.time_slot;
+    get diagnostics written = row_count;
+    return written;
+end;
+$$;
@@ -0,0 +1,16 @@
+-- Single-row change counter behind the ETags on /schedules, /requests/<staff_id> and /team/requests
+-- (ChangeVersion in flaskapp/models/versioning.py). Every mutating endpoint bumps it.
+
+create table if not exists public.change_version (
+    id integer primary key default 1 check (id = 1),
+    version bigint not null default 0
+);
+
+insert into public.change_version (id, version) values (1, 0) on conflict (id) do nothing;
+
+create or replace function public.bump_change_version()
+returns bigint
+language sql
+as $$
+    update public.change_version set version = version + 1 where id = 1 returning version;
+$$;
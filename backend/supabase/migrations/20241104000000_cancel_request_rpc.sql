@@ -0,0 +1,35 @@
+-- Cancel an approved WFH request: delete the request and its schedule rows in one transaction
+-- (RequestService.cancel_request in flaskapp/models/requests.py). P0002 -> 404.
+-- Returns {"request": <deleted request row>, "schedule": [<deleted schedule rows>]}.
+create or replace function public.cancel_request(p_request_id bigint)
+returns jsonb
+language plpgsql
+as $$
+declare
+    req public.request%rowtype;
+    deleted jsonb;
+begin
+    delete from public.request where request_id = p_request_id returning * into req;
+    if not found then
+        raise exception 'Request % not found', p_request_id using errcode = 'P0002';
+    end if;
+
+    with rows as (
+        delete from public.schedule where request_id = p_request_id
+        returning staff_id, date, time_slot, request_id
+    )
+    select coalesce(jsonb_agg(to_jsonb(rows) order by rows.date, rows.time_slot), '[]'::jsonb) into deleted from rows;
+
+    update public.occupancy_summary o
+    set wfh_count = o.wfh_count - r.removed
+    from (
+        select e."Dept" as dept, e."Reporting_Manager" as reporting_manager, r.date, r.time_slot, count(*) as removed
+        from jsonb_to_recordset(deleted) as r(date date, time_slot integer)
+        join public."Employee" e on e."Staff_ID" = req.staff_id
+        group by e."Dept", e."Reporting_Manager", r.date, r.time_slot
+    ) r
+    where o.dept = r.dept and o.reporting_manager = r.reporting_manager and o.date = r.date and o.time_slot = r.time_slot;
+
+    return jsonb_build_object('request', to_jsonb(req), 'schedule', deleted);
+end;
+$$;
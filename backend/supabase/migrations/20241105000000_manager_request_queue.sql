@@ -0,0 +1,9 @@
+-- Requests joined to the requester's reporting manager, so a manager's approval queue is one
+-- filtered query (RequestService.get_team_requests in flaskapp/models/requests.py).
+create or replace view public.manager_request_queue as
+select r.*, e."Reporting_Manager" as reporting_manager
+from public.request r
+join public."Employee" e on e."Staff_ID" = r.staff_id;
+
+create index if not exists employee_reporting_manager_idx on public."Employee" ("Reporting_Manager");
+create index if not exists request_staff_status_idx on public.request (staff_id, status, request_id);
@@ -0,0 +1,67 @@
+-- approve_request no longer writes schedule rows the staff member already has for that date and slot,
+-- e.g. from an earlier overlapping request (see 20241103000000_approval_rpc.sql).
+create or replace function public.approve_request(
+    p_request_id bigint,
+    p_result_reason text,
+    p_approved_dates date[],
+    p_horizon_days integer default 365
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    req public.request%rowtype;
+    first_date date;
+    inserted jsonb;
+begin
+    select * into req from public.request where request_id = p_request_id for update;
+    if not found then
+        raise exception 'Request % not found', p_request_id using errcode = 'P0002';
+    end if;
+    if req.status <> 0 then
+        raise exception 'Request % is not pending', p_request_id using errcode = 'P0001';
+    end if;
+
+    first_date := (select min(d) from unnest(p_approved_dates) as d);
+
+    with dates as (
+        select g::date as date
+        from generate_series(first_date, first_date + p_horizon_days, interval '1 day') as g
+        where req.request_type = 2
+          and extract(isodow from g) in (select extract(isodow from d) from unnest(p_approved_dates) as d)
+        union
+        select d
+        from unnest(p_approved_dates) as d
+        where req.request_type <> 2
+    ),
+    slots as (
+        select unnest(case when req.time_slot::integer = 3 then array[1, 2] else array[req.time_slot::integer] end) as time_slot
+        where req.time_slot::integer in (1, 2, 3)
+    ),
+    rows as (
+        insert into public.schedule (staff_id, date, time_slot, request_id)
+        select req.staff_id, dates.date, slots.time_slot, req.request_id
+        from dates cross join slots
+        where not exists (
+            select 1 from public.schedule s
+            where s.staff_id = req.staff_id and s.date = dates.date and s.time_slot = slots.time_slot
+        )
+        returning staff_id, date, time_slot, request_id
+    )
+    select coalesce(jsonb_agg(to_jsonb(rows) order by rows.date, rows.time_slot), '[]'::jsonb) into inserted from rows;
+
+    insert into public.occupancy_summary (dept, reporting_manager, date, time_slot, wfh_count)
+    select e."Dept", e."Reporting_Manager", r.date, r.time_slot, count(*)
+    from jsonb_to_recordset(inserted) as r(date date, time_slot integer)
+    join public."Employee" e on e."Staff_ID" = req.staff_id
+    group by e."Dept", e."Reporting_Manager", r.date, r.time_slot
+    on conflict (dept, reporting_manager, date, time_slot)
+    do update set wfh_count = public.occupancy_summary.wfh_count + excluded.wfh_count;
+
+    update public.request set status = 1, result_reason = p_result_reason where request_id = p_request_id;
+
+    return jsonb_build_object('request', to_jsonb(req), 'schedule', inserted);
+end;
+$$;
+
+create index if not exists schedule_staff_date_slot_idx on public.schedule (staff_id, date, time_slot);
@@ -0,0 +1,18 @@
+-- Background materialisation of approved requests (ApprovalJobService in flaskapp/models/approval_jobs.py).
+-- With ASYNC_APPROVAL on, /request/<id>/approve records the decision, queues a job here and returns 202;
+-- a worker writes the schedule rows and GET /jobs/<job_id> reports progress.
+
+create table if not exists public.approval_job (
+    job_id uuid primary key default gen_random_uuid(),
+    request_id bigint not null references public.request (request_id) on delete cascade,
+    approved_dates date[] not null default '{}',
+    status text not null default 'queued' check (status in ('queued', 'running', 'done', 'failed')),
+    rows_written integer,
+    rows_skipped integer,
+    failed_chunks jsonb,
+    error text,
+    created_at timestamptz not null default now(),
+    updated_at timestamptz not null default now()
+);
+
+create index if not exists approval_job_request_id_idx on public.approval_job (request_id);
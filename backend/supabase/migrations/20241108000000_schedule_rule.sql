@@ -0,0 +1,183 @@
+-- Recurring WFH arrangements stored as one rule per approved request instead of a year of schedule rows
+-- (RECURRENCE_RULES in flaskapp/models/recurrence.py). Readers expand a rule only over the dates they ask for.
+-- Bit d of weekday_mask is ISO weekday d + 1 (bit 0 = Monday); exceptions are dates the rule skips.
+
+create table if not exists public.schedule_rule (
+    rule_id bigint generated by default as identity primary key,
+    request_id bigint not null unique references public.request (request_id) on delete cascade,
+    staff_id bigint not null,
+    weekday_mask smallint not null check (weekday_mask between 1 and 127),
+    time_slot integer not null check (time_slot in (1, 2, 3)),
+    startdate date not null,
+    enddate date not null check (enddate >= startdate),
+    exceptions date[] not null default '{}'
+);
+
+create index if not exists schedule_rule_staff_id_idx on public.schedule_rule (staff_id);
+create index if not exists schedule_rule_window_idx on public.schedule_rule (startdate, enddate);
+
+-- The (staff_id, date, time_slot, request_id) rows the rules stand for, limited to p_start..p_end
+-- (either may be null) and to one request when p_request_id is given
+create or replace function public.expand_schedule_rules(
+    p_start date default null,
+    p_end date default null,
+    p_request_id bigint default null
+)
+returns table (staff_id bigint, date date, time_slot integer, request_id bigint)
+language sql
+stable
+as $$
+    select r.staff_id, g::date, slot, r.request_id
+    from public.schedule_rule r
+    cross join lateral generate_series(greatest(r.startdate, coalesce(p_start, r.startdate)),
+                                       least(r.enddate, coalesce(p_end, r.enddate)), interval '1 day') as g
+    cross join lateral unnest(case when r.time_slot = 3 then array[1, 2] else array[r.time_slot] end) as slot
+    where (p_request_id is null or r.request_id = p_request_id)
+      and (r.weekday_mask >> (extract(isodow from g)::integer - 1)) & 1 = 1
+      and not (g::date = any(r.exceptions));
+$$;
+
+-- approve_request gains p_recurrence_rule: when true a recurring request (request_type 2) is stored as a
+-- schedule_rule row and "schedule" in the result holds its expanded rows (nothing is written to schedule).
+-- The old signature is dropped so PostgREST has a single candidate to call.
+drop function if exists public.approve_request(bigint, text, date[], integer);
+
+create or replace function public.approve_request(
+    p_request_id bigint,
+    p_result_reason text,
+    p_approved_dates date[],
+    p_horizon_days integer default 365,
+    p_recurrence_rule boolean default false
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    req public.request%rowtype;
+    first_date date;
+    inserted jsonb;
+    rule public.schedule_rule%rowtype;
+begin
+    select * into req from public.request where request_id = p_request_id for update;
+    if not found then
+        raise exception 'Request % not found', p_request_id using errcode = 'P0002';
+    end if;
+    if req.status <> 0 then
+        raise exception 'Request % is not pending', p_request_id using errcode = 'P0001';
+    end if;
+
+    first_date := (select min(d) from unnest(p_approved_dates) as d);
+
+    if p_recurrence_rule and req.request_type = 2 then
+        insert into public.schedule_rule (request_id, staff_id, weekday_mask, time_slot, startdate, enddate)
+        select req.request_id, req.staff_id,
+               (select sum(distinct 1 << (extract(isodow from d)::integer - 1))::smallint from unnest(p_approved_dates) as d),
+               req.time_slot::integer, first_date, first_date + p_horizon_days
+        returning * into rule;
+
+        select coalesce(jsonb_agg(to_jsonb(rows) order by rows.date, rows.time_slot), '[]'::jsonb) into inserted
+        from public.expand_schedule_rules(null, null, req.request_id) as rows;
+    else
+        with dates as (
+            select g::date as date
+            from generate_series(first_date, first_date + p_horizon_days, interval '1 day') as g
+            where req.request_type = 2
+              and extract(isodow from g) in (select extract(isodow from d) from unnest(p_approved_dates) as d)
+            union
+            select d
+            from unnest(p_approved_dates) as d
+            where req.request_type <> 2
+        ),
+        slots as (
+            select unnest(case when req.time_slot::integer = 3 then array[1, 2] else array[req.time_slot::integer] end) as time_slot
+            where req.time_slot::integer in (1, 2, 3)
+        ),
+        rows as (
+            insert into public.schedule (staff_id, date, time_slot, request_id)
+            select req.staff_id, dates.date, slots.time_slot, req.request_id
+            from dates cross join slots
+            where not exists (
+                select 1 from public.schedule s
+                where s.staff_id = req.staff_id and s.date = dates.date and s.time_slot = slots.time_slot
+            )
+            returning staff_id, date, time_slot, request_id
+        )
+        select coalesce(jsonb_agg(to_jsonb(rows) order by rows.date, rows.time_slot), '[]'::jsonb) into inserted from rows;
+    end if;
+
+    insert into public.occupancy_summary (dept, reporting_manager, date, time_slot, wfh_count)
+    select e."Dept", e."Reporting_Manager", r.date, r.time_slot, count(*)
+    from jsonb_to_recordset(inserted) as r(date date, time_slot integer)
+    join public."Employee" e on e."Staff_ID" = req.staff_id
+    group by e."Dept", e."Reporting_Manager", r.date, r.time_slot
+    on conflict (dept, reporting_manager, date, time_slot)
+    do update set wfh_count = public.occupancy_summary.wfh_count + excluded.wfh_count;
+
+    update public.request set status = 1, result_reason = p_result_reason where request_id = p_request_id;
+
+    return jsonb_build_object('request', to_jsonb(req), 'schedule', inserted,
+                              'rule', case when rule.rule_id is null then null else to_jsonb(rule) end);
+end;
+$$;
+
+-- cancel_request also removes the request's rule; its expanded rows are reported (and taken off the
+-- occupancy summary) alongside the deleted schedule rows
+create or replace function public.cancel_request(p_request_id bigint)
+returns jsonb
+language plpgsql
+as $$
+declare
+    req public.request%rowtype;
+    ruled jsonb;
+    deleted jsonb;
+begin
+    -- Expanded before the request is deleted, since the delete cascades to the rule
+    select coalesce(jsonb_agg(to_jsonb(rows)), '[]'::jsonb) into ruled
+    from public.expand_schedule_rules(null, null, p_request_id) as rows;
+
+    delete from public.request where request_id = p_request_id returning * into req;
+    if not found then
+        raise exception 'Request % not found', p_request_id using errcode = 'P0002';
+    end if;
+
+    with rows as (
+        delete from public.schedule where request_id = p_request_id
+        returning staff_id, date, time_slot, request_id
+    )
+    select coalesce(jsonb_agg(to_jsonb(rows) order by rows.date, rows.time_slot), '[]'::jsonb) || ruled into deleted from rows;
+
+    update public.occupancy_summary o
+    set wfh_count = o.wfh_count - r.removed
+    from (
+        select e."Dept" as dept, e."Reporting_Manager" as reporting_manager, r.date, r.time_slot, count(*) as removed
+        from jsonb_to_recordset(deleted) as r(date date, time_slot integer)
+        join public."Employee" e on e."Staff_ID" = req.staff_id
+        group by e."Dept", e."Reporting_Manager", r.date, r.time_slot
+    ) r
+    where o.dept = r.dept and o.reporting_manager = r.reporting_manager and o.date = r.date and o.time_slot = r.time_slot;
+
+    return jsonb_build_object('request', to_jsonb(req), 'schedule', deleted);
+end;
+$$;
+
+create or replace function public.rebuild_occupancy_summary()
+returns integer
+language plpgsql
+as $$
+declare
+    written integer;
+begin
+    delete from public.occupancy_summary where true;
+    insert into public.occupancy_summary (dept, reporting_manager, date, time_slot, wfh_count)
+    select e."Dept", e."Reporting_Manager", s.date, s.time_slot, count(*)
+    from (
+        select staff_id, date, time_slot from public.schedule
+        union all
+        select staff_id, date, time_slot from public.expand_schedule_rules()
+    ) s
+    join public."Employee" e on e."Staff_ID" = s.staff_id
+    group by e."Dept", e."Reporting_Manager", s.date, s.time_slot;
+    get diagnostics written = row_count;
+    return written;
+end;
+$$;
@@ -0,0 +1,7 @@
+-- Client-supplied Idempotency-Key for POST /requests/ (RequestService.create_request):
+-- a retried submission finds the request its first attempt created instead of inserting another.
+alter table public.request add column if not exists idempotency_key text;
+
+create unique index if not exists request_staff_idempotency_key_idx
+    on public.request (staff_id, idempotency_key)
+    where idempotency_key is not null;
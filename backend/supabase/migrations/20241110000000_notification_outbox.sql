@@ -0,0 +1,36 @@
+-- Queued notifications (NotificationOutbox in flaskapp/models/outbox.py, NOTIFICATION_OUTBOX=supabase).
+-- Routes insert a row instead of calling SNS; `flask notify-drain` or the Zappa schedule delivers them.
+
+create table if not exists public.notification_outbox (
+    id bigint generated by default as identity primary key,
+    kind text not null,
+    payload jsonb,
+    status text not null default 'pending' check (status in ('pending', 'sending', 'sent', 'failed')),
+    attempts integer not null default 0,
+    next_attempt_at timestamptz not null default now(),
+    claimed_at timestamptz,
+    last_error text,
+    created_at timestamptz not null default now(),
+    sent_at timestamptz
+);
+
+create index if not exists notification_outbox_due_idx on public.notification_outbox (next_attempt_at) where status in ('pending', 'sending');
+
+-- Claims up to p_limit due rows (and rows stuck in 'sending' for p_claim_timeout seconds) for one dispatcher.
+-- skip locked lets concurrent dispatchers take disjoint batches.
+create or replace function public.claim_notifications(p_limit integer, p_claim_timeout double precision default 300)
+returns setof public.notification_outbox
+language sql
+as $$
+    update public.notification_outbox o
+    set status = 'sending', claimed_at = now(), attempts = o.attempts + 1
+    where o.id in (
+        select id from public.notification_outbox
+        where (status = 'pending' and next_attempt_at <= now())
+           or (status = 'sending' and claimed_at <= now() - make_interval(secs => p_claim_timeout))
+        order by id
+        limit p_limit
+        for update skip locked
+    )
+    returning o.*;
+$$;
@@ -0,0 +1,27 @@
+-- occupancy_summary files each count under the employee's Dept / Reporting_Manager at write time,
+-- so moving someone to another team leaves their existing WFH days counted under the old one.
+-- Rebuild the summary whenever an update to Employee changes anyone's team.
+
+create or replace function public.rebuild_occupancy_on_team_change()
+returns trigger
+language plpgsql
+as $$
+begin
+    if exists (
+        select 1
+        from old_rows o
+        join new_rows n on n."Staff_ID" = o."Staff_ID"
+        where o."Dept" is distinct from n."Dept"
+           or o."Reporting_Manager" is distinct from n."Reporting_Manager"
+    ) then
+        perform public.rebuild_occupancy_summary();
+    end if;
+    return null;
+end;
+$$;
+
+drop trigger if exists employee_team_change on public."Employee";
+create trigger employee_team_change
+after update on public."Employee"
+referencing old table as old_rows new table as new_rows
+for each statement execute function public.rebuild_occupancy_on_team_change();
@@ -0,0 +1,3 @@
+-- Views run with their owner's rights by default, so reads of manager_request_queue through PostgREST
+-- skipped the row level security policies on request. Check them against the calling role instead.
+alter view public.manager_request_queue set (security_invoker = true);
@@ -0,0 +1,38 @@
+-- Recovery for background approvals (ApprovalJobService in flaskapp/models/approval_jobs.py).
+-- attempts counts runs, so a rerun knows to remove what an earlier run wrote first, and
+-- submit_approval_job approves the request and queues its job in one transaction, so a failed
+-- insert can no longer leave a request approved with nothing to write its schedule.
+
+alter table public.approval_job add column if not exists attempts integer not null default 0;
+
+create index if not exists approval_job_status_updated_at_idx on public.approval_job (status, updated_at);
+
+create or replace function public.submit_approval_job(
+    p_request_id bigint,
+    p_result_reason text,
+    p_approved_dates date[]
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    req public.request%rowtype;
+    job public.approval_job%rowtype;
+begin
+    select * into req from public.request where request_id = p_request_id for update;
+    if not found then
+        raise exception 'Request % not found', p_request_id using errcode = 'P0002';
+    end if;
+    if req.status <> 0 then
+        raise exception 'Request % is not pending', p_request_id using errcode = 'PT409';
+    end if;
+
+    update public.request set status = 1, result_reason = p_result_reason where request_id = p_request_id;
+
+    insert into public.approval_job (request_id, approved_dates)
+    values (p_request_id, coalesce(p_approved_dates, '{}'))
+    returning * into job;
+
+    return to_jsonb(job);
+end;
+$$;
@@ -0,0 +1,190 @@
+-- occupancy_summary counts each staff member once per slot, however many schedule rows and rules hold it.
+-- approve_request writes no schedule row on a slot a rule already holds and counts only the slots of a new
+-- rule that nothing else holds; cancel_request takes a slot off only once nothing holds it any more; and
+-- rebuild_occupancy_summary counts distinct (staff_id, date, time_slot) rather than every row and rule.
+
+-- The (date, time_slot) slots p_staff_id holds within p_start..p_end through schedule rows or rules,
+-- leaving out those of p_except_request_id
+create or replace function public.held_slots(
+    p_staff_id bigint,
+    p_start date,
+    p_end date,
+    p_except_request_id bigint default null
+)
+returns table (date date, time_slot integer)
+language sql
+stable
+as $$
+    select s.date, s.time_slot::integer
+    from public.schedule s
+    where s.staff_id = p_staff_id and s.date between p_start and p_end
+      and s.request_id is distinct from p_except_request_id
+    union
+    select g::date, slot
+    from public.schedule_rule r
+    cross join lateral generate_series(greatest(r.startdate, p_start), least(r.enddate, p_end), interval '1 day') as g
+    cross join lateral unnest(case when r.time_slot = 3 then array[1, 2] else array[r.time_slot] end) as slot
+    where r.staff_id = p_staff_id
+      and r.request_id is distinct from p_except_request_id
+      and (r.weekday_mask >> (extract(isodow from g)::integer - 1)) & 1 = 1
+      and not (g::date = any(r.exceptions));
+$$;
+
+create or replace function public.approve_request(
+    p_request_id bigint,
+    p_result_reason text,
+    p_approved_dates date[],
+    p_horizon_days integer default 365,
+    p_recurrence_rule boolean default false
+)
+returns jsonb
+language plpgsql
+as $$
+declare
+    req public.request%rowtype;
+    first_date date;
+    last_date date;
+    inserted jsonb;
+    counted jsonb;
+    rule public.schedule_rule%rowtype;
+begin
+    select * into req from public.request where request_id = p_request_id for update;
+    if not found then
+        raise exception 'Request % not found', p_request_id using errcode = 'P0002';
+    end if;
+    if req.status <> 0 then
+        raise exception 'Request % is not pending', p_request_id using errcode = 'PT409';
+    end if;
+
+    first_date := (select min(d) from unnest(p_approved_dates) as d);
+    last_date := case when req.request_type = 2 then first_date + p_horizon_days
+                      else (select max(d) from unnest(p_approved_dates) as d) end;
+
+    if p_recurrence_rule and req.request_type = 2 then
+        insert into public.schedule_rule (request_id, staff_id, weekday_mask, time_slot, startdate, enddate)
+        select req.request_id, req.staff_id,
+               (select sum(distinct 1 << (extract(isodow from d)::integer - 1))::smallint from unnest(p_approved_dates) as d),
+               req.time_slot::integer, first_date, first_date + p_horizon_days
+        returning * into rule;
+
+        select coalesce(jsonb_agg(to_jsonb(rows) order by rows.date, rows.time_slot), '[]'::jsonb) into inserted
+        from public.expand_schedule_rules(null, null, req.request_id) as rows;
+
+        -- Slots the staff member already holds through a schedule row or another rule are not counted again
+        with held as (
+            select * from public.held_slots(req.staff_id, rule.startdate, rule.enddate, req.request_id)
+        )
+        select coalesce(jsonb_agg(to_jsonb(rows)), '[]'::jsonb) into counted
+        from public.expand_schedule_rules(null, null, req.request_id) as rows
+        where not exists (select 1 from held h where h.date = rows.date and h.time_slot = rows.time_slot);
+    else
+        with dates as (
+            select g::date as date
+            from generate_series(first_date, first_date + p_horizon_days, interval '1 day') as g
+            where req.request_type = 2
+              and extract(isodow from g) in (select extract(isodow from d) from unnest(p_approved_dates) as d)
+            union
+            select d
+            from unnest(p_approved_dates) as d
+            where req.request_type <> 2
+        ),
+        held as (
+            select * from public.held_slots(req.staff_id, first_date, last_date)
+        ),
+        slots as (
+            select unnest(case when req.time_slot::integer = 3 then array[1, 2] else array[req.time_slot::integer] end) as time_slot
+            where req.time_slot::integer in (1, 2, 3)
+        ),
+        rows as (
+            insert into public.schedule (staff_id, date, time_slot, request_id)
+            select req.staff_id, dates.date, slots.time_slot, req.request_id
+            from dates cross join slots
+            where not exists (
+                select 1 from held h
+                where h.date = dates.date and h.time_slot = slots.time_slot
+            )
+            returning staff_id, date, time_slot, request_id
+        )
+        select coalesce(jsonb_agg(to_jsonb(rows) order by rows.date, rows.time_slot), '[]'::jsonb) into inserted from rows;
+        counted := inserted;
+    end if;
+
+    insert into public.occupancy_summary (dept, reporting_manager, date, time_slot, wfh_count)
+    select e."Dept", e."Reporting_Manager", r.date, r.time_slot, count(*)
+    from jsonb_to_recordset(counted) as r(date date, time_slot integer)
+    join public."Employee" e on e."Staff_ID" = req.staff_id
+    group by e."Dept", e."Reporting_Manager", r.date, r.time_slot
+    on conflict (dept, reporting_manager, date, time_slot)
+    do update set wfh_count = public.occupancy_summary.wfh_count + excluded.wfh_count;
+
+    update public.request set status = 1, result_reason = p_result_reason where request_id = p_request_id;
+
+    return jsonb_build_object('request', to_jsonb(req), 'schedule', inserted,
+                              'rule', case when rule.rule_id is null then null else to_jsonb(rule) end);
+end;
+$$;
+
+create or replace function public.cancel_request(p_request_id bigint)
+returns jsonb
+language plpgsql
+as $$
+declare
+    req public.request%rowtype;
+    ruled jsonb;
+    deleted jsonb;
+begin
+    -- Expanded before the request is deleted, since the delete cascades to the rule
+    select coalesce(jsonb_agg(to_jsonb(rows)), '[]'::jsonb) into ruled
+    from public.expand_schedule_rules(null, null, p_request_id) as rows;
+
+    delete from public.request where request_id = p_request_id returning * into req;
+    if not found then
+        raise exception 'Request % not found', p_request_id using errcode = 'P0002';
+    end if;
+
+    with rows as (
+        delete from public.schedule where request_id = p_request_id
+        returning staff_id, date, time_slot, request_id
+    )
+    select coalesce(jsonb_agg(to_jsonb(rows) order by rows.date, rows.time_slot), '[]'::jsonb) || ruled into deleted from rows;
+
+    -- A slot another schedule row or rule still holds keeps its count
+    update public.occupancy_summary o
+    set wfh_count = o.wfh_count - r.removed
+    from (
+        select e."Dept" as dept, e."Reporting_Manager" as reporting_manager, r.date, r.time_slot, count(distinct (r.date, r.time_slot)) as removed
+        from jsonb_to_recordset(deleted) as r(date date, time_slot integer)
+        join public."Employee" e on e."Staff_ID" = req.staff_id
+        where not exists (
+            select 1 from public.held_slots(req.staff_id, r.date, r.date) h
+            where h.date = r.date and h.time_slot = r.time_slot
+        )
+        group by e."Dept", e."Reporting_Manager", r.date, r.time_slot
+    ) r
+    where o.dept = r.dept and o.reporting_manager = r.reporting_manager and o.date = r.date and o.time_slot = r.time_slot;
+
+    return jsonb_build_object('request', to_jsonb(req), 'schedule', deleted);
+end;
+$$;
+
+create or replace function public.rebuild_occupancy_summary()
+returns integer
+language plpgsql
+as $$
+declare
+    written integer;
+begin
+    delete from public.occupancy_summary where true;
+    insert into public.occupancy_summary (dept, reporting_manager, date, time_slot, wfh_count)
+    select e."Dept", e."Reporting_Manager", s.date, s.time_slot, count(*)
+    from (
+        select staff_id, date, time_slot from public.schedule
+        union
+        select staff_id, date, time_slot from public.expand_schedule_rules()
+    ) s
+    join public."Employee" e on e."Staff_ID" = s.staff_id
+    group by e."Dept", e."Reporting_Manager", s.date, s.time_slot;
+    get diagnostics written = row_count;
+    return written;
+end;
+$$;
@@ -0,0 +1,235 @@
+import pytest
+from datetime import datetime, timedelta, timezone
+from unittest.mock import MagicMock, patch
+from postgrest.exceptions import APIError
+from flaskapp.models import approval_jobs as approval_jobs_module
+from flaskapp.models.approval_jobs import ApprovalJobService
+from flaskapp.models.requests import RequestController, RequestService
+
+JOB_ID = "5b0c6c1e-0d7f-4f0e-9d43-2a1f1c9b7e11"
+UPDATED_AT = "2024-11-04T09:00:00.123456+00:00"
+
+@pytest.fixture
+def supabase_mock():
+    return MagicMock()
+
+@pytest.fixture
+def request_service():
+    request_service = MagicMock()
+    request_service.write_schedule.return_value = {"rows_written": 104, "rows_skipped": 0, "failed_chunks": []}
+    return request_service
+
+@pytest.fixture
+def dispatch():
+    return MagicMock()
+
+@pytest.fixture
+def jobs(supabase_mock, request_service, dispatch):
+    return ApprovalJobService(supabase_mock, request_service, change_version=MagicMock(), dispatch=dispatch)
+
+def test_submit_records_decision_and_queues_job(jobs, supabase_mock, request_service, dispatch, client):
+    supabase_mock.from_.return_value.update.return_value.eq.return_value.eq.return_value.execute.return_value = MagicMock(data=[{"request_id": 7}])
+    supabase_mock.from_.return_value.insert.return_value.execute.return_value = MagicMock(data=[{"job_id": JOB_ID}])
+
+    with client.application.app_context():
+        response, status_code = jobs.submit(7, "ok", ["2024-11-04"])
+
+    assert status_code == 202
+    assert response["job_id"] == JOB_ID and response["status_url"] == f"/jobs/{JOB_ID}"
+    supabase_mock.from_.return_value.update.assert_called_once_with({"status": 1, "result_reason": "ok"})
+    supabase_mock.from_.return_value.insert.assert_called_once_with({"request_id": 7, "approved_dates": ["2024-11-04"]})
+    dispatch.assert_called_once_with(JOB_ID)
+    # Nothing is written to the schedule before the response
+    request_service.write_schedule.assert_not_called()
+
+@pytest.mark.parametrize("existing, expected", [([], 404), ([{"request_id": 7}], 409)])
+def test_submit_only_approves_pending_requests(jobs, supabase_mock, dispatch, client, existing, expected):
+    supabase_mock.from_.return_value.update.return_value.eq.return_value.eq.return_value.execute.return_value = MagicMock(data=[])
+    supabase_mock.from_.return_value.select.return_value.eq.return_value.execute.return_value = MagicMock(data=existing)
+
+    with client.application.app_context():
+        _, status_code = jobs.submit(7, "ok", ["2024-11-04"])
+
+    assert status_code == expected
+    supabase_mock.from_.return_value.insert.assert_not_called()
+    dispatch.assert_not_called()
+
+def test_submit_puts_request_back_when_job_insert_fails(jobs, supabase_mock, dispatch, client):
+    supabase_mock.from_.return_value.update.return_value.eq.return_value.eq.return_value.execute.return_value = MagicMock(data=[{"request_id": 7}])
+    supabase_mock.from_.return_value.insert.return_value.execute.side_effect = Exception("timeout")
+
+    with client.application.app_context():
+        _, status_code = jobs.submit(7, "ok", ["2024-11-04"])
+
+    assert status_code == 500
+    updates = supabase_mock.from_.return_value.update.call_args_list
+    assert [call.args[0] for call in updates] == [{"status": 1, "result_reason": "ok"}, {"status": 0, "result_reason": None}]
+    supabase_mock.from_.return_value.update.return_value.eq.return_value.eq.assert_called_with("status", 1)
+    dispatch.assert_not_called()
+
+def test_submit_keeps_job_when_dispatch_fails(jobs, supabase_mock, dispatch, client):
+    supabase_mock.from_.return_value.update.return_value.eq.return_value.eq.return_value.execute.return_value = MagicMock(data=[{"request_id": 7}])
+    supabase_mock.from_.return_value.insert.return_value.execute.return_value = MagicMock(data=[{"job_id": JOB_ID}])
+    dispatch.side_effect = Exception("throttled")
+
+    with client.application.app_context():
+        response, status_code = jobs.submit(7, "ok", ["2024-11-04"])
+
+    assert status_code == 202 and response["job_id"] == JOB_ID
+    supabase_mock.from_.return_value.update.assert_called_once()
+
+@pytest.mark.parametrize("code, expected", [(None, 202), ("P0002", 404), ("PT409", 409)])
+def test_submit_through_database_function(supabase_mock, request_service, dispatch, client, code, expected):
+    jobs = ApprovalJobService(supabase_mock, request_service, dispatch=dispatch, submit_rpc=True)
+    if code is None:
+        supabase_mock.rpc.return_value.execute.return_value = MagicMock(data={"job_id": JOB_ID})
+    else:
+        supabase_mock.rpc.return_value.execute.side_effect = APIError({"code": code, "message": "failed", "details": None, "hint": None})
+
+    with client.application.app_context():
+        _, status_code = jobs.submit(7, "ok", ["2024-11-04"])
+
+    assert status_code == expected
+    supabase_mock.rpc.assert_called_once_with("submit_approval_job", {"p_request_id": 7, "p_result_reason": "ok", "p_approved_dates": ["2024-11-04"]})
+    supabase_mock.from_.assert_not_called()
+    assert dispatch.call_count == (1 if code is None else 0)
+
+def _job_and_request(supabase_mock, job, request_row):
+    supabase_mock.from_.return_value.select.return_value.eq.return_value.execute.side_effect = [
+        MagicMock(data=[job]), MagicMock(data=[request_row])]
+
+def test_run_materialises_recurring_schedule(jobs, supabase_mock, request_service, client):
+    request_row = {"request_id": 7, "staff_id": 140002, "request_type": 2, "time_slot": 3}
+    _job_and_request(supabase_mock, {"job_id": JOB_ID, "request_id": 7, "approved_dates": ["2024-11-04"], "status": "queued", "attempts": 0, "updated_at": UPDATED_AT}, request_row)
+
+    with client.application.app_context():
+        jobs.run(JOB_ID)
+
+    request_service.write_schedule.assert_called_once_with(request_row, ["2024-11-04"])
+    updates = [call.args[0] for call in supabase_mock.from_.return_value.update.call_args_list]
+    assert (updates[0]["status"], updates[0]["attempts"]) == ("running", 1)
+    supabase_mock.from_.return_value.update.return_value.eq.return_value.eq.assert_called_once_with("updated_at", UPDATED_AT)
+    assert {key: updates[1][key] for key in ("status", "rows_written", "failed_chunks")} == {"status": "done", "rows_written": 104, "failed_chunks": None}
+    jobs.change_version.bump.assert_called_once()
+    request_service.discard_schedule.assert_not_called()
+
+def test_run_reports_failed_chunks(jobs, supabase_mock, request_service, client):
+    _job_and_request(supabase_mock,
+        {"job_id": JOB_ID, "request_id": 7, "approved_dates": ["2024-11-04"], "status": "queued", "attempts": 1, "updated_at": UPDATED_AT},
+        {"request_id": 7, "staff_id": 140002, "request_type": 1, "time_slot": 1})
+    failed = [{"chunk": 0, "start_date": "2024-11-04", "end_date": "2024-11-04", "rows": 1, "error": "timeout"}]
+    request_service.write_schedule.return_value = {"rows_written": 1, "rows_skipped": 0, "failed_chunks": failed}
+
+    with client.application.app_context():
+        jobs.run(JOB_ID)
+
+    final = supabase_mock.from_.return_value.update.call_args_list[-1].args[0]
+    assert final["status"] == "failed" and final["failed_chunks"] == failed and final["rows_written"] == 0
+    # What the earlier run wrote is removed before the rerun, and what this run wrote after it fails
+    assert request_service.discard_schedule.call_count == 2
+    request_service.discard_schedule.assert_called_with([7])
+    jobs.change_version.bump.assert_not_called()
+
+def test_run_skips_job_claimed_by_another_worker(jobs, supabase_mock, request_service, client):
+    supabase_mock.from_.return_value.select.return_value.eq.return_value.execute.return_value = MagicMock(
+        data=[{"job_id": JOB_ID, "request_id": 7, "approved_dates": [], "status": "queued", "attempts": 0, "updated_at": UPDATED_AT}])
+    supabase_mock.from_.return_value.update.return_value.eq.return_value.eq.return_value.execute.return_value = MagicMock(data=[])
+
+    with client.application.app_context():
+        jobs.run(JOB_ID)
+
+    request_service.write_schedule.assert_not_called()
+
+def test_run_skips_finished_jobs(jobs, supabase_mock, request_service, client):
+    supabase_mock.from_.return_value.select.return_value.eq.return_value.execute.return_value = MagicMock(data=[{"job_id": JOB_ID, "status": "done"}])
+
+    with client.application.app_context():
+        jobs.run(JOB_ID)
+
+    request_service.write_schedule.assert_not_called()
+    supabase_mock.from_.return_value.update.assert_not_called()
+
+def test_dispatch_runs_job_on_thread_pool(client, monkeypatch):
+    monkeypatch.delenv("AWS_LAMBDA_FUNCTION_NAME", raising=False)
+    with patch("flaskapp.blueprints.requests_routes.approval_jobs") as shared_jobs:
+        with client.application.app_context():
+            approval_jobs_module.dispatch(JOB_ID)
+        approval_jobs_module.executor().submit(lambda: None).result(timeout=5)
+
+    shared_jobs.run.assert_called_once_with(JOB_ID)
+
+def test_controller_submits_job_when_async(client):
+    approval_jobs = MagicMock()
+    approval_jobs.submit.return_value = ({"job_id": JOB_ID}, 202)
+    controller = RequestController(RequestService(MagicMock()), approval_jobs=approval_jobs)
+
+    with client.application.test_request_context(json={"result_reason": "ok", "approved_dates": ["2024-11-04"]}):
+        assert controller.approve_request(7) == ({"job_id": JOB_ID}, 202)
+    approval_jobs.submit.assert_called_once_with(7, "ok", ["2024-11-04"])
+
+def test_get_job_route(client):
+    job = {"job_id": JOB_ID, "request_id": 7, "status": "running"}
+    with patch("flaskapp.models.approval_jobs.ApprovalJobService.get_job", return_value=(job, 200)):
+        response = client.get(f"/jobs/{JOB_ID}")
+    assert response.status_code == 200
+    assert response.json == job
+
+def _stale(status):
+    updated_at = (datetime.now(timezone.utc) - timedelta(seconds=approval_jobs_module.APPROVAL_JOB_STALE_SECONDS + 60)).isoformat()
+    return {"job_id": JOB_ID, "request_id": 7, "status": status, "updated_at": updated_at}
+
+def test_get_job_restarts_stale_job(jobs, supabase_mock, dispatch, client):
+    job = _stale("running")
+    supabase_mock.from_.return_value.select.return_value.eq.return_value.execute.return_value = MagicMock(data=[job])
+
+    with client.application.app_context():
+        response, status_code = jobs.get_job(JOB_ID)
+
+    assert (status_code, response["status"]) == (200, "queued")
+    assert supabase_mock.from_.return_value.update.call_args.args[0]["status"] == "queued"
+    # Guarded on the row as read, so concurrent polls restart it once
+    supabase_mock.from_.return_value.update.return_value.eq.return_value.eq.assert_called_once_with("status", "running")
+    supabase_mock.from_.return_value.update.return_value.eq.return_value.eq.return_value.eq.assert_called_once_with("updated_at", job["updated_at"])
+    dispatch.assert_called_once_with(JOB_ID)
+
+def test_get_job_leaves_recent_job_alone(jobs, supabase_mock, dispatch, client):
+    job = {"job_id": JOB_ID, "status": "running", "updated_at": datetime.now(timezone.utc).isoformat()}
+    supabase_mock.from_.return_value.select.return_value.eq.return_value.execute.return_value = MagicMock(data=[job])
+
+    with client.application.app_context():
+        assert jobs.get_job(JOB_ID) == (job, 200)
+    supabase_mock.from_.return_value.update.assert_not_called()
+    dispatch.assert_not_called()
+
+@pytest.mark.parametrize("status, expected", [("failed", 202), ("done", 409)])
+def test_retry(jobs, supabase_mock, dispatch, client, status, expected):
+    supabase_mock.from_.return_value.select.return_value.eq.return_value.execute.return_value = MagicMock(
+        data=[{"job_id": JOB_ID, "status": status, "updated_at": UPDATED_AT}])
+
+    with client.application.app_context():
+        _, status_code = jobs.retry(JOB_ID)
+
+    assert status_code == expected
+    assert dispatch.call_count == (1 if status == "failed" else 0)
+
+def test_sweep_restarts_stale_and_failed_jobs(jobs, supabase_mock, dispatch):
+    supabase_mock.from_.return_value.select.return_value.in_.return_value.lte.return_value.execute.return_value = MagicMock(data=[_stale("queued")])
+    supabase_mock.from_.return_value.select.return_value.eq.return_value.execute.return_value = MagicMock(data=[_stale("failed")])
+
+    assert jobs.sweep() == 1
+    assert jobs.sweep(include_failed=True) == 2
+    supabase_mock.from_.return_value.select.return_value.in_.assert_called_with("status", ["queued", "running"])
+
+def test_retry_job_route(client):
+    with patch("flaskapp.models.approval_jobs.ApprovalJobService.retry", return_value=({"job_id": JOB_ID}, 202)) as mock_retry:
+        response = client.post(f"/jobs/{JOB_ID}/retry")
+    assert response.status_code == 202
+    mock_retry.assert_called_once_with(JOB_ID)
+
+def test_sweep_command(client):
+    with patch("flaskapp.main.approval_jobs") as approval_jobs:
+        approval_jobs.sweep.return_value = 3
+        result = client.application.test_cli_runner().invoke(args=["approval-jobs-sweep", "--failed"])
+
+    assert result.output == "Restarted 3 approval jobs\n"
+    approval_jobs.sweep.assert_called_once_with(include_failed=True)
@@ -0,0 +1,35 @@
+import threading
+import time
+import pytest
+from flask import Flask, current_app
+from flaskapp.models.fanout import fan_out, fan_out_map
+
+def test_results_keep_call_order():
+    assert fan_out(lambda: 1, lambda: 2, lambda: 3) == [1, 2, 3]
+    assert fan_out_map(lambda x: x * 2, [1, 2, 3]) == [2, 4, 6]
+
+def test_calls_run_concurrently():
+    # Both calls must be in flight at once for the barrier to release
+    barrier = threading.Barrier(2, timeout=2)
+    assert fan_out(barrier.wait, barrier.wait) in ([0, 1], [1, 0])
+
+def test_first_exception_is_raised():
+    def fails():
+        raise ValueError("query failed")
+
+    with pytest.raises(ValueError, match="query failed"):
+        fan_out(lambda: time.sleep(0.5), fails)
+
+def test_timeout_raises():
+    start = time.monotonic()
+    with pytest.raises(TimeoutError):
+        fan_out(lambda: time.sleep(0.5), lambda: None, timeout=0.05)
+    assert time.monotonic() - start < 0.4
+
+def test_nested_fan_out_runs_inline():
+    assert fan_out(lambda: fan_out(lambda: 1, lambda: 2), lambda: 3) == [[1, 2], 3]
+
+def test_calls_see_app_context():
+    app = Flask("fanout")
+    with app.app_context():
+        assert fan_out(lambda: current_app.name, lambda: current_app.name) == ["fanout", "fanout"]
@@ -1,6 +1,7 @@
 import pytest
 from unittest.mock import MagicMock
 from flask import Flask, jsonify, request
+from flaskapp.models import notification
 from flaskapp.models.notification import notification_engine, notification_sender, supabase_access
 import requests
 from unittest import mock
@@ -533,92 +534,163 @@ def test_compose_withdraw_bad_data(supabase_caller, notif_engine):
 #happy path
 def test_send_approve(notif_engine, notif_sender):
     notif_engine.compose_approve = MagicMock(return_value = ("Hi John Doe, your request (ID: 1) from 1970-1-1 to 1970-1-2 has been partially or fully approved. Please check your schedule for details.", 200))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 200
         assert notif_sender.send_approve(1) == 200
 
 def test_send_reject(notif_engine, notif_sender):
     notif_engine.compose_reject = MagicMock(return_value = ("Hi John Doe, your request (ID: 1) from 1970-1-1 to 1970-1-2 has been rejected.", 200))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 200
         assert notif_sender.send_reject(1) == 200
 
 def test_send_created(notif_engine, notif_sender):
     notif_engine.compose_create = MagicMock(return_value = ("Hi Jane Doe, John Doe has sent a request (ID: 1) from 1970-1-1 to 1970-1-2. Please check requests for details.", 200))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 200
         assert notif_sender.send_create() == 200
 
 def test_send_cancel(notif_engine, notif_sender):
     notif_engine.compose_cancel = MagicMock(return_value = ("Hi Jane Doe, John Doe has cancelled a request (ID: 1) from 1970-1-1 to 1970-1-2. Please check requests for details.", 200))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 200
         assert notif_sender.send_cancel(data) == 200
 
 def test_send_withdraw(notif_engine, notif_sender):
     notif_engine.compose_withdraw = MagicMock(return_value = ("Hi Jane Doe, John Doe has withdrawn a request (ID: 1) from 1970-1-1 to 1970-1-2. Please check requests for details.", 200))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 200
         assert notif_sender.send_withdraw(data) == 200
 
 #-ve path error from compose
 def test_send_approve_compose_error(notif_engine, notif_sender):
     notif_engine.compose_approve = MagicMock(return_value = ("Unique error1", 500))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 200
         assert notif_sender.send_approve(1) == "Unique error1"
 
 def test_send_reject_compose_error(notif_engine, notif_sender):
     notif_engine.compose_reject = MagicMock(return_value = ("Unique error2", 500))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 200
         assert notif_sender.send_reject(1) == "Unique error2"
 
 def test_send_created_compose_error(notif_engine, notif_sender):
     notif_engine.compose_create = MagicMock(return_value = ("Unique error3", 500))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 200
         assert notif_sender.send_create() == "Unique error3"
 
 def test_send_cancel_compose_error(notif_engine, notif_sender):
     notif_engine.compose_cancel = MagicMock(return_value = ("Unique error4", 500))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 200
         assert notif_sender.send_cancel(data) == "Unique error4"
 
 def test_send_withdraw_compose_error(notif_engine, notif_sender):
     notif_engine.compose_withdraw = MagicMock(return_value = ("Unique error5", 500))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 200
         assert notif_sender.send_withdraw(data) == "Unique error5"
 
 #post error path
 def test_send_approve_post_error(notif_engine, notif_sender):
     notif_engine.compose_approve = MagicMock(return_value = ("Hi John Doe, your request (ID: 1) from 1970-1-1 to 1970-1-2 has been partially or fully approved. Please check your schedule for details.", 200))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 400
         assert notif_sender.send_approve(1) == "Email failed to send"
 
 def test_send_reject_post_error(notif_engine, notif_sender):
     notif_engine.compose_reject = MagicMock(return_value = ("Hi John Doe, your request (ID: 1) from 1970-1-1 to 1970-1-2 has been rejected.", 200))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 400
         assert notif_sender.send_reject(1) == "Email failed to send"
 
 def test_send_created_post_error(notif_engine, notif_sender):
     notif_engine.compose_create = MagicMock(return_value = ("Hi Jane Doe, John Doe has sent a request (ID: 1) from 1970-1-1 to 1970-1-2. Please check requests for details.", 200))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 400
         assert notif_sender.send_create() == "Email failed to send"
 
 def test_send_cancel_post_error(notif_engine, notif_sender):
     notif_engine.compose_cancel = MagicMock(return_value = ("Hi Jane Doe, John Doe has cancelled a request (ID: 1) from 1970-1-1 to 1970-1-2. Please check requests for details.", 200))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 400
         assert notif_sender.send_cancel(data) == "Email failed to send"
 
 def test_send_withdraw_post_error(notif_engine, notif_sender):
     notif_engine.compose_withdraw = MagicMock(return_value = ("Hi Jane Doe, John Doe has withdrawn a request (ID: 1) from 1970-1-1 to 1970-1-2. Please check requests for details.", 200))
-    with mock.patch('requests.post') as patched_post:
+    with mock.patch('requests.Session.post') as patched_post:
         patched_post.return_value.status_code = 400
-        assert notif_sender.send_withdraw(data) == "Email failed to send"
\ No newline at end of file
+        assert notif_sender.send_withdraw(data) == "Email failed to send"
+
+def test_compose_decisions(notif_engine, supabase_caller):
+    supabase_caller.supabase.from_().select().in_().execute.return_value.data = [
+        {"Staff_ID": 1, "Staff_FName": "John", "Staff_LName": "Doe"},
+        {"Staff_ID": 2, "Staff_FName": "Jane", "Staff_LName": "Tan"}]
+    items = [
+        {"decision": "approve", "data": {"request_id": 1, "staff_id": 1, "startdate": "1970-1-1", "enddate": "1970-1-2"}},
+        {"decision": "reject", "data": {"request_id": 2, "staff_id": 2, "startdate": "1970-1-3", "enddate": "1970-1-3"}}]
+    assert notif_engine.compose_decisions(items) == (
+        "Hi John Doe, your request (ID: 1) from 1970-1-1 to 1970-1-2 has been partially or fully approved. Please check your schedule for details.\n\n"
+        "Hi Jane Tan, your request (ID: 2) from 1970-1-3 to 1970-1-3 has been rejected.", 200)
+
+def test_send_decisions_posts_once(notif_engine, notif_sender):
+    notif_engine.compose_decisions = MagicMock(return_value = ("Hi John Doe, ...\n\nHi Jane Tan, ...", 200))
+    with mock.patch('requests.Session.post') as patched_post:
+        patched_post.return_value.status_code = 200
+        assert notif_sender.send_decisions([{}, {}]) == 200
+        patched_post.assert_called_once()
+
+def test_compose_digest_one_email_per_manager(notif_engine, supabase_caller):
+    supabase_caller.get_staff_data_many = MagicMock(side_effect = [
+        {1: {"Staff_ID": 1, "Staff_FName": "John", "Staff_LName": "Doe", "Reporting_Manager": 9},
+         2: {"Staff_ID": 2, "Staff_FName": "Jane", "Staff_LName": "Tan", "Reporting_Manager": 9}},
+        {9: {"Staff_ID": 9, "Staff_FName": "Mary", "Staff_LName": "Lim"}}])
+    items = [
+        {"request_id": 1, "staff_id": 1, "startdate": "1970-1-1", "enddate": "1970-1-2"},
+        {"request_id": 2, "staff_id": 3, "startdate": "1970-1-3", "enddate": "1970-1-3"},
+        {"request_id": 3, "staff_id": 2, "startdate": "1970-1-4", "enddate": "1970-1-4"}]
+    assert notif_engine.compose_digest("cancel", items) == [([0, 2], (
+        "Hi Mary Lim, 2 request(s) were cancelled since the last update:\n"
+        "- John Doe has cancelled a request (ID: 1) from 1970-1-1 to 1970-1-2.\n"
+        "- Jane Tan has cancelled a request (ID: 3) from 1970-1-4 to 1970-1-4.\n"
+        "Please check requests for details.", 200))]
+    assert supabase_caller.get_staff_data_many.call_count == 2
+
+def test_compose_create_uses_given_request(supabase_caller, notif_engine):
+    supabase_caller.get_latest_req = MagicMock()
+    supabase_caller.get_staff_data = MagicMock(return_value = ({"Staff_FName": "John", "Staff_LName": "Doe", "Reporting_Manager": 2}, 200))
+    supabase_caller.get_manager_data = MagicMock(return_value = ({"Staff_FName": "Jane", "Staff_LName": "Doe"}, 200))
+
+    created = {"request_id": 5, "staff_id": 1, "startdate": "1970-1-1", "enddate": "1970-1-2"}
+    assert notif_engine.compose_create(created) == ("Hi Jane Doe, John Doe has sent a request (ID: 5) from 1970-1-1 to 1970-1-2. Please check requests for details.", 200)
+    supabase_caller.get_latest_req.assert_not_called()
+
+def test_publish_uses_pooled_session_with_timeouts(notif_sender):
+    with mock.patch('requests.Session.post') as patched_post:
+        patched_post.return_value.status_code = 200
+        assert notif_sender.publish("Hi") == 200
+        assert notif_sender.publish("Hi again") == 200
+
+    assert patched_post.call_args.kwargs["timeout"] == (notification.SNS_CONNECT_TIMEOUT, notification.SNS_READ_TIMEOUT)
+    assert notification.sns_session() is notification.sns_session()
+    adapter = notification.sns_session().get_adapter("https://sns.ap-southeast-1.amazonaws.com/")
+    assert adapter.max_retries.read == 0 and adapter.max_retries.status_forcelist == (429, 503)
+
+def test_publish_connection_error_counts_as_failure(notif_sender):
+    before = notification.send_stats.snapshot()
+    with mock.patch('requests.Session.post', side_effect=requests.ConnectionError("refused")):
+        assert notif_sender.publish("Hi") == "Email failed to send"
+    assert notification.send_stats.snapshot()["failed"] == before["failed"] + 1
+
+def test_publish_retries_throttled_requests(notif_sender):
+    from tests.test_outbox import FakeSNS
+    sns = FakeSNS()
+    sns.statuses = [503]
+    try:
+        with mock.patch('flaskapp.models.notification.sns_url', sns.url):
+            assert notif_sender.publish("Hi") == 200
+    finally:
+        sns.server.shutdown()
+    assert sns.messages == ["Hi", "Hi"]
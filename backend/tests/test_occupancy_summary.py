@@ -0,0 +1,106 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from flaskapp.models.occupancy_summary import OccupancySummaryService
+from flaskapp.models.requests import RequestService
+
+@pytest.fixture
+def supabase_mock():
+    return MagicMock()
+
+@pytest.fixture
+def org_chart():
+    org_chart = MagicMock()
+    org_chart.get.return_value = {"Staff_ID": 140002, "Dept": "Sales", "Reporting_Manager": 140894}
+    return org_chart
+
+@pytest.fixture
+def occupancy_summary(supabase_mock, org_chart):
+    return OccupancySummaryService(supabase_mock, org_chart)
+
+def test_record_added_groups_deltas(occupancy_summary, supabase_mock):
+    occupancy_summary.record_added(140002, [("2024-10-01", 1), ("2024-10-01", "2"), ("2024-10-02", 1)])
+
+    supabase_mock.rpc.assert_called_once_with("bump_occupancy", {"deltas": [
+        {"dept": "Sales", "reporting_manager": 140894, "date": "2024-10-01", "time_slot": 1, "delta": 1},
+        {"dept": "Sales", "reporting_manager": 140894, "date": "2024-10-01", "time_slot": 2, "delta": 1},
+        {"dept": "Sales", "reporting_manager": 140894, "date": "2024-10-02", "time_slot": 1, "delta": 1},
+    ]})
+    supabase_mock.rpc().execute.assert_called_once()
+
+def test_record_removed_decrements(occupancy_summary, supabase_mock):
+    occupancy_summary.record_removed(140002, [("2024-10-01", 1), ("2024-10-01", 1)])
+
+    supabase_mock.rpc.assert_called_once_with("bump_occupancy", {"deltas": [
+        {"dept": "Sales", "reporting_manager": 140894, "date": "2024-10-01", "time_slot": 1, "delta": -2},
+    ]})
+
+def test_record_skips_unknown_staff_and_empty_slots(occupancy_summary, supabase_mock, org_chart):
+    assert occupancy_summary.record_added(140002, []) is None
+    org_chart.get.return_value = None
+    assert occupancy_summary.record_added(999999, [("2024-10-01", 1)]) is None
+    supabase_mock.rpc.assert_not_called()
+
+def test_team_lookup_without_org_chart(supabase_mock):
+    supabase_mock.from_().select().eq().execute.return_value = MagicMock(data=[{"Dept": "HR", "Reporting_Manager": 2}])
+
+    OccupancySummaryService(supabase_mock).record_added(1, [("2024-10-01", 1)])
+
+    assert supabase_mock.rpc.call_args[0][1]["deltas"][0]["dept"] == "HR"
+
+def test_rebuild(occupancy_summary, supabase_mock):
+    supabase_mock.rpc().execute.return_value = MagicMock(data=42)
+
+    assert occupancy_summary.rebuild() == 42
+    supabase_mock.rpc.assert_called_with("rebuild_occupancy_summary", {})
+
+def test_get_counts_sums_teams(occupancy_summary, supabase_mock):
+    query = MagicMock()
+    query.gt.return_value = query
+    query.eq.return_value = query
+    query.gte.return_value = query
+    query.lte.return_value = query
+    query.execute.return_value = MagicMock(data=[
+        {"date": "2024-10-02", "time_slot": 1, "wfh_count": 1},
+        {"date": "2024-10-01", "time_slot": 2, "wfh_count": 3},
+        {"date": "2024-10-02", "time_slot": 1, "wfh_count": 2},
+    ])
+    supabase_mock.from_().select.return_value = query
+
+    result = occupancy_summary.get_counts(dept="Sales", start="2024-10-01", end="2024-10-31")
+
+    assert result == [
+        {"date": "2024-10-01", "time_slot": 2, "count": 3},
+        {"date": "2024-10-02", "time_slot": 1, "count": 3},
+    ]
+    query.gt.assert_called_once_with("wfh_count", 0)
+    query.eq.assert_called_once_with("dept", "Sales")
+    query.gte.assert_called_once_with("date", "2024-10-01")
+    query.lte.assert_called_once_with("date", "2024-10-31")
+
+def test_create_schedule_entries_updates_summary(supabase_mock):
+    occupancy_summary = MagicMock()
+    request_service = RequestService(supabase_mock, occupancy_summary=occupancy_summary)
+
+    request_service.create_schedule_entries(140002, ["2024-10-01", "2024-10-02"], 3, 7)
+
+    occupancy_summary.record_added.assert_called_once_with(140002, [("2024-10-01", 1), ("2024-10-01", 2), ("2024-10-02", 1), ("2024-10-02", 2)])
+
+def test_cancel_request_updates_summary(supabase_mock):
+    occupancy_summary = MagicMock()
+    request_service = RequestService(supabase_mock, occupancy_summary=occupancy_summary)
+    supabase_mock.from_().delete().eq().execute.side_effect = [
+        MagicMock(data=[{"request_id": 7, "staff_id": 140002, "startdate": "2024-10-01", "enddate": "2024-10-01"}]),
+        MagicMock(data=[{"request_id": 7, "staff_id": 140002, "date": "2024-10-01", "time_slot": 1}])
+    ]
+
+    response, status_code = request_service.cancel_request(7)
+
+    assert status_code == 200
+    occupancy_summary.record_removed.assert_called_once_with(140002, [("2024-10-01", 1)])
+
+def test_rebuild_command(client):
+    with patch("flaskapp.main.occupancy_summary") as occupancy_summary:
+        occupancy_summary.rebuild.return_value = 42
+        result = client.application.test_cli_runner().invoke(args=["occupancy-rebuild"])
+
+    assert result.output == "Rebuilt occupancy summary: 42 rows\n"
@@ -0,0 +1,102 @@
+import pytest
+from unittest.mock import MagicMock
+from flaskapp.models.org_chart import OrgChartCache
+from flaskapp.models.schedules import SchedulesService
+from flaskapp.models.teams import TeamsService
+from flaskapp.models.requests import RequestService
+
+EMPLOYEES = [
+    {"Staff_ID": 130002, "Staff_FName": "Jack", "Staff_LName": "Sim", "Dept": "CEO", "Position": "MD", "Reporting_Manager": 130002, "Role": 1},
+    {"Staff_ID": 140001, "Staff_FName": "Derek", "Staff_LName": "Tan", "Dept": "Sales", "Position": "Director", "Reporting_Manager": 130002, "Role": 1},
+    {"Staff_ID": 140894, "Staff_FName": "Rahim", "Staff_LName": "Khalid", "Dept": "Sales", "Position": "Sales Manager", "Reporting_Manager": 140001, "Role": 3},
+    {"Staff_ID": 140002, "Staff_FName": "Susan", "Staff_LName": "Goh", "Dept": "Sales", "Position": "Account Manager", "Reporting_Manager": 140894, "Role": 2},
+    {"Staff_ID": 150008, "Staff_FName": "Eric", "Staff_LName": "Loh", "Dept": "Solutioning", "Position": "Director", "Reporting_Manager": 130002, "Role": 1},
+]
+
+@pytest.fixture
+def supabase_mock():
+    supabase = MagicMock()
+    supabase.from_().select().execute.return_value = MagicMock(data=EMPLOYEES)
+    supabase.reset_mock()
+    return supabase
+
+@pytest.fixture
+def org_chart(supabase_mock):
+    return OrgChartCache(supabase_mock)
+
+def test_loads_lazily_once(org_chart, supabase_mock):
+    supabase_mock.from_().select().execute.assert_not_called()
+
+    assert org_chart.ceo_id() == 130002
+    assert org_chart.get("140894")["Staff_FName"] == "Rahim"
+    assert [e["Staff_ID"] for e in org_chart.direct_reports(130002)] == [130002, 140001, 150008]
+
+    assert supabase_mock.from_().select().execute.call_count == 1
+
+def test_invalidate_forces_reload(org_chart, supabase_mock):
+    org_chart.employees()
+    org_chart.invalidate()
+    org_chart.employees()
+
+    assert supabase_mock.from_().select().execute.call_count == 2
+
+def test_invalidate_keeps_current_snapshot_until_reload(org_chart, supabase_mock):
+    employees = org_chart.employees()
+    # A reader already holding the snapshot keeps a usable one when another thread invalidates
+    org_chart.invalidate()
+    assert org_chart._snapshot[0] is employees
+    assert org_chart.ceo_id() == 130002
+    assert supabase_mock.from_().select().execute.call_count == 2
+
+def test_ttl_expiry_forces_reload(supabase_mock):
+    org_chart = OrgChartCache(supabase_mock, ttl=0)
+    org_chart.employees()
+    org_chart.employees()
+
+    assert supabase_mock.from_().select().execute.call_count == 2
+
+def test_rosters(org_chart):
+    assert [e["Staff_ID"] for e in org_chart.dept_roster("Sales")] == [140001, 140894, 140002]
+    assert [e["Staff_ID"] for e in org_chart.position_roster("Director")] == [140001, 150008]
+    assert org_chart.get("not an id") is None
+    assert org_chart.direct_reports(None) == []
+
+def test_ceo_missing(supabase_mock):
+    supabase_mock.from_().select().execute.return_value = MagicMock(data=[])
+    with pytest.raises(LookupError):
+        OrgChartCache(supabase_mock).ceo_id()
+
+def test_schedules_service_uses_cache(org_chart, supabase_mock):
+    schedules_service = SchedulesService(supabase_mock, org_chart)
+
+    assert schedules_service.get_ceo() == 130002
+    assert [e["Staff_ID"] for e in schedules_service.get_all_employees().data] == [130002, 140001, 140894, 140002, 150008]
+    assert [e["Staff_ID"] for e in schedules_service.get_all_employees_by_dept("Sales").data] == [140001, 140894, 140002]
+    assert [e["Staff_ID"] for e in schedules_service.get_all_employees_by_reporting_manager("Sales", 140001).data] == [140894]
+    assert [e["Staff_ID"] for e in schedules_service.get_all_directors("130002").data] == [140001, 150008]
+    assert supabase_mock.from_().select().execute.call_count == 1
+
+def test_teams_service_uses_cache(org_chart, supabase_mock):
+    teams_service = TeamsService(supabase_mock, org_chart)
+
+    assert [e["Staff_ID"] for e in teams_service.get_staff_by_department("CEO")] == [140001, 150008]
+    assert [e["Staff_ID"] for e in teams_service.get_staff_by_department("Sales")] == [140001, 140894, 140002]
+    assert len(teams_service.get_staff_by_department("All")) == 5
+    assert teams_service.get_manager_name(140001) == "Derek Tan"
+    assert teams_service.get_manager_name(999999) == "Unknown"
+    assert supabase_mock.from_().select().execute.call_count == 1
+
+def test_team_requests_use_cache(org_chart, supabase_mock):
+    request_service = RequestService(supabase_mock, org_chart)
+    supabase_mock.from_().select().in_().eq().execute.return_value = MagicMock(data=[{"request_id": 1, "staff_id": 140002}])
+
+    result, status_code = request_service.get_team_requests("140894")
+
+    assert status_code == 200
+    assert result == [{"request_id": 1, "staff_id": 140002}]
+    supabase_mock.from_().select().in_.assert_called_with("staff_id", [140002])
+
+def test_team_requests_user_not_in_cache(org_chart, supabase_mock):
+    request_service = RequestService(supabase_mock, org_chart)
+
+    assert request_service.get_team_requests("999999") == ({"error": "User not found"}, 404)
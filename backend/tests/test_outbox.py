@@ -0,0 +1,218 @@
+import threading
+import time
+import pytest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+from unittest.mock import MagicMock, patch
+from postgrest.exceptions import APIError
+from flaskapp.models import outbox as outbox_module
+from flaskapp.models.notification import notification_engine, notification_sender
+from flaskapp.models.outbox import NotificationOutbox, SqliteOutboxStore, SupabaseOutboxStore
+
+
+class FakeSNS:
+    # Local stand-in for the SNS publish endpoint: records each message and answers with the next status
+    def __init__(self):
+        self.messages = []
+        self.statuses = []
+        self.delay = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+                time.sleep(fake.delay)
+                fake.messages.append(parse_qs(body)["Message"][0])
+                self.send_response(fake.statuses.pop(0) if fake.statuses else 200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+
+@pytest.fixture
+def sns():
+    fake = FakeSNS()
+    with patch("flaskapp.models.notification.sns_url", fake.url):
+        yield fake
+    fake.server.shutdown()
+
+@pytest.fixture
+def notif_engine():
+    notif_engine = MagicMock()
+    for kind in ("approve", "reject", "create", "decisions", "withdraw", "cancel"):
+        getattr(notif_engine, "compose_" + kind).side_effect = lambda arg, kind=kind: (f"{kind} {arg}", 200)
+    return notif_engine
+
+@pytest.fixture
+def store(tmp_path):
+    return SqliteOutboxStore(str(tmp_path / "outbox.sqlite3"))
+
+@pytest.fixture
+def outbox(store, notif_engine):
+    return NotificationOutbox(store, notification_sender(notif_engine))
+
+def test_send_queues_without_calling_sns(outbox, store, sns, client):
+    with client.application.app_context():
+        assert outbox.send_approve(7) == "queued"
+        assert outbox.send_cancel({"request_id": 8, "staff_id": 1}) == "queued"
+
+    assert sns.messages == []
+    assert [(row["kind"], row["status"]) for row in store.rows()] == [("approve", "pending"), ("cancel", "pending")]
+
+def test_drain_delivers_every_kind(outbox, store, sns, client):
+    with client.application.app_context():
+        outbox.send_approve(7)
+        outbox.send_reject(8)
+        outbox.send_create({"request_id": 9})
+        outbox.send_decisions([{"request_id": 10}])
+        outbox.send_withdraw({"request_id": 11})
+        outbox.send_cancel({"request_id": 12})
+        assert outbox.drain() == (6, 0)
+
+    assert sorted(sns.messages) == sorted(["approve 7", "reject 8", "create {'request_id': 9}", "decisions [{'request_id': 10}]",
+                                           "withdraw {'request_id': 11}", "cancel {'request_id': 12}"])
+    assert [row["status"] for row in store.rows()] == ["sent"] * 6
+
+def test_failed_send_backs_off_then_gives_up(outbox, store, sns, client, monkeypatch):
+    sns.statuses = [500, 500, 500]
+    with client.application.app_context():
+        outbox.send_approve(7)
+        assert outbox.drain() == (0, 1)
+
+        row = store.rows()[0]
+        assert (row["status"], row["attempts"], row["last_error"]) == ("pending", 1, "Email failed to send")
+        # Not due again until the backoff has passed
+        assert outbox.drain() == (0, 0)
+
+        # Once due, later retries (without backoff here) run until the attempts are used up
+        store.finish(row["id"], {"next_attempt_at": "2000-01-01T00:00:00+00:00"})
+        monkeypatch.setattr(outbox_module, "NOTIFY_BACKOFF_SECONDS", 0)
+        monkeypatch.setattr(outbox_module, "NOTIFY_MAX_ATTEMPTS", 3)
+        assert outbox.drain() == (0, 2)
+
+    row = store.rows()[0]
+    assert (row["status"], row["attempts"]) == ("failed", 3)
+    assert len(sns.messages) == 3
+
+def test_retry_succeeds_after_backoff(outbox, store, sns, client, monkeypatch):
+    monkeypatch.setattr(outbox_module, "NOTIFY_BACKOFF_SECONDS", 0)
+    sns.statuses = [500]
+    with client.application.app_context():
+        outbox.send_reject(7)
+        assert outbox.drain() == (1, 1)
+
+    assert [row["status"] for row in store.rows()] == ["sent"]
+    assert sns.messages == ["reject 7", "reject 7"]
+
+def test_drain_sends_concurrently(outbox, sns, client):
+    sns.delay = 0.2
+    with client.application.app_context():
+        for request_id in range(8):
+            outbox.send_approve(request_id)
+        started = time.perf_counter()
+        assert outbox.drain() == (8, 0)
+        elapsed = time.perf_counter() - started
+
+    assert elapsed < 8 * 0.2 / 2
+
+def test_drain_sends_on_its_own_pool(outbox, sns, client):
+    with client.application.app_context(), patch("flaskapp.models.outbox.fan_out", wraps=outbox_module.fan_out) as fan_out:
+        outbox.send_approve(7)
+        outbox.send_approve(8)
+        assert outbox.drain() == (2, 0)
+
+    assert fan_out.call_args.kwargs["pool"] is outbox_module.send_executor()
+
+def test_stale_claims_are_claimed_again(store, monkeypatch):
+    store.add("approve", 7)
+    assert [row["id"] for row in store.claim(10)] == [1]
+    assert store.claim(10) == []
+
+    monkeypatch.setattr(outbox_module, "NOTIFY_CLAIM_TIMEOUT", 0)
+    assert [(row["id"], row["attempts"]) for row in store.claim(10)] == [(1, 2)]
+
+def test_enqueue_failure_sends_inline(notif_engine, sns, client):
+    store = MagicMock()
+    store.add.side_effect = Exception("disk full")
+    outbox = NotificationOutbox(store, notification_sender(notif_engine))
+
+    with client.application.app_context():
+        assert outbox.send_approve(7) == 200
+    assert sns.messages == ["approve 7"]
+
+def test_supabase_store_claims_without_function(client):
+    supabase_mock = MagicMock()
+    supabase_mock.rpc.return_value.execute.side_effect = APIError({"code": "PGRST202", "message": "Could not find the function", "details": None, "hint": None})
+    supabase_mock.from_.return_value.select.return_value.or_.return_value.order.return_value.limit.return_value.execute.return_value = MagicMock(
+        data=[{"id": 1, "kind": "approve", "payload": 7, "attempts": 0}])
+    store = SupabaseOutboxStore(supabase_mock)
+
+    with client.application.app_context():
+        assert store.claim(10) == [{"id": 1, "kind": "approve", "payload": 7, "attempts": 1}]
+    # Stale claims are picked up again, as with claim_notifications
+    assert "and(status.eq.sending,claimed_at.lte." in supabase_mock.from_.return_value.select.return_value.or_.call_args.args[0]
+    assert supabase_mock.from_.return_value.update.call_args.args[0]["status"] == "sending"
+    supabase_mock.from_.return_value.update.return_value.in_.assert_called_once_with("id", [1])
+
+def test_route_queues_through_outbox(outbox, store, sns, client):
+    with patch("flaskapp.blueprints.requests_routes.notifier", outbox), \
+         patch("flaskapp.models.requests.RequestService.reject_request", return_value=({"message": "Request rejected successfully"}, 200)), \
+         patch("flaskapp.models.versioning.ChangeVersion.bump"):
+        response = client.put('/request/7/reject', json={"result_reason": "busy"})
+
+    assert response.get_json()["email"] == "queued"
+    assert sns.messages == []
+    assert [(row["kind"], row["payload"]) for row in store.rows()] == [("reject", '"7"')]
+
+def test_notify_drain_command(client):
+    outbox = MagicMock()
+    outbox.drain.return_value = (3, 1)
+    with patch("flaskapp.main.notification_outbox", outbox):
+        result = client.application.test_cli_runner().invoke(args=["notify-drain"])
+
+    assert "Sent 3 notifications, 1 left for retry" in result.output
+
+def test_drain_scheduled_without_outbox(monkeypatch):
+    monkeypatch.setattr(outbox_module, "NOTIFICATION_OUTBOX", "")
+    assert outbox_module.drain_scheduled({}, None) is None
+
+def test_digest_coalesces_manager_notifications(store, sns, client):
+    supabase_caller = MagicMock()
+    supabase_caller.get_staff_data_many.side_effect = lambda ids: {
+        staff_id: {"Staff_ID": staff_id, "Staff_FName": name, "Staff_LName": "Tan", "Reporting_Manager": 9}
+        for staff_id, name in ((1, "John"), (2, "Jane"), (9, "Mary")) if staff_id in ids}
+    outbox = NotificationOutbox(store, notification_sender(notification_engine(supabase_caller)), digest_window=300)
+
+    with client.application.app_context():
+        for request_id, staff_id in ((7, 1), (8, 2), (9, 1), (10, 5)):
+            outbox.send_create({"request_id": request_id, "staff_id": staff_id, "startdate": "2024-10-01", "enddate": "2024-10-01"})
+        outbox.send_withdraw({"request_id": 11, "staff_id": 2, "startdate": "2024-10-02", "enddate": "2024-10-02"})
+        # Held until the window closes
+        assert outbox.drain() == (0, 0)
+        due = store.rows()[0]["next_attempt_at"]
+        assert {row["next_attempt_at"] for row in store.rows()} == {due}
+        assert due == outbox_module._window_end(outbox_module._now(), 300).isoformat()
+
+        for row in store.rows():
+            store.finish(row["id"], {"next_attempt_at": "2000-01-01T00:00:00+00:00"})
+        assert outbox.drain() == (4, 1)
+
+    assert len(sns.messages) == 2
+    create = next(message for message in sns.messages if "sent" in message)
+    assert create.startswith("Hi Mary Tan, 3 request(s) were sent")
+    assert all(f"(ID: {request_id})" in create for request_id in (7, 8, 9))
+    # Staff that cannot be looked up is retried on its own schedule
+    assert [(row["payload"], row["status"], row["last_error"]) for row in store.rows() if row["status"] != "sent"] == [
+        ('{"request_id": 10, "staff_id": 5, "startdate": "2024-10-01", "enddate": "2024-10-01"}', "pending", "Error fetching staff")]
+
+def test_digest_off_sends_each_notification(outbox, store, sns, client):
+    with client.application.app_context():
+        outbox.send_create({"request_id": 7, "staff_id": 1})
+        outbox.send_create({"request_id": 8, "staff_id": 1})
+        assert outbox.drain() == (2, 0)
+    assert len(sns.messages) == 2
@@ -0,0 +1,122 @@
+import pytest
+from unittest.mock import MagicMock
+from flaskapp.models.request_intervals import RequestIntervalIndex, StaffIntervals
+from flaskapp.models.requests import RequestService
+
+ROWS = [
+    {"request_id": 1, "staff_id": 140002, "startdate": "2024-11-04", "enddate": "2024-11-08", "time_slot": 3},
+    {"request_id": 2, "staff_id": 140002, "startdate": "2024-11-18", "enddate": "2024-11-18", "time_slot": 1},
+    {"request_id": 3, "staff_id": 140003, "startdate": "2024-11-04", "enddate": "2024-11-30", "time_slot": 2},
+]
+
+@pytest.fixture
+def supabase_mock():
+    supabase_mock = MagicMock()
+    supabase_mock.from_.return_value.select.return_value.in_.return_value.order.return_value.range.return_value.execute.return_value = MagicMock(data=ROWS)
+    return supabase_mock
+
+@pytest.fixture
+def index(supabase_mock):
+    return RequestIntervalIndex(supabase_mock)
+
+def test_loads_active_requests(index, supabase_mock):
+    index.overlapping(140002, "2024-11-01", "2024-11-01", 1)
+    supabase_mock.from_.return_value.select.return_value.in_.assert_called_once_with("status", [0, 1])
+    # Pages are ordered so none is skipped or repeated
+    supabase_mock.from_.return_value.select.return_value.in_.return_value.order.assert_called_once_with("request_id")
+
+def test_overlapping_ranges_and_slots(index):
+    assert index.overlapping(140002, "2024-11-08", "2024-11-20", 1) == [1, 2]
+    assert index.overlapping(140002, "2024-11-08", "2024-11-20", 2) == [1]
+    assert index.overlapping(140002, "2024-11-09", "2024-11-17", 3) == []
+    assert index.overlapping(140002, "2024-11-01T00:00:00", "2024-11-04T00:00:00", 2) == [1]
+    assert index.overlapping(140003, "2024-11-10", "2024-11-10", 1) == []
+    assert index.overlapping(999999, "2024-11-10", "2024-11-10", 3) == []
+
+def test_add_and_remove(index):
+    index.overlapping(140002, "2024-11-01", "2024-11-01", 1)
+    index.add({"request_id": 4, "staff_id": 140002, "startdate": "2024-11-11", "enddate": "2024-11-12", "time_slot": 2})
+    assert index.overlapping(140002, "2024-11-12", "2024-11-12", 3) == [4]
+
+    index.remove(4)
+    index.remove(1)
+    assert index.overlapping(140002, "2024-11-01", "2024-11-17", 3) == []
+
+def test_long_interval_found_behind_later_short_ones():
+    intervals = StaffIntervals()
+    intervals.add(("2024-01-01", "2024-12-31", 1, 3))
+    for day, request_id in (("2024-03-01", 2), ("2024-04-01", 3), ("2024-05-01", 4)):
+        intervals.add((day, day, request_id, 1))
+
+    assert intervals.overlapping("2024-06-01", "2024-06-01", 2) == [1]
+    intervals.remove(1)
+    assert intervals.overlapping("2024-06-01", "2024-06-01", 2) == []
+
+def _service(index):
+    supabase_mock = MagicMock()
+    supabase_mock.from_.return_value.insert.return_value.execute.return_value = MagicMock(data=[
+        {"request_id": 9, "staff_id": 140002, "startdate": "2024-11-25", "enddate": "2024-11-25", "time_slot": 1, "status": 0}
+    ])
+    return RequestService(supabase_mock, request_intervals=index), supabase_mock
+
+def test_create_request_rejects_overlap(index):
+    service, supabase_mock = _service(index)
+
+    result, status_code = service.create_request({"staffid": 140002, "startdate": "2024-11-07", "enddate": "2024-11-07", "time_slot": 1})
+
+    assert status_code == 409
+    assert result["overlapping_requests"] == [1]
+    supabase_mock.from_.return_value.insert.assert_not_called()
+
+def test_create_request_adds_to_index(index, client):
+    service, supabase_mock = _service(index)
+
+    with client.application.app_context():
+        _, status_code = service.create_request({"staffid": 140002, "startdate": "2024-11-25", "enddate": "2024-11-25", "time_slot": 1})
+
+    assert status_code == 201
+    assert index.overlapping(140002, "2024-11-25", "2024-11-25", 3) == [9]
+
+def test_create_request_flag_mode(index, client, monkeypatch):
+    monkeypatch.setattr("flaskapp.models.requests.REQUEST_OVERLAP", "flag")
+    service, supabase_mock = _service(index)
+
+    with client.application.app_context():
+        result, status_code = service.create_request({"staffid": 140002, "startdate": "2024-11-18", "enddate": "2024-11-18", "time_slot": 3})
+
+    assert status_code == 201
+    assert result["overlapping_requests"] == [2]
+
+def test_reject_request_frees_dates(index):
+    assert index.overlapping(140002, "2024-11-18", "2024-11-18", 1) == [2]
+    supabase_mock = MagicMock()
+    supabase_mock.from_.return_value.update.return_value.eq.return_value.execute.return_value = MagicMock(data=[{"request_id": 2}])
+    service = RequestService(supabase_mock, request_intervals=index)
+
+    assert service.reject_request(2, "No")[1] == 200
+    assert index.overlapping(140002, "2024-11-18", "2024-11-18", 1) == []
+
+def test_approval_skips_existing_schedule_rows():
+    supabase_mock = MagicMock()
+    supabase_mock.from_.return_value.select.return_value.in_.return_value.gte.return_value.lte.return_value.order.return_value.range.return_value.execute.return_value = MagicMock(
+        data=[{"staff_id": 140002, "date": "2024-11-04", "time_slot": 1}])
+    service = RequestService(supabase_mock)
+
+    result = service.create_schedule_entries(140002, ["2024-11-04", "2024-11-05", "2024-11-05"], 3, 9)
+
+    inserted = supabase_mock.from_.return_value.insert.call_args.args[0]
+    assert [(row["date"], row["time_slot"]) for row in inserted] == [("2024-11-04", 2), ("2024-11-05", 1), ("2024-11-05", 2)]
+    assert result == {"rows_written": 3, "rows_skipped": 3, "failed_chunks": []}
+
+def test_approval_does_not_trust_a_stale_index():
+    # The index still holds a slot another instance has since cancelled; the database decides
+    schedule_index = MagicMock()
+    schedule_index.is_away.return_value = True
+    supabase_mock = MagicMock()
+    supabase_mock.from_.return_value.select.return_value.in_.return_value.gte.return_value.lte.return_value.order.return_value.range.return_value.execute.return_value = MagicMock(data=[])
+    service = RequestService(supabase_mock, schedule_index=schedule_index)
+
+    result = service.create_schedule_entries(140002, ["2024-11-04"], 1, 9)
+
+    assert result == {"rows_written": 1, "rows_skipped": 0, "failed_chunks": []}
+    schedule_index.is_away.assert_not_called()
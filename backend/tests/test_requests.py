@@ -1,10 +1,14 @@
+import os
 import pytest
+import time
 from unittest.mock import MagicMock, patch
 from flask import Flask, jsonify, request, abort, current_app
-from flaskapp.models.requests import RequestService, RequestController
+from flaskapp.models.requests import RequestService, RequestController, listing_options
+from flaskapp.models.recurrence import expand_weekly, expand_rule, rule_rows, weekly_rule
 from flaskapp.blueprints.requests_routes import requests_blueprint
 from datetime import datetime, timedelta
 from werkzeug.exceptions import NotFound
+from postgrest.exceptions import APIError
 
 
 @pytest.fixture
@@ -41,29 +45,24 @@ def test_single_time_slot_insert(request_service, supabase_client):
     request_service.create_schedule_entries(staff_id=123, dates=["2024-10-26"], time_slot=1, request_id=456)
 
     # Assert that one insert call was made with the correct parameters
-    supabase_client.from_("schedule").insert.assert_called_once_with({
+    supabase_client.from_("schedule").insert.assert_called_once_with([{
         "staff_id": 123,
         "date": "2024-10-26",
         "time_slot": 1,
         "request_id": 456
-    })
+    }])
 
 def test_multiple_time_slots_insert(request_service, supabase_client):
-    # Mock insert responses for time slot 3 scenario
-    mock_response1 = MagicMock()
-    mock_response2 = MagicMock()
-    supabase_client.from_().insert().execute.side_effect = [mock_response1, mock_response2]
-
     # Call the method with time slot 3
-    request_service.create_schedule_entries(staff_id=123, dates=["2024-10-26"], time_slot=3, request_id=456)
+    result = request_service.create_schedule_entries(staff_id=123, dates=["2024-10-26"], time_slot=3, request_id=456)
 
-    # Assert that two insert calls were made with time slots 1 and 2
-    expected_calls = [
+    # Assert that one bulk insert was made with time slots 1 and 2
+    expected_rows = [
         {"staff_id": 123, "date": "2024-10-26", "time_slot": 1, "request_id": 456},
         {"staff_id": 123, "date": "2024-10-26", "time_slot": 2, "request_id": 456}
     ]
-    supabase_client.from_("schedule").insert.assert_any_call(expected_calls[0])
-    supabase_client.from_("schedule").insert.assert_any_call(expected_calls[1])
+    supabase_client.from_("schedule").insert.assert_called_once_with(expected_rows)
+    assert result == {"rows_written": 2, "rows_skipped": 0, "failed_chunks": []}
 
 def test_invalid_time_slot_type(request_service, supabase_client):
     # Mocking insert response
@@ -199,15 +198,81 @@ def test_calculate_recurring_dates_multiple_dates(request_service):
 
     assert result == expected_dates  # Verify the generated list of dates matches expected Mondays and Wednesdays
 
+def _reference_recurring_dates(approved_dates):
+    # The original day-by-day loop, kept to check the expansion engines against
+    date_list = []
+    earliest_date = min([datetime.strptime(date, '%Y-%m-%d') for date in approved_dates])
+    end_date = earliest_date + timedelta(days=365)
+    approved_weekdays = [date.weekday() for date in [datetime.strptime(date, '%Y-%m-%d') for date in approved_dates]]
+    current_date = earliest_date
+    while current_date <= end_date:
+        if current_date.weekday() in approved_weekdays:
+            date_list.append(current_date.strftime('%Y-%m-%d'))
+        current_date += timedelta(days=1)
+    return date_list
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_expand_weekly_matches_reference(engine):
+    if engine == "numpy":
+        pytest.importorskip("numpy")
+    cases = [
+        ["2024-01-01"],
+        ["2024-01-03", "2024-01-01"],
+        ["2024-02-29", "2024-03-01", "2024-03-04"],
+        ["2024-12-30", "2025-01-02", "2025-01-02"],
+        ["2024-11-04", "2024-11-05", "2024-11-06", "2024-11-07", "2024-11-08", "2024-11-09", "2024-11-10"],
+    ]
+    for approved_dates in cases:
+        assert expand_weekly(approved_dates, engine=engine) == _reference_recurring_dates(approved_dates)
+
+@pytest.mark.parametrize("engine", ["python", "numpy"])
+def test_expand_weekly_options(engine):
+    if engine == "numpy":
+        pytest.importorskip("numpy")
+    approved_dates = ["2024-01-01", "2024-01-01", "2024-01-03"]
+
+    assert expand_weekly(approved_dates, horizon_days=14, engine=engine) == ["2024-01-01", "2024-01-03", "2024-01-08", "2024-01-10", "2024-01-15"]
+    assert expand_weekly(approved_dates, end="2024-01-08", engine=engine) == ["2024-01-01", "2024-01-03", "2024-01-08"]
+    assert expand_weekly(approved_dates, horizon_days=14, holidays=["2024-01-08"], engine=engine) == ["2024-01-01", "2024-01-03", "2024-01-10", "2024-01-15"]
+    assert expand_weekly(approved_dates, end="2023-12-31", engine=engine) == []
+
+def test_calculate_recurring_dates_passes_options(request_service):
+    result = request_service.calculate_recurring_dates(["2024-01-01"], horizon_days=30, holidays=["2024-01-15"])
+    assert result == ["2024-01-01", "2024-01-08", "2024-01-22", "2024-01-29"]
+
+@pytest.mark.skipif(not os.environ.get("RUN_BENCHMARKS"), reason="wall-clock benchmark; set RUN_BENCHMARKS=1 to run it")
+def test_calculate_recurring_dates_benchmark(request_service):
+    approved_dates = ["2024-11-04", "2024-11-05", "2024-11-06", "2024-11-07", "2024-11-08"]
+    runs = 200
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        _reference_recurring_dates(approved_dates)
+    reference_elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = request_service.calculate_recurring_dates(approved_dates)
+    elapsed = time.perf_counter() - start
+
+    assert result == _reference_recurring_dates(approved_dates)
+    # Locally the engines are several times faster than the day-by-day loop
+    assert elapsed < reference_elapsed
+
 def test_withdraw_request_success(request_service, supabase_client):
     # Mock the response for withdrawing a request
-    supabase_client.from_("request").delete().eq("request_id", 1).execute.return_value = MagicMock(data=True)
+    supabase_client.from_("request").delete().eq("request_id", 1).execute.return_value = MagicMock(data=[
+        {"request_id": 1, "staff_id": 123, "startdate": "2024-11-01", "enddate": "2024-11-01", "status": 0}
+    ])
     
     response, status_code = request_service.withdraw_request(1)
     
     assert status_code == 200
     assert response["message"] == "Request cancel successful"
+    assert response["data"] == {"request_id": 1, "staff_id": 123, "startdate": "2024-11-01", "enddate": "2024-11-01"}
     supabase_client.from_("request").delete().eq("request_id", 1).execute.assert_called_once()
+    # The deleted row comes back from the delete itself
+    supabase_client.from_("request").select.assert_not_called()
 
 def test_withdraw_request_not_found(request_service, supabase_client):
     # Mock the response to simulate that no request was found
@@ -222,15 +287,47 @@ def test_withdraw_request_not_found(request_service, supabase_client):
 
 def test_cancel_request_success(request_service, supabase_client):
     # Mock the responses to simulate a successful cancel
-    supabase_client.from_("request").delete().eq("request_id", 1).execute.return_value = MagicMock(data=[{"request_id": 1}])
-    supabase_client.from_("schedule").delete().eq("request_id", 1).execute.return_value = MagicMock(data=[{"request_id": 1}])
+    supabase_client.from_("request").delete().eq("request_id", 1).execute.side_effect = [
+        MagicMock(data=[{"request_id": 1, "staff_id": 123, "startdate": "2024-11-01", "enddate": "2024-11-01", "status": 1}]),
+        MagicMock(data=[{"schedule_id": 5, "staff_id": 123, "date": "2024-11-01", "time_slot": 1, "request_id": 1}])
+    ]
 
     # Call the cancel_request method
     response, status_code = request_service.cancel_request(1)
 
     # Assert that the response is what we expect when the cancel is successful
     assert response["message"] == "Request withdrawn successful"
+    assert response["data"] == {"request_id": 1, "staff_id": 123, "startdate": "2024-11-01", "enddate": "2024-11-01"}
+    assert status_code == 200
+    supabase_client.from_("request").select.assert_not_called()
+
+def test_cancel_request_rpc(supabase_client, client):
+    schedule_index = MagicMock()
+    occupancy_summary = MagicMock()
+    service = RequestService(supabase_client, occupancy_summary=occupancy_summary, schedule_index=schedule_index, approval_rpc=True)
+    deleted = [{"staff_id": 123, "date": "2024-11-01", "time_slot": 1, "request_id": 1}]
+    supabase_client.rpc.return_value.execute.return_value = MagicMock(data={
+        "request": {"request_id": 1, "staff_id": 123, "startdate": "2024-11-01", "enddate": "2024-11-01", "status": 1},
+        "schedule": deleted
+    })
+
+    with client.application.app_context():
+        response, status_code = service.cancel_request(1)
+
     assert status_code == 200
+    assert response["data"] == {"request_id": 1, "staff_id": 123, "startdate": "2024-11-01", "enddate": "2024-11-01"}
+    supabase_client.rpc.assert_called_once_with("cancel_request", {"p_request_id": 1})
+    supabase_client.from_.assert_not_called()
+    schedule_index.remove.assert_called_once_with(deleted)
+    # The function updates the summary in its own transaction
+    occupancy_summary.record_removed.assert_not_called()
+
+def test_cancel_request_rpc_not_found(supabase_client, client):
+    service = RequestService(supabase_client, approval_rpc=True)
+    supabase_client.rpc.return_value.execute.side_effect = APIError({"code": "P0002", "message": "Request 999 not found", "details": None, "hint": None})
+
+    with client.application.app_context():
+        assert service.cancel_request(999) == ({"error": "Request not found"}, 404)
 
 def test_cancel_request_not_found(request_service, supabase_client):
     # Mock the responses to simulate a request not found
@@ -263,6 +360,46 @@ def test_create_request_success(request_service, supabase_client):
     assert result == {"request_id": 1, "staff_id": "123"}
     supabase_client.from_("request").insert().execute.assert_called_once()
 
+def test_create_request_idempotency_key_replays_first_attempt(request_service, supabase_client, client):
+    form_data = {"staffid": 123, "reason": "r", "status": 0, "startdate": "2024-11-04", "enddate": "2024-11-04", "time_slot": 1, "request_type": 1}
+    existing = {"request_id": 1, "staff_id": 123, "idempotency_key": "k1"}
+    supabase_client.from_.return_value.insert.return_value.execute.side_effect = APIError({"code": "23505", "message": "duplicate key", "details": None, "hint": None})
+    supabase_client.from_.return_value.select.return_value.eq.return_value.eq.return_value.execute.return_value = MagicMock(data=[existing])
+
+    with client.application.app_context():
+        result, status_code = request_service.create_request(form_data, "k1")
+
+    assert (result, status_code) == (existing, 200)
+    assert supabase_client.from_.return_value.insert.call_args.args[0]["idempotency_key"] == "k1"
+    supabase_client.from_.return_value.select.return_value.eq.assert_called_once_with("staff_id", 123)
+
+def test_create_request_duplicate_without_key_is_an_error(request_service, supabase_client, client):
+    supabase_client.from_.return_value.insert.return_value.execute.side_effect = APIError({"code": "23505", "message": "duplicate key", "details": None, "hint": None})
+
+    with client.application.app_context():
+        _, status_code = request_service.create_request({"staffid": 123, "startdate": "2024-11-04", "enddate": "2024-11-04", "time_slot": 1})
+
+    assert status_code == 500
+    supabase_client.from_.return_value.select.assert_not_called()
+
+def test_create_request_route_notifies_with_created_row(client):
+    created = {"request_id": 1, "staff_id": 123}
+    with patch("flaskapp.models.requests.RequestService.create_request", return_value=(created, 201)) as mock_create, \
+         patch("flaskapp.models.notification.notification_sender.send_create", return_value=200) as mock_send_create:
+        response = client.post('/requests/', json={"staffid": 123}, headers={"Idempotency-Key": "k1"})
+
+    assert response.status_code == 201
+    mock_create.assert_called_once_with({"staffid": 123}, "k1")
+    mock_send_create.assert_called_once_with(created)
+
+def test_create_request_route_replay_does_not_notify(client):
+    with patch("flaskapp.models.requests.RequestService.create_request", return_value=({"request_id": 1, "staff_id": 123}, 200)), \
+         patch("flaskapp.models.notification.notification_sender.send_create") as mock_send_create:
+        response = client.post('/requests/', json={"staffid": 123}, headers={"Idempotency-Key": "k1"})
+
+    assert response.status_code == 200
+    mock_send_create.assert_not_called()
+
 def test_create_request_insert_failure(request_service, supabase_client, client):
     # Use the application context for current_app.logger
     with client.application.app_context():
@@ -335,27 +472,162 @@ def test_get_requests_by_staff_not_found(request_service, supabase_client):
 
 def test_approve_request_success(request_service, supabase_client):
     request_response = MagicMock()
-    request_response.data = [{"request_id": 1, "staff_id": "123", "request_type": 1, "time_slot": 2}]
+    request_response.data = [{"request_id": 1, "staff_id": "123", "status": 0, "request_type": 1, "time_slot": 2}]
     supabase_client.from_("request").select().eq("request_id", 1).execute.return_value = request_response
 
-    request_service.create_schedule_entries = MagicMock()
+    request_service.create_schedule_entries = MagicMock(return_value={"rows_written": 1, "failed_chunks": []})
 
     result = request_service.approve_request(1, "Approved", ["2024-11-01"])
-    assert result == ({"message": "Request approved successfully"}, 200)
+    assert result == ({"message": "Request approved successfully", "rows_written": 1}, 200)
     supabase_client.from_("request").select().eq("request_id", 1).execute.assert_called_once()
 
+def test_approve_request_survives_occupancy_failure(supabase_client, client):
+    occupancy_summary = MagicMock()
+    occupancy_summary.record_added.side_effect = Exception("bump_occupancy timed out")
+    service = RequestService(supabase_client, occupancy_summary=occupancy_summary)
+    supabase_client.from_.return_value.select.return_value.eq.return_value.execute.return_value = MagicMock(
+        data=[{"request_id": 1, "staff_id": 123, "status": 0, "request_type": 1, "time_slot": 2}])
+
+    with client.application.app_context():
+        result = service.approve_request(1, "Approved", ["2024-11-01"])
+
+    # The schedule row is written and the request approved; the summary is left for occupancy-rebuild
+    assert result == ({"message": "Request approved successfully", "rows_written": 1}, 200)
+    supabase_client.from_.return_value.update.assert_called_once()
+    supabase_client.from_.return_value.delete.assert_not_called()
+
 def test_approve_request_success_recurring(request_service, supabase_client):
     request_response = MagicMock()
-    request_response.data = [{"request_id": 1, "staff_id": "123", "request_type": 2, "time_slot": 2}]
+    request_response.data = [{"request_id": 1, "staff_id": "123", "status": 0, "request_type": 2, "time_slot": 2}]
     supabase_client.from_("request").select().eq("request_id", 1).execute.return_value = request_response
 
     request_service.calculate_recurring_dates = MagicMock()
-    request_service.create_schedule_entries = MagicMock()
+    request_service.create_schedule_entries = MagicMock(return_value={"rows_written": 1, "failed_chunks": []})
 
     result = request_service.approve_request(1, "Approved", ["2024-11-01"])
-    assert result == ({"message": "Request approved successfully"}, 200)
+    assert result == ({"message": "Request approved successfully", "rows_written": 1}, 200)
     supabase_client.from_("request").select().eq("request_id", 1).execute.assert_called_once()
 
+def test_weekly_rule_round_trips_expand_weekly():
+    approved_dates = ["2024-11-04", "2024-11-06"]
+    rule = weekly_rule(approved_dates, 30)
+
+    assert rule == {"weekday_mask": 0b101, "startdate": "2024-11-04", "enddate": "2024-12-04", "exceptions": []}
+    assert expand_rule(rule) == expand_weekly(approved_dates, 30)
+    assert expand_rule(rule, "2024-11-10", "2024-11-14") == ["2024-11-11", "2024-11-13"]
+    assert expand_rule({**rule, "exceptions": ["2024-11-11"]}, "2024-11-10", "2024-11-14") == ["2024-11-13"]
+    assert expand_rule(rule, "2025-01-01", "2025-01-31") == []
+
+def test_rule_rows_full_day():
+    rule = {"request_id": 7, "staff_id": 140002, "weekday_mask": 1, "time_slot": 3, "startdate": "2024-11-04", "enddate": "2024-11-11"}
+    assert rule_rows(rule, "2024-11-05") == [
+        {"staff_id": 140002, "date": "2024-11-11", "time_slot": 1, "request_id": 7},
+        {"staff_id": 140002, "date": "2024-11-11", "time_slot": 2, "request_id": 7},
+    ]
+
+def test_approve_recurring_request_writes_one_rule(supabase_client):
+    occupancy_summary = MagicMock()
+    service = RequestService(supabase_client, occupancy_summary=occupancy_summary, recurrence_rules=True)
+    supabase_client.from_.return_value.select.return_value.eq.return_value.execute.return_value = MagicMock(
+        data=[{"request_id": 1, "staff_id": 140002, "status": 0, "request_type": 2, "time_slot": 1}])
+    supabase_client.from_.return_value.insert.return_value.execute.side_effect = lambda: MagicMock(
+        data=[{**supabase_client.from_.return_value.insert.call_args.args[0][0], "rule_id": 9}])
+
+    result = service.approve_request(1, "Approved", ["2024-11-04"])
+
+    assert result == ({"message": "Request approved successfully", "rows_written": 0, "rule_id": 9}, 200)
+    supabase_client.from_.assert_any_call("schedule_rule")
+    # schedule is only read, for the slots the staff member already holds
+    assert supabase_client.from_.return_value.insert.call_count == 1
+    inserted = supabase_client.from_.return_value.insert.call_args.args[0]
+    assert inserted == [{"weekday_mask": 1, "startdate": "2024-11-04", "enddate": "2025-11-04", "exceptions": [], "request_id": 1, "staff_id": 140002, "time_slot": 1}]
+    # The occupancy summary still counts every date the rule covers
+    staff_id, slots = occupancy_summary.record_added.call_args.args
+    assert staff_id == 140002 and len(slots) == 53
+
+def test_approve_recurring_rule_leaves_out_held_slots(supabase_client):
+    occupancy_summary = MagicMock()
+    service = RequestService(supabase_client, occupancy_summary=occupancy_summary, recurrence_rules=True)
+    supabase_client.from_.return_value.select.return_value.eq.return_value.execute.return_value = MagicMock(
+        data=[{"request_id": 1, "staff_id": 140002, "status": 0, "request_type": 2, "time_slot": 1}])
+    # An ad-hoc row already holds one of the rule's slots
+    supabase_client.from_.return_value.select.return_value.in_.return_value.gte.return_value.lte.return_value.order.return_value.range.return_value.execute.return_value = MagicMock(
+        data=[{"staff_id": 140002, "date": "2024-11-11", "time_slot": 1}])
+    supabase_client.from_.return_value.insert.return_value.execute.side_effect = lambda: MagicMock(
+        data=[{**supabase_client.from_.return_value.insert.call_args.args[0][0], "rule_id": 9}])
+
+    service.approve_request(1, "Approved", ["2024-11-04"])
+
+    staff_id, slots = occupancy_summary.record_added.call_args.args
+    assert staff_id == 140002 and len(slots) == 52 and ("2024-11-11", 1) not in slots
+
+def test_approve_request_rpc_with_rules(supabase_client, client):
+    service = RequestService(supabase_client, approval_rpc=True, recurrence_rules=True)
+    supabase_client.rpc.return_value.execute.return_value = MagicMock(data={
+        "request": {"request_id": 1}, "schedule": [{"staff_id": 140002, "date": "2024-11-04", "time_slot": 1, "request_id": 1}], "rule": {"rule_id": 9}})
+
+    with client.application.app_context():
+        result = service.approve_request(1, "Approved", ["2024-11-04"])
+
+    assert result == ({"message": "Request approved successfully", "rows_written": 0, "rule_id": 9}, 200)
+    assert supabase_client.rpc.call_args.args[1]["p_recurrence_rule"] is True
+
+def test_cancel_request_with_rule_removes_expanded_rows(supabase_client, client):
+    occupancy_summary = MagicMock()
+    service = RequestService(supabase_client, occupancy_summary=occupancy_summary, recurrence_rules=True)
+    rule = {"rule_id": 9, "request_id": 7, "staff_id": 140002, "weekday_mask": 1, "time_slot": 2, "startdate": "2024-11-04", "enddate": "2024-11-18"}
+    supabase_client.from_.return_value.delete.return_value.eq.return_value.execute.side_effect = [
+        MagicMock(data=[rule]),
+        MagicMock(data=[{"request_id": 7, "staff_id": 140002, "startdate": "2024-11-04", "enddate": "2024-11-04"}]),
+        MagicMock(data=[]),
+    ]
+
+    with client.application.app_context():
+        _, status_code = service.cancel_request(7)
+
+    assert status_code == 200
+    # The deletes, then the lookup of slots still held
+    assert [call.args[0] for call in supabase_client.from_.call_args_list][:3] == ["schedule_rule", "request", "schedule"]
+    occupancy_summary.record_removed.assert_called_once_with(140002, [("2024-11-04", 2), ("2024-11-11", 2), ("2024-11-18", 2)])
+
+def test_cancel_request_keeps_slots_still_held(supabase_client, client):
+    occupancy_summary = MagicMock()
+    service = RequestService(supabase_client, occupancy_summary=occupancy_summary, recurrence_rules=True)
+    rule = {"rule_id": 9, "request_id": 7, "staff_id": 140002, "weekday_mask": 1, "time_slot": 2, "startdate": "2024-11-04", "enddate": "2024-11-18"}
+    supabase_client.from_.return_value.delete.return_value.eq.return_value.execute.side_effect = [
+        MagicMock(data=[rule]),
+        MagicMock(data=[{"request_id": 7, "staff_id": 140002, "startdate": "2024-11-04", "enddate": "2024-11-04"}]),
+        MagicMock(data=[]),
+    ]
+    # Another request's row still holds the afternoon of 2024-11-11
+    supabase_client.from_.return_value.select.return_value.in_.return_value.gte.return_value.lte.return_value.order.return_value.range.return_value.execute.return_value = MagicMock(
+        data=[{"staff_id": 140002, "date": "2024-11-11", "time_slot": 2}])
+
+    with client.application.app_context():
+        service.cancel_request(7)
+
+    occupancy_summary.record_removed.assert_called_once_with(140002, [("2024-11-04", 2), ("2024-11-18", 2)])
+
+def test_held_slots_are_read_in_pages(supabase_client):
+    service = RequestService(supabase_client)
+    held = [{"staff_id": 1, "date": "2024-11-04", "time_slot": 1}, {"staff_id": 1, "date": "2024-11-04", "time_slot": 2}]
+    query = supabase_client.from_.return_value.select.return_value.in_.return_value.gte.return_value.lte.return_value.order.return_value
+    query.range.side_effect = lambda lo, hi: MagicMock(execute=MagicMock(return_value=MagicMock(data=held[lo:hi + 1])))
+
+    with patch("flaskapp.models.requests.HELD_PAGE_SIZE", 1):
+        assert service._held(held + [{"staff_id": 1, "date": "2024-11-05", "time_slot": 1}]) == {(1, "2024-11-04", 1), (1, "2024-11-04", 2)}
+    supabase_client.from_.return_value.select.return_value.in_.return_value.gte.return_value.lte.return_value.order.assert_called_with("schedule_id")
+    assert [c.args for c in query.range.call_args_list] == [(0, 0), (1, 1), (2, 2)]
+
+def test_is_scheduled_checks_rules(supabase_client):
+    service = RequestService(supabase_client, recurrence_rules=True)
+    supabase_client.from_.return_value.select.return_value.in_.return_value.gte.return_value.lte.return_value.order.return_value.range.return_value.execute.return_value = MagicMock(data=[])
+    supabase_client.from_.return_value.select.return_value.in_.return_value.lte.return_value.gte.return_value.order.return_value.range.return_value.execute.return_value = MagicMock(
+        data=[{"rule_id": 9, "request_id": 7, "staff_id": 140002, "weekday_mask": 1, "time_slot": 3, "startdate": "2024-11-04", "enddate": "2024-11-18"}])
+
+    assert service.is_scheduled(140002, "2024-11-11", 2)
+    assert not service.is_scheduled(140002, "2024-11-12", 2)
+
 def test_approve_request_not_found(request_service, supabase_client):
     supabase_client.from_("request").select().eq("request_id", 999).execute.return_value = MagicMock(data=None)
 
@@ -366,55 +638,160 @@ def test_approve_request_not_found(request_service, supabase_client):
 def test_reject_request_success(request_service, supabase_client):
     supabase_response = MagicMock()
     supabase_response.data = True
-    supabase_client.from_("request").update().eq("request_id", 1).execute.return_value = supabase_response
+    supabase_client.from_("request").update().eq("request_id", 1).eq("status", 0).execute.return_value = supabase_response
 
     result = request_service.reject_request(1, "Not Approved")
     assert result == ({"message": "Request rejected successfully"}, 200)
-    supabase_client.from_("request").update().eq("request_id", 1).execute.assert_called_once()
+    supabase_client.from_("request").update().eq("request_id", 1).eq("status", 0).execute.assert_called_once()
 
 def test_reject_request_not_found(request_service, supabase_client):
-    supabase_client.from_("request").update().eq("request_id", 999).execute.return_value = MagicMock(data=None)
+    supabase_client.from_("request").update().eq("request_id", 999).eq("status", 0).execute.return_value = MagicMock(data=None)
+    supabase_client.from_("request").select().eq("request_id", 999).execute.return_value = MagicMock(data=[])
 
     response = request_service.reject_request(999, "Rejected")
     assert response == ({'error': '404 Not Found: Request not found.'}, 500)
-    supabase_client.from_("request").update().eq("request_id", 999).execute.assert_called_once()
+    supabase_client.from_("request").update().eq("request_id", 999).eq("status", 0).execute.assert_called_once()
 
-def test_create_schedule_entries_response1_none(request_service, supabase_client, client, caplog):
-    # Use the application context for current_app.logger
-    with client.application.app_context(), caplog.at_level("ERROR"):
-        # Set up mock for supabase execute to return None for response1
-        supabase_client.from_("schedule").insert().execute.side_effect = [None, MagicMock()]
+def test_reject_request_not_pending(request_service, supabase_client):
+    supabase_client.from_("request").update().eq().eq().execute.return_value = MagicMock(data=[])
+    supabase_client.from_("request").select().eq().execute.return_value = MagicMock(data=[{"request_id": 1}])
 
-        staff_id = 123
-        dates = ["2024-11-01"]
-        time_slot = 3
-        request_id = 456
+    assert request_service.reject_request(1, "Rejected") == ({"error": "Request 1 is not pending"}, 409)
 
-        # Call the function
-        request_service.create_schedule_entries(staff_id, dates, time_slot, request_id)
+def test_approve_request_rpc(supabase_client, client):
+    schedule_index = MagicMock()
+    service = RequestService(supabase_client, schedule_index=schedule_index, approval_rpc=True)
+    rows = [{"staff_id": 123, "date": "2024-11-01", "time_slot": 1, "request_id": 1}, {"staff_id": 123, "date": "2024-11-01", "time_slot": 2, "request_id": 1}]
+    supabase_client.rpc.return_value.execute.return_value = MagicMock(data={"request": {"request_id": 1}, "schedule": rows})
 
-        # Check the log for the correct error message
-        assert any("Failed to create schedule entry for date 2024-11-01 with time_slot 1" in record.message for record in caplog.records)
+    with client.application.app_context():
+        result = service.approve_request(1, "Approved", ["2024-11-01"])
 
-        # Verify the execute call was made
-        supabase_client.from_("schedule").insert().execute.assert_called()
+    assert result == ({"message": "Request approved successfully", "rows_written": 2}, 200)
+    supabase_client.rpc.assert_called_once_with("approve_request", {
+        "p_request_id": 1, "p_result_reason": "Approved", "p_approved_dates": ["2024-11-01"], "p_horizon_days": 365
+    })
+    schedule_index.add.assert_called_once_with(rows)
+    # One round trip: no table reads or writes outside the function
+    supabase_client.from_.assert_not_called()
+
+@pytest.mark.parametrize("code, status_code", [("P0002", 404), ("PT409", 409), ("P0001", 500), ("23505", 500)])
+def test_approve_request_rpc_errors(supabase_client, client, code, status_code):
+    service = RequestService(supabase_client, approval_rpc=True)
+    supabase_client.rpc.return_value.execute.side_effect = APIError({"code": code, "message": "failed", "details": None, "hint": None})
 
-def test_create_schedule_entries_response2_none(request_service, supabase_client, client):
-    # Use the application context for current_app.logger
     with client.application.app_context():
-        # Mock the Supabase client so that the second insert returns None
-        supabase_client.from_("schedule").insert().execute.side_effect = [MagicMock(), None]
+        result, status = service.approve_request(1, "Approved", ["2024-11-01"])
 
-        staff_id = 123
-        dates = ["2024-11-01"]
-        time_slot = 3
-        request_id = 456
+    assert status == status_code
+    assert "error" in result
+
+def test_approve_request_not_pending(request_service, supabase_client):
+    supabase_client.from_("request").select().eq().execute.return_value = MagicMock(data=[{"request_id": 1, "staff_id": 123, "status": 1, "request_type": 1, "time_slot": 2}])
+
+    assert request_service.approve_request(1, "Approved", ["2024-11-01"]) == ({"error": "Request 1 is not pending"}, 409)
+    supabase_client.from_("schedule").insert.assert_not_called()
+    supabase_client.from_("request").update.assert_not_called()
+
+def test_approve_request_decided_concurrently_removes_rows(request_service, supabase_client, client):
+    supabase_client.from_("request").select().eq().execute.return_value = MagicMock(data=[{"request_id": 1, "staff_id": 123, "status": 0, "request_type": 1, "time_slot": 2}])
+    # The guarded status update matches nothing: the request was decided while its schedule was written
+    supabase_client.from_("request").update().eq().eq().execute.return_value = MagicMock(data=[])
 
-        # Call the create_schedule_entries method
-        request_service.create_schedule_entries(staff_id, dates, time_slot, request_id)
+    with client.application.app_context():
+        assert request_service.approve_request(1, "Approved", ["2024-11-01"]) == ({"error": "Request 1 is not pending"}, 409)
+    supabase_client.from_("request").update().eq().eq.assert_called_with("status", 0)
+    supabase_client.from_("schedule").delete().in_.assert_called_once_with("request_id", [1])
+
+def test_approve_request_falls_back_without_function(supabase_client, client):
+    service = RequestService(supabase_client, approval_rpc=True)
+    supabase_client.rpc.return_value.execute.side_effect = APIError({"code": "PGRST202", "message": "Could not find the function", "details": None, "hint": None})
+    supabase_client.from_("request").select().eq("request_id", 1).execute.return_value = MagicMock(data=[{"request_id": 1, "staff_id": 123, "status": 0, "request_type": 1, "time_slot": 2}])
+
+    with client.application.app_context():
+        assert service.approve_request(1, "Approved", ["2024-11-01"]) == ({"message": "Request approved successfully", "rows_written": 1}, 200)
+        service.reject_request(2, "No")
+
+    # The missing function is remembered, so later calls go straight to the Python path
+    assert service.approval_rpc is False
+    supabase_client.rpc.assert_called_once()
+
+def test_reject_request_rpc(supabase_client, client):
+    service = RequestService(supabase_client, approval_rpc=True)
+    supabase_client.rpc.return_value.execute.return_value = MagicMock(data={"request": {"request_id": 1}})
+
+    with client.application.app_context():
+        assert service.reject_request(1, "Not Approved") == ({"message": "Request rejected successfully"}, 200)
+    supabase_client.rpc.assert_called_once_with("reject_request", {"p_request_id": 1, "p_result_reason": "Not Approved"})
 
-        # Verify that the insert method was called twice
-        assert supabase_client.from_("schedule").insert().execute.call_count == 2
+def test_create_schedule_entries_response_none(request_service, supabase_client, client, caplog):
+    # Use the application context for current_app.logger
+    with client.application.app_context(), caplog.at_level("ERROR"):
+        # Set up mock for supabase execute to return None for the bulk insert
+        supabase_client.from_("schedule").insert().execute.return_value = None
+
+        result = request_service.create_schedule_entries(123, ["2024-11-01"], 3, 456)
+
+        # Check the log for the correct error message
+        assert any("Failed to create schedule entries 2024-11-01 to 2024-11-01 (chunk 0)" in record.message for record in caplog.records)
+        assert result == {"rows_written": 0, "rows_skipped": 0, "failed_chunks": [
+            {"chunk": 0, "start_date": "2024-11-01", "end_date": "2024-11-01", "rows": 2, "error": "No response"}
+        ]}
+
+def test_create_schedule_entries_chunks(request_service, supabase_client, client):
+    # Use the application context for current_app.logger
+    with client.application.app_context():
+        # The second chunk fails; the others are still written
+        supabase_client.from_("schedule").insert().execute.side_effect = [MagicMock(), Exception("timeout"), MagicMock()]
+        supabase_client.from_("schedule").insert.reset_mock()
+        dates = ["2024-11-04", "2024-11-05", "2024-11-06", "2024-11-07", "2024-11-08"]
+
+        result = request_service.create_schedule_entries(123, dates, 1, 456, chunk_size=2)
+
+        inserted = [call.args[0] for call in supabase_client.from_("schedule").insert.call_args_list]
+        assert [[row["date"] for row in chunk] for chunk in inserted] == [dates[0:2], dates[2:4], dates[4:5]]
+        assert result == {"rows_written": 3, "rows_skipped": 0, "failed_chunks": [
+            {"chunk": 1, "start_date": "2024-11-06", "end_date": "2024-11-07", "rows": 2, "error": "timeout"}
+        ]}
+
+def test_create_schedule_entries_single_round_trip_for_a_year(request_service, supabase_client):
+    dates = request_service.calculate_recurring_dates(["2024-11-04", "2024-11-05", "2024-11-06", "2024-11-07", "2024-11-08"])
+
+    result = request_service.create_schedule_entries(123, dates, 3, 456)
+
+    assert supabase_client.from_("schedule").insert().execute.call_count == 2
+    assert result["rows_written"] == len(dates) * 2
+
+def test_approve_request_keeps_request_pending_when_chunks_fail(request_service, supabase_client):
+    supabase_client.from_("request").select().eq("request_id", 1).execute.return_value = MagicMock(data=[{"request_id": 1, "staff_id": "123", "status": 0, "request_type": 1, "time_slot": 2}])
+    failed = {"rows_written": 0, "failed_chunks": [{"chunk": 0, "start_date": "2024-11-01", "end_date": "2024-11-01", "rows": 1, "error": "timeout"}]}
+    request_service.create_schedule_entries = MagicMock(return_value=failed)
+
+    result, status_code = request_service.approve_request(1, "Approved", ["2024-11-01"])
+
+    assert status_code == 500
+    assert result["failed_chunks"] == failed["failed_chunks"]
+    supabase_client.from_("request").update.assert_not_called()
+
+def test_approve_request_removes_written_rows_when_chunks_fail(supabase_client, client):
+    occupancy_summary = MagicMock()
+    schedule_index = MagicMock()
+    schedule_index.is_away.return_value = False
+    service = RequestService(supabase_client, occupancy_summary=occupancy_summary, schedule_index=schedule_index)
+    supabase_client.from_("request").select().eq("request_id", 1).execute.return_value = MagicMock(data=[{"request_id": 1, "staff_id": 123, "status": 0, "request_type": 1, "time_slot": 1}])
+    supabase_client.from_("schedule").insert().execute.side_effect = [MagicMock(), Exception("timeout")]
+    written = [{"staff_id": 123, "date": "2024-11-04", "time_slot": 1, "request_id": 1}]
+    supabase_client.from_("schedule").delete().in_().execute.return_value = MagicMock(data=written)
+
+    with client.application.app_context(), patch("flaskapp.models.requests.SCHEDULE_INSERT_CHUNK_SIZE", 1):
+        result, status_code = service.approve_request(1, "Approved", ["2024-11-04", "2024-11-05"])
+
+    assert status_code == 500 and result["rows_written"] == 0
+    supabase_client.from_("schedule").delete().in_.assert_called_with("request_id", [1])
+    occupancy_summary.record_added.assert_called_once_with(123, [("2024-11-04", 1)])
+    occupancy_summary.record_removed.assert_called_once_with(123, [("2024-11-04", 1)])
+    schedule_index.remove.assert_called_once_with(written)
+    supabase_client.from_("request").update.assert_not_called()
 
 def test_get_requests_by_staff_no_response(request_service, supabase_client, client):
     # Use the application context for current_app.logger
@@ -745,4 +1122,337 @@ def test_reject_request_controller_success(request_controller, client):
             # Assert the expected response
             assert response.status_code == 400
             assert response.get_json() == {"message": "Request rejected successfully"}
-" """
\ No newline at end of file
+" """
+# ---------------------------------------------
+# Conditional GET on request listings
+# ---------------------------------------------
+def test_get_requests_by_staff_etag_round_trip(client):
+    with patch("flaskapp.models.versioning.ChangeVersion.current", return_value=3), \
+         patch("flaskapp.models.requests.RequestService.get_requests_by_staff", return_value=([{"request_id": 1}], 200)) as mock_get_requests_by_staff:
+        first = client.get('/requests/123')
+        etag = first.headers["ETag"]
+        second = client.get('/requests/123', headers={"If-None-Match": etag})
+
+    assert first.status_code == 200
+    assert second.status_code == 304
+    assert second.headers["ETag"] == etag
+    mock_get_requests_by_staff.assert_called_once()
+
+def test_get_team_requests_etag_changes_with_version(client):
+    with patch("flaskapp.models.versioning.ChangeVersion.current", side_effect=[3, 4]), \
+         patch("flaskapp.models.requests.RequestService.get_team_requests", return_value=([], 200)) as mock_get_team_requests:
+        first = client.get('/team/requests', headers={'X-Staff-ID': '123'})
+        second = client.get('/team/requests', headers={'X-Staff-ID': '123', "If-None-Match": first.headers["ETag"]})
+
+    assert second.status_code == 200
+    assert second.headers["ETag"] != first.headers["ETag"]
+    assert mock_get_team_requests.call_count == 2
+
+def test_approve_request_bumps_change_version(client):
+    with patch("flaskapp.models.requests.RequestService.approve_request", return_value=({"message": "Request approved successfully"}, 200)), \
+         patch("flaskapp.models.notification.notification_sender.send_approve", return_value="test_email"), \
+         patch("flaskapp.models.versioning.ChangeVersion.bump") as mock_bump:
+        client.put('/request/1/approve', json={"result_reason": "Approved", "approved_dates": ["2024-11-01"]})
+
+    mock_bump.assert_called_once()
+
+def test_failed_reject_does_not_bump_change_version(client):
+    with patch("flaskapp.models.requests.RequestService.reject_request", return_value=({"error": "Request not found"}, 500)), \
+         patch("flaskapp.models.versioning.ChangeVersion.bump") as mock_bump:
+        client.put('/request/1/reject', json={"result_reason": "Rejected"})
+
+    mock_bump.assert_not_called()
+
+# ---------------------------------------------
+# Paginated request listings
+# ---------------------------------------------
+def _listing_query(supabase_client, rows):
+    # Every filter returns the same query so the calls can be inspected afterwards
+    query = MagicMock()
+    for method in ("eq", "in_", "gt", "gte", "lte", "order", "limit"):
+        getattr(query, method).return_value = query
+    query.execute.return_value = MagicMock(data=rows)
+    supabase_client.from_.return_value.select.return_value = query
+    return query
+
+def test_listing_options():
+    assert listing_options({}) is None
+    assert listing_options({"limit": "2", "cursor": "10", "status": "0", "start": "2024-11-01", "fields": "status,request_id,startdate"}) == {
+        "limit": 2, "cursor": 10, "status": 0, "start": "2024-11-01", "end": None, "fields": ["request_id", "status", "startdate"]
+    }
+    for args in ({"limit": "0"}, {"limit": "1000"}, {"cursor": "abc"}, {"start": "01/11/2024"}, {"fields": "staff_id,password"}):
+        with pytest.raises(ValueError):
+            listing_options(args)
+
+def test_get_requests_by_staff_first_page(request_service, supabase_client):
+    query = _listing_query(supabase_client, [{"request_id": 3}, {"request_id": 5}, {"request_id": 8}])
+    options = listing_options({"limit": "2", "status": "1", "fields": "status"})
+
+    result, status_code = request_service.get_requests_by_staff(123, options)
+
+    assert status_code == 200
+    assert result == {"requests": [{"request_id": 3}, {"request_id": 5}], "next_cursor": 5}
+    supabase_client.from_.return_value.select.assert_called_once_with("request_id, status")
+    query.eq.assert_any_call("staff_id", 123)
+    query.eq.assert_any_call("status", 1)
+    query.order.assert_called_once_with("request_id")
+    query.limit.assert_called_once_with(3)
+    query.gt.assert_not_called()
+
+def test_get_requests_by_staff_last_page(request_service, supabase_client):
+    query = _listing_query(supabase_client, [{"request_id": 8}])
+    options = listing_options({"limit": "2", "cursor": "5", "start": "2024-11-01", "end": "2024-11-30"})
+
+    result, status_code = request_service.get_requests_by_staff(123, options)
+
+    assert result == {"requests": [{"request_id": 8}], "next_cursor": None}
+    query.gt.assert_called_once_with("request_id", 5)
+    # Requests overlapping the range
+    query.gte.assert_called_once_with("enddate", "2024-11-01")
+    query.lte.assert_called_once_with("startdate", "2024-11-30")
+
+def test_get_team_requests_page_keeps_pending_filter(supabase_client):
+    org_chart = MagicMock()
+    org_chart.get.return_value = {"Role": 3, "Position": "Sales Manager"}
+    org_chart.direct_reports.return_value = [{"Staff_ID": 1}, {"Staff_ID": 2}]
+    service = RequestService(supabase_client, org_chart)
+    query = _listing_query(supabase_client, [{"request_id": 4}])
+
+    result, status_code = service.get_team_requests(140894, listing_options({"limit": "20"}))
+
+    assert (result, status_code) == ({"requests": [{"request_id": 4}], "next_cursor": None}, 200)
+    query.in_.assert_called_once_with("staff_id", [1, 2])
+    query.eq.assert_called_once_with("status", 0)
+
+def test_get_requests_by_staff_route_rejects_bad_options(client):
+    with patch("flaskapp.models.versioning.ChangeVersion.current", return_value=None), \
+         patch("flaskapp.models.requests.RequestService.get_requests_by_staff") as mock_get_requests_by_staff:
+        response = client.get('/requests/123?limit=abc')
+
+    assert response.status_code == 400
+    mock_get_requests_by_staff.assert_not_called()
+
+# ---------------------------------------------
+# Manager approval queue
+# ---------------------------------------------
+def test_team_requests_single_query_through_view(supabase_client):
+    org_chart = MagicMock()
+    org_chart.get.return_value = {"Role": 1, "Position": "Director"}
+    service = RequestService(supabase_client, org_chart, team_queue_view=True)
+    query = _listing_query(supabase_client, [{"request_id": 4, "staff_id": 140002, "reporting_manager": 140001}])
+
+    result, status_code = service.get_team_requests("140001")
+
+    assert (result, status_code) == ([{"request_id": 4, "staff_id": 140002, "reporting_manager": 140001}], 200)
+    supabase_client.from_.assert_called_once_with("manager_request_queue")
+    query.eq.assert_any_call("reporting_manager", "140001")
+    query.eq.assert_any_call("status", 0)
+    query.in_.assert_not_called()
+    org_chart.direct_reports.assert_not_called()
+
+def test_team_requests_fall_back_without_view(supabase_client, client):
+    org_chart = MagicMock()
+    org_chart.get.return_value = {"Role": 1, "Position": "Director"}
+    org_chart.direct_reports.return_value = [{"Staff_ID": 140002}]
+    service = RequestService(supabase_client, org_chart, team_queue_view=True)
+    query = _listing_query(supabase_client, [])
+    query.execute.side_effect = [APIError({"code": "PGRST205", "message": "Could not find the table", "details": None, "hint": None}), MagicMock(data=[{"request_id": 4}])]
+
+    with client.application.app_context():
+        result, status_code = service.get_team_requests("140001")
+
+    assert (result, status_code) == ([{"request_id": 4}], 200)
+    assert service.team_queue_view is False
+    query.in_.assert_called_once_with("staff_id", [140002])
+
+def test_team_access_check_is_cached(request_service, supabase_client):
+    supabase_client.from_().select().eq().execute.return_value = MagicMock(data=[{"Role": 2, "Position": "Account Manager"}])
+    supabase_client.from_().select().eq().execute.reset_mock()
+
+    assert request_service.get_team_requests(140002) == ([], 401)
+    assert request_service.get_team_requests("140002") == ([], 401)
+    supabase_client.from_().select().eq().execute.assert_called_once()
+
+def test_team_access_cache_is_bounded(request_service, supabase_client):
+    supabase_client.from_().select().eq().execute.return_value = MagicMock(data=[{"Role": 2, "Position": "Account Manager"}])
+
+    with patch("flaskapp.models.requests.TEAM_ACCESS_MAX", 2):
+        for staff_id in (1, 2, 3):
+            request_service.can_view_team_requests(staff_id)
+
+    assert list(request_service._team_access) == ["2", "3"]
+
+def test_team_access_follows_org_chart(supabase_client):
+    org_chart = MagicMock()
+    org_chart.get.return_value = {"Role": 1, "Position": "Director"}
+    service = RequestService(supabase_client, org_chart)
+
+    assert service.can_view_team_requests(140001) is True
+    # A reloaded org chart is seen straight away
+    org_chart.get.return_value = {"Role": 2, "Position": "Director"}
+    assert service.can_view_team_requests(140001) is False
+    assert service._team_access == {}
+
+def test_team_requests_through_view_without_team(supabase_client):
+    org_chart = MagicMock()
+    org_chart.get.return_value = {"Role": 1, "Position": "Director"}
+    service = RequestService(supabase_client, org_chart, team_queue_view=True)
+    _listing_query(supabase_client, [])
+
+    org_chart.direct_reports.return_value = []
+    assert service.get_team_requests("140001") == ([], 404)
+    # A team with nothing pending is an empty queue, not a missing team
+    org_chart.direct_reports.return_value = [{"Staff_ID": 140002}]
+    assert service.get_team_requests("140001") == ([], 200)
+
+# ---------------------------------------------
+# Bulk approve/reject
+# ---------------------------------------------
+def _bulk_supabase(supabase_client, requests, pending=None):
+    supabase_client.from_.return_value.select.return_value.in_.return_value.execute.return_value = MagicMock(data=requests)
+    # The guarded status update returns the rows it changed: every one asked for unless pending says otherwise
+    update = supabase_client.from_.return_value.update.return_value
+    update.in_.return_value.eq.return_value.execute.side_effect = lambda: MagicMock(data=[
+        {"request_id": i} for i in update.in_.call_args.args[1] if pending is None or i in pending])
+    return supabase_client
+
+def test_decide_requests(request_service, supabase_client, client):
+    _bulk_supabase(supabase_client, [
+        {"request_id": 1, "staff_id": 101, "request_type": 1, "time_slot": 3, "status": 0, "startdate": "2024-11-04", "enddate": "2024-11-05"},
+        {"request_id": 2, "staff_id": 102, "request_type": 1, "time_slot": 1, "status": 0, "startdate": "2024-11-06", "enddate": "2024-11-06"},
+        {"request_id": 3, "staff_id": 103, "request_type": 1, "time_slot": 1, "status": 0, "startdate": "2024-11-07", "enddate": "2024-11-07"},
+        {"request_id": 4, "staff_id": 104, "request_type": 1, "time_slot": 1, "status": 1, "startdate": "2024-11-08", "enddate": "2024-11-08"},
+    ])
+
+    with client.application.app_context():
+        results = request_service.decide_requests([
+            {"request_id": 1, "decision": "approve", "result_reason": "ok", "approved_dates": ["2024-11-04", "2024-11-05"]},
+            {"request_id": 2, "decision": "approve", "result_reason": "ok", "approved_dates": ["2024-11-06"]},
+            {"request_id": 3, "decision": "reject", "result_reason": "busy"},
+            {"request_id": 4, "decision": "approve", "approved_dates": ["2024-11-08"]},
+            {"request_id": 5, "decision": "approve", "approved_dates": ["2024-11-08"]},
+            {"request_id": 6, "decision": "maybe"},
+        ])
+
+    assert [(r["request_id"], r["status"]) for r in results] == [(1, 200), (2, 200), (3, 200), (4, 409), (5, 404), (6, 400)]
+    assert results[0]["rows_written"] == 4 and results[1]["rows_written"] == 1
+    assert results[2]["message"] == "Request rejected successfully"
+
+    # One read, one lookup of held slots and one bulk insert for both approvals, one update per (status, result_reason)
+    assert [call.args[0] for call in supabase_client.from_.return_value.select.call_args_list] == ["*", "staff_id, date, time_slot"]
+    inserted = supabase_client.from_.return_value.insert.call_args_list
+    assert len(inserted) == 1 and len(inserted[0].args[0]) == 5
+    updates = supabase_client.from_.return_value.update.call_args_list
+    assert [call.args[0] for call in updates] == [{"status": 1, "result_reason": "ok"}, {"status": -1, "result_reason": "busy"}]
+    supabase_client.from_.return_value.update.return_value.in_.assert_any_call("request_id", [1, 2])
+
+def test_decide_requests_failed_chunk_keeps_request_pending(request_service, supabase_client, client):
+    _bulk_supabase(supabase_client, [
+        {"request_id": 1, "staff_id": 101, "request_type": 1, "time_slot": 1, "status": 0, "startdate": "2024-11-04", "enddate": "2024-11-04"},
+    ])
+    supabase_client.from_.return_value.insert.return_value.execute.side_effect = Exception("timeout")
+
+    with client.application.app_context():
+        results = request_service.decide_requests([{"request_id": 1, "decision": "approve", "approved_dates": ["2024-11-04"]}])
+
+    assert results[0]["status"] == 500
+    supabase_client.from_.return_value.update.assert_not_called()
+
+def test_decide_requests_failed_chunk_removes_rows_of_other_chunks(request_service, supabase_client, client):
+    _bulk_supabase(supabase_client, [
+        {"request_id": 1, "staff_id": 101, "request_type": 1, "time_slot": 3, "status": 0, "startdate": "2024-11-04", "enddate": "2024-11-04"},
+        {"request_id": 2, "staff_id": 102, "request_type": 1, "time_slot": 1, "status": 0, "startdate": "2024-11-04", "enddate": "2024-11-04"},
+    ])
+    # Request 1's two rows land in different chunks and only the second chunk fails
+    supabase_client.from_.return_value.insert.return_value.execute.side_effect = [MagicMock(), Exception("timeout"), MagicMock()]
+
+    with client.application.app_context(), patch("flaskapp.models.requests.SCHEDULE_INSERT_CHUNK_SIZE", 1):
+        results = request_service.decide_requests([
+            {"request_id": 1, "decision": "approve", "approved_dates": ["2024-11-04"]},
+            {"request_id": 2, "decision": "approve", "approved_dates": ["2024-11-04"]},
+        ])
+
+    assert [result["status"] for result in results] == [500, 200]
+    supabase_client.from_.return_value.delete.return_value.in_.assert_called_once_with("request_id", [1])
+    supabase_client.from_.return_value.update.return_value.in_.assert_called_once_with("request_id", [2])
+
+def test_decide_requests_failed_update_removes_rows(request_service, supabase_client, client):
+    _bulk_supabase(supabase_client, [
+        {"request_id": 1, "staff_id": 101, "request_type": 1, "time_slot": 1, "status": 0, "startdate": "2024-11-04", "enddate": "2024-11-04"},
+    ])
+    supabase_client.from_.return_value.update.return_value.in_.side_effect = Exception("timeout")
+
+    with client.application.app_context():
+        results = request_service.decide_requests([{"request_id": 1, "decision": "approve", "approved_dates": ["2024-11-04"]}])
+
+    assert results == [{"request_id": 1, "status": 500, "error": "timeout"}]
+    supabase_client.from_.return_value.delete.return_value.in_.assert_called_once_with("request_id", [1])
+
+def test_decide_requests_skips_requests_decided_concurrently(request_service, supabase_client, client):
+    _bulk_supabase(supabase_client, [
+        {"request_id": 1, "staff_id": 101, "request_type": 1, "time_slot": 1, "status": 0, "startdate": "2024-11-04", "enddate": "2024-11-04"},
+        {"request_id": 2, "staff_id": 102, "request_type": 1, "time_slot": 1, "status": 0, "startdate": "2024-11-04", "enddate": "2024-11-04"},
+    ], pending={2})
+
+    with client.application.app_context():
+        results = request_service.decide_requests([
+            {"request_id": 1, "decision": "approve", "approved_dates": ["2024-11-04"]},
+            {"request_id": 2, "decision": "approve", "approved_dates": ["2024-11-04"]},
+        ])
+
+    assert [(result["status"], result.get("error")) for result in results] == [(409, "Request is not pending"), (200, None)]
+    supabase_client.from_.return_value.update.return_value.in_.return_value.eq.assert_called_once_with("status", 0)
+    supabase_client.from_.return_value.delete.return_value.in_.assert_called_once_with("request_id", [1])
+
+def test_decide_requests_restores_shared_slots(request_service, supabase_client, client):
+    # Requests 1 and 2 of the same staff member share the morning of 2024-11-04; only 2 is still pending
+    _bulk_supabase(supabase_client, [
+        {"request_id": 1, "staff_id": 101, "request_type": 1, "time_slot": 1, "status": 0, "startdate": "2024-11-04", "enddate": "2024-11-04"},
+        {"request_id": 2, "staff_id": 101, "request_type": 1, "time_slot": 1, "status": 0, "startdate": "2024-11-04", "enddate": "2024-11-05"},
+    ], pending={2})
+
+    with client.application.app_context():
+        results = request_service.decide_requests([
+            {"request_id": 1, "decision": "approve", "approved_dates": ["2024-11-04"]},
+            {"request_id": 2, "decision": "approve", "approved_dates": ["2024-11-04", "2024-11-05"]},
+        ])
+
+    assert [(result["status"], result.get("rows_written")) for result in results] == [(409, None), (200, 2)]
+    supabase_client.from_.return_value.delete.return_value.in_.assert_called_once_with("request_id", [1])
+    # The shared slot went out with request 1's rows, so it is written again for request 2
+    inserted = [call.args[0] for call in supabase_client.from_.return_value.insert.call_args_list]
+    assert inserted[-1] == [{"staff_id": 101, "date": "2024-11-04", "time_slot": 1, "request_id": 2}]
+
+def test_request_decisions_route_sends_one_notification(client):
+    results = [{"request_id": 1, "status": 200, "decision": "approve"}, {"request_id": 2, "status": 404, "error": "Request not found"}]
+    with patch("flaskapp.models.requests.RequestService.decide_requests", return_value=results), \
+         patch("flaskapp.models.notification.notification_sender.send_decisions", return_value=200) as mock_send_decisions, \
+         patch("flaskapp.models.versioning.ChangeVersion.bump") as mock_bump:
+        response = client.post('/requests/decisions', json={"decisions": [{"request_id": 1, "decision": "approve"}, {"request_id": 2, "decision": "reject"}]})
+
+    assert response.status_code == 200
+    assert response.get_json() == {"results": results, "email": 200}
+    mock_send_decisions.assert_called_once_with([results[0]])
+    mock_bump.assert_called_once()
+
+def test_request_decisions_route_rejects_bad_body(client):
+    assert client.post('/requests/decisions', json={"decisions": []}).status_code == 400
+
+def test_decide_requests_stores_recurring_approvals_as_rules(supabase_client, client):
+    service = RequestService(supabase_client, recurrence_rules=True)
+    _bulk_supabase(supabase_client, [
+        {"request_id": 1, "staff_id": 101, "request_type": 2, "time_slot": 1, "status": 0, "startdate": "2024-11-04", "enddate": "2024-11-04"},
+        {"request_id": 2, "staff_id": 102, "request_type": 2, "time_slot": 2, "status": 0, "startdate": "2024-11-05", "enddate": "2024-11-05"},
+    ])
+    supabase_client.from_.return_value.insert.return_value.execute.return_value = MagicMock(data=[])
+
+    with client.application.app_context():
+        results = service.decide_requests([
+            {"request_id": 1, "decision": "approve", "approved_dates": ["2024-11-04"]},
+            {"request_id": 2, "decision": "approve", "approved_dates": ["2024-11-05"]},
+        ])
+
+    assert [result["status"] for result in results] == [200, 200]
+    # One insert of both rules, no schedule rows
+    supabase_client.from_.return_value.insert.assert_called_once()
+    assert [rule["request_id"] for rule in supabase_client.from_.return_value.insert.call_args.args[0]] == [1, 2]
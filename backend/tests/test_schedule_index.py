@@ -0,0 +1,178 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from flaskapp.models import schedule_index as schedule_index_module
+from flaskapp.models.schedule_index import ScheduleIndex
+from flaskapp.models.requests import RequestService
+from flaskapp.models.schedules import SchedulesService
+
+ROWS = [
+    {"staff_id": 140002, "date": "2024-10-01", "time_slot": 1},
+    {"staff_id": 140003, "date": "2024-10-01", "time_slot": 1},
+    {"staff_id": 140002, "date": "2024-10-03", "time_slot": 2},
+    {"staff_id": 140004, "date": "2024-10-07", "time_slot": 1},
+]
+
+def _paged(supabase_mock, rows):
+    # .order(key).range(lo, hi) returns that slice of rows, like PostgREST; each query is kept in .queries
+    supabase_mock.queries = []
+    def select(*args):
+        query = MagicMock()
+        query.order.return_value = query
+        query.range.side_effect = lambda lo, hi: MagicMock(execute=MagicMock(return_value=MagicMock(data=rows[lo:hi + 1])))
+        supabase_mock.queries.append(query)
+        return query
+    supabase_mock.from_.return_value.select.side_effect = select
+
+@pytest.fixture
+def supabase_mock():
+    supabase_mock = MagicMock()
+    _paged(supabase_mock, ROWS)
+    return supabase_mock
+
+@pytest.fixture
+def index(supabase_mock):
+    return ScheduleIndex(supabase_mock)
+
+def test_away_on_slot(index):
+    assert index.away_on("2024-10-01", 1) == [140002, 140003]
+    assert index.away_on("2024-10-01", 2) == []
+    assert index.is_away(140003, "2024-10-01", "1")
+    assert not index.is_away(140004, "2024-10-01", 1)
+    assert not index.is_away(999999, "2024-10-01", 1)
+
+def test_is_away_between(index):
+    assert index.is_away_between(140002, "2024-10-02", "2024-10-05")
+    assert not index.is_away_between(140002, "2024-10-04", "2024-10-31")
+    assert index.is_away_between(140002, "2024-10-01", "2024-10-01", time_slot=1)
+    assert not index.is_away_between(140002, "2024-10-02", "2024-10-05", time_slot=1)
+    assert not index.is_away_between(999999, "2024-01-01", "2024-12-31")
+
+def test_loads_in_pages(supabase_mock, monkeypatch):
+    monkeypatch.setattr(schedule_index_module, "SCHEDULE_INDEX_PAGE_SIZE", 3)
+    index = ScheduleIndex(supabase_mock)
+
+    assert index.away_on("2024-10-07", 1) == [140004]
+    assert supabase_mock.from_.return_value.select.call_count == 2
+
+def test_pages_are_ordered_by_a_unique_key(supabase_mock):
+    tables = {"schedule": MagicMock(), "schedule_rule": MagicMock()}
+    _paged(tables["schedule"], ROWS)
+    _paged(tables["schedule_rule"], [])
+    supabase_mock.from_.side_effect = lambda table: tables[table].from_.return_value
+    ScheduleIndex(supabase_mock, recurrence_rules=True).away_on("2024-10-01", 1)
+
+    tables["schedule"].queries[0].order.assert_called_once_with("schedule_id")
+    tables["schedule_rule"].queries[0].order.assert_called_once_with("rule_id")
+
+def test_reload_runs_in_the_background(supabase_mock):
+    index = ScheduleIndex(supabase_mock, ttl=0)
+    assert index.away_on("2024-10-07", 1) == [140004]
+    _paged(supabase_mock, ROWS[:3])
+
+    with patch("flaskapp.models.schedule_index.threading.Thread") as thread:
+        # Past the ttl, readers are answered from the current state and one reload is started
+        assert index.away_on("2024-10-07", 1) == [140004]
+        assert index.is_away(140004, "2024-10-07", 1)
+    thread.assert_called_once()
+    assert supabase_mock.from_.return_value.select.call_count == 1
+
+    thread.call_args.kwargs["target"]()
+    assert index.away_on("2024-10-07", 1) == []
+
+def test_loads_once_within_ttl(index, supabase_mock):
+    index.away_on("2024-10-01", 1)
+    index.is_away_between(140002, "2024-10-01", "2024-10-31")
+
+    supabase_mock.from_.return_value.select.assert_called_once()
+
+def test_add_and_remove_update_in_place(index, supabase_mock):
+    index.away_on("2024-10-01", 1)
+    index.add([{"staff_id": 140004, "date": "2024-10-01", "time_slot": 1}])
+    index.remove([{"staff_id": 140002, "date": "2024-10-01", "time_slot": 1}])
+
+    assert index.away_on("2024-10-01", 1) == [140003, 140004]
+    assert not index.is_away_between(140002, "2024-10-01", "2024-10-02")
+    supabase_mock.from_.return_value.select.assert_called_once()
+
+def test_duplicate_rows_need_matching_removes(index):
+    index.away_on("2024-10-01", 1)
+    index.add([{"staff_id": 140003, "date": "2024-10-01", "time_slot": 1}])
+    index.remove([{"staff_id": 140003, "date": "2024-10-01", "time_slot": 1}])
+    assert index.is_away(140003, "2024-10-01", 1)
+
+    index.remove([{"staff_id": 140003, "date": "2024-10-01", "time_slot": 1}])
+    assert not index.is_away(140003, "2024-10-01", 1)
+
+def test_updates_before_load_are_ignored(index, supabase_mock):
+    # The first read loads the table, which already contains these rows
+    index.add([{"staff_id": 140005, "date": "2024-10-09", "time_slot": 2}])
+    assert index.away_on("2024-10-09", 2) == []
+
+def test_create_schedule_entries_updates_index():
+    schedule_index = MagicMock()
+    schedule_index.is_away.return_value = False
+    service = RequestService(MagicMock(), schedule_index=schedule_index)
+
+    service.create_schedule_entries(140002, ["2024-10-01"], 3, 7)
+
+    schedule_index.add.assert_called_once_with([
+        {"staff_id": 140002, "date": "2024-10-01", "time_slot": 1, "request_id": 7},
+        {"staff_id": 140002, "date": "2024-10-01", "time_slot": 2, "request_id": 7},
+    ])
+
+def test_cancel_request_updates_index():
+    supabase_mock = MagicMock()
+    deleted = [{"staff_id": 140002, "date": "2024-10-01", "time_slot": 1, "request_id": 7}]
+    supabase_mock.from_.return_value.delete.return_value.eq.return_value.execute.side_effect = [
+        MagicMock(data=[{"request_id": 7, "staff_id": 140002, "startdate": "2024-10-01", "enddate": "2024-10-01"}]),
+        MagicMock(data=deleted)
+    ]
+    schedule_index = MagicMock()
+    service = RequestService(supabase_mock, schedule_index=schedule_index)
+
+    _, status_code = service.cancel_request(7)
+
+    assert status_code == 200
+    schedule_index.remove.assert_called_once_with(deleted)
+
+def test_is_scheduled_uses_index_without_query():
+    supabase_mock = MagicMock()
+    schedule_index = MagicMock()
+    schedule_index.is_away.return_value = True
+    service = RequestService(supabase_mock, schedule_index=schedule_index)
+
+    assert service.is_scheduled(140002, "2024-10-01", 1)
+    supabase_mock.from_.assert_not_called()
+
+def test_schedules_service_point_queries(index, supabase_mock):
+    service = SchedulesService(supabase_mock, schedule_index=index)
+
+    assert service.who_is_away("2024-10-01", 1) == [140002, 140003]
+    assert service.is_away_between(140004, "2024-10-07", "2024-10-07")
+
+def test_get_away_route(client):
+    with patch('flaskapp.models.schedules.SchedulesService.who_is_away', return_value=[140002]), \
+         patch('flaskapp.models.schedules.SchedulesService.is_away_between', return_value=False) as mock_between:
+        response = client.get('/schedules/away?date=2024-10-01&time_slot=1')
+        assert response.status_code == 200
+        assert response.json == {"date": "2024-10-01", "time_slot": 1, "staff_ids": [140002]}
+
+        response = client.get('/schedules/away?staff_id=140002&start=2024-10-01&end=2024-10-31')
+        assert response.json["away"] is False
+        mock_between.assert_called_once_with(140002, "2024-10-01", "2024-10-31", None)
+
+    assert client.get('/schedules/away?date=10/01/2024&time_slot=1').status_code == 400
+
+def test_loads_recurrence_rules(supabase_mock):
+    rule = {"rule_id": 1, "request_id": 7, "staff_id": 140005, "weekday_mask": 0b10, "time_slot": 3, "startdate": "2024-10-01", "enddate": "2024-10-31", "exceptions": ["2024-10-15"]}
+    tables = {"schedule": MagicMock(), "schedule_rule": MagicMock()}
+    _paged(tables["schedule"], ROWS)
+    _paged(tables["schedule_rule"], [rule])
+    supabase_mock.from_.side_effect = lambda table: tables[table].from_.return_value
+    index = ScheduleIndex(supabase_mock, recurrence_rules=True)
+
+    # Tuesdays, both slots, except 2024-10-15
+    assert index.away_on("2024-10-01", 1) == [140002, 140003, 140005]
+    assert index.away_on("2024-10-08", 2) == [140005]
+    assert not index.is_away(140005, "2024-10-15", 1)
+    assert not index.is_away_between(140005, "2024-10-02", "2024-10-07")
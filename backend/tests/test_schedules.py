@@ -1,3 +1,8 @@
+import base64
+import json
+import os
+import time
+import threading
 import pytest
 from flask import jsonify
 from unittest.mock import MagicMock, patch
@@ -169,6 +174,7 @@ def test_get_all_directors(schedules_service, supabase_mock):
     
     assert result.data == mock_response.data
     supabase_mock.from_().select.assert_called_once_with('Staff_ID, Staff_FName, Staff_LName, Dept, Position')
+    select_mock.neq.assert_called_once_with("Position", "MD")
 
 # Test case for getting directors' schedules
 def test_get_directors_schedules(schedules_service, supabase_mock):
@@ -186,6 +192,7 @@ def test_get_directors_schedules(schedules_service, supabase_mock):
     
     assert result.data == mock_response.data
     supabase_mock.from_().select.assert_called_once_with('Staff_ID, Staff_FName, Staff_LName, Dept, Position, schedule!inner(schedule_id, staff_id, date, time_slot)')
+    select_mock.neq.assert_called_once_with("Position", "MD")
 
 # Test case for formatting schedules
 def test_format_schedules(schedules_service):
@@ -199,6 +206,54 @@ def test_format_schedules(schedules_service):
     assert result == {'schedules': [{'start': '2024-10-16 09:00', 'end': '2024-10-16 13:00', 'class': 'AM', 'WFH': [{"staff_id": 1, "staff_fname": "John", "staff_lname": "Doe", "dept": "HR", "position": "HR_Manager"}], 'count': 1, 'title': 1, 'inOffice': []}]}
     assert status_code == 200
 
+def test_format_schedules_expands_rules_in_window(schedules_service):
+    response = MagicMock()
+    response.data = [{'Staff_ID': 1, 'Dept': 'HR', 'Staff_FName': 'John', 'Staff_LName': 'Doe', "Position": "HR_Manager", 'schedule': [{'schedule_id': 1, 'date': '2024-11-04', 'time_slot': 1}]}]
+    allnames = MagicMock()
+    allnames.data = [{'Staff_ID': 1, 'Staff_FName': 'John', 'Staff_LName': 'Doe', "Dept": "HR", "Position": "HR_Manager"},
+                     {'Staff_ID': 2, 'Staff_FName': 'Jane', 'Staff_LName': 'Tan', "Dept": "HR", "Position": "HR_Manager"}]
+    rules = [
+        # Mondays AM for staff 2 (only in the roster) and staff 1 (already has a row on 2024-11-04)
+        {"rule_id": 1, "request_id": 10, "staff_id": 2, "weekday_mask": 1, "time_slot": 1, "startdate": "2024-10-07", "enddate": "2025-10-07", "exceptions": []},
+        {"rule_id": 2, "request_id": 11, "staff_id": 1, "weekday_mask": 1, "time_slot": 1, "startdate": "2024-11-04", "enddate": "2025-11-04", "exceptions": []},
+        # Not in this view
+        {"rule_id": 3, "request_id": 12, "staff_id": 3, "weekday_mask": 1, "time_slot": 1, "startdate": "2024-11-04", "enddate": "2025-11-04", "exceptions": []},
+    ]
+
+    result, _ = schedules_service.format_schedules(response, allnames, start="2024-11-04", end="2024-11-10", rules=rules)
+
+    assert [(slot["start"], [name["staff_id"] for name in slot["WFH"]]) for slot in result["schedules"]] == [("2024-11-04 09:00", [1, 2])]
+
+def test_get_rules_overlapping_window(supabase_mock):
+    service = SchedulesService(supabase_mock, recurrence_rules=True)
+    service.get_rules("2024-11-01", "2024-11-30", staff_id=2)
+
+    query = supabase_mock.from_.return_value.select.return_value
+    query.gte.assert_called_once_with("enddate", "2024-11-01")
+    query.gte.return_value.lte.assert_called_once_with("startdate", "2024-11-30")
+    assert SchedulesService(MagicMock()).get_rules("2024-11-01", "2024-11-30") == []
+
+def test_get_rules_for_roster(supabase_mock):
+    service = SchedulesService(supabase_mock, recurrence_rules=True)
+    service.get_rules("2024-11-01", "2024-11-30", staff_ids=[1, 2])
+
+    query = supabase_mock.from_.return_value.select.return_value.gte.return_value.lte.return_value
+    query.in_.assert_called_once_with("staff_id", [1, 2])
+    assert service.get_rules("2024-11-01", "2024-11-30", staff_ids=[]) == []
+
+def test_get_schedules_reads_rules_of_roster_only(client):
+    from flaskapp.blueprints.schedules_routes import schedules_service
+    roster = MagicMock(data=[{"Staff_ID": 2}, {"Staff_ID": 1}])
+    with patch.object(schedules_service, "recurrence_rules", True), \
+         patch.object(schedules_service, "get_all_employees_by_dept", return_value=roster), \
+         patch.object(schedules_service, "get_schedules_by_dept", return_value=MagicMock(data=[])), \
+         patch.object(schedules_service, "get_rules", return_value=[]) as get_rules, \
+         patch.object(schedules_service, "format_schedules", return_value=([], 200)):
+        response = client.get('/schedules', query_string={'dept': 'Sales', 'reporting_manager': 'all', 'start': '2024-11-01', 'end': '2024-11-30'})
+
+    assert response.status_code == 200
+    get_rules.assert_called_once_with(start="2024-11-01", end="2024-11-30", staff_ids=[1, 2])
+
 # Test case for formatting schedules with no data
 def test_format_schedules_no_data(schedules_service):
     response = MagicMock()
@@ -254,7 +309,8 @@ def test_get_schedules_ceo(client):
         })
 
         # Verify that the service methods were called correctly
-        mock_get_ceo.assert_called_once()
+        # The CEO id is only needed on the director-team branch
+        mock_get_ceo.assert_not_called()
         mock_get_all_employees_by_dept.assert_called_once_with('CEO')
         mock_get_schedules_by_dept.assert_called_once_with('CEO')
 
@@ -407,4 +463,286 @@ def test_format_schedules_else_branch(schedules_service):
     assert len(result["schedules"]) == 1  # Same date and time slot are combined
     assert len(result["schedules"][0]["WFH"]) == 2
     assert {"staff_id": 1, "staff_fname": "John", "staff_lname": "Doe", "dept": "HR", "position": "Analyst"} in result["schedules"][0]["WFH"]
-    assert {"staff_id": 2, "staff_fname": "Jane", "staff_lname": "Smith", "dept": "IT", "position": "Developer"} in result["schedules"][0]["WFH"]
\ No newline at end of file
+    assert {"staff_id": 2, "staff_fname": "Jane", "staff_lname": "Smith", "dept": "IT", "position": "Developer"} in result["schedules"][0]["WFH"]
+
+def _synthetic_roster(size, days, wfh_every):
+    # Every wfh_every-th employee works from home on every AM and PM slot of each day
+    roster = []
+    schedules = []
+    for i in range(size):
+        employee = {"Staff_ID": i, "Staff_FName": f"F{i}", "Staff_LName": f"L{i}", "Dept": f"Dept{i % 7}", "Position": "Staff"}
+        roster.append(employee)
+        if i % wfh_every == 0:
+            slots = [{"schedule_id": i * 1000 + d * 2 + t, "date": f"2024-10-{d + 1:02d}", "time_slot": t} for d in range(days) for t in (1, 2)]
+            schedules.append(dict(employee, schedule=slots))
+    return MagicMock(data=schedules), MagicMock(data=roster)
+
+def _reference_format_schedules(response, allnames):
+    # The original list-membership formulation of format_schedules, kept as the regression oracle
+    names = {}
+    for employee in response.data:
+        for slot in employee["schedule"]:
+            names.setdefault((slot["date"], slot["time_slot"]), []).append({"staff_id": employee["Staff_ID"], "staff_fname": employee["Staff_FName"], "staff_lname": employee["Staff_LName"], "dept": employee["Dept"], "position": employee["Position"]})
+    allnamelist = [{"staff_id": e["Staff_ID"], "staff_fname": e["Staff_FName"], "staff_lname": e["Staff_LName"], "dept": e["Dept"], "position": e["Position"]} for e in allnames.data]
+    returnlist = []
+    for (date, time_slot), name_list in names.items():
+        label = "AM" if time_slot == 1 else "PM"
+        returnlist.append({
+            "start": f"{date} 09:00" if label == "AM" else f"{date} 14:00",
+            "end": f"{date} 13:00" if label == "AM" else f"{date} 18:00",
+            "class": label,
+            "WFH": name_list,
+            "count": len(name_list),
+            "title": len(name_list),
+            "inOffice": [e for e in allnamelist if e not in name_list]
+        })
+    return {"schedules": returnlist}
+
+def test_format_schedules_matches_reference_output(schedules_service):
+    response, allnames = _synthetic_roster(500, 5, 25)
+
+    result, status = schedules_service.format_schedules(response, allnames)
+
+    assert status == 200
+    assert json.dumps(result).encode() == json.dumps(_reference_format_schedules(response, allnames)).encode()
+
+@pytest.mark.skipif(not os.environ.get("RUN_BENCHMARKS"), reason="wall-clock benchmark; set RUN_BENCHMARKS=1 to run it")
+def test_format_schedules_benchmark_10k_roster(schedules_service):
+    response, allnames = _synthetic_roster(10000, 20, 100)
+
+    start = time.perf_counter()
+    result, status = schedules_service.format_schedules(response, allnames)
+    elapsed = time.perf_counter() - start
+
+    assert status == 200
+    assert len(result["schedules"]) == 40
+    assert all(slot["count"] == 100 and len(slot["inOffice"]) == 9900 for slot in result["schedules"])
+    # The list-membership version took tens of seconds here; O(roster) per slot is well under this
+    assert elapsed < 5
+
+def test_get_schedules_by_dept_with_window(schedules_service, supabase_mock):
+    select_mock = MagicMock()
+    select_mock.eq.return_value = select_mock
+    select_mock.gte.return_value = select_mock
+    select_mock.lte.return_value = select_mock
+    supabase_mock.from_().select.return_value = select_mock
+
+    schedules_service.get_schedules_by_dept("HR", start="2024-10-01", end="2024-10-31")
+
+    select_mock.gte.assert_called_once_with("schedule.date", "2024-10-01")
+    select_mock.lte.assert_called_once_with("schedule.date", "2024-10-31")
+    select_mock.execute.assert_called_once()
+
+def test_get_schedules_by_dept_without_window(schedules_service, supabase_mock):
+    select_mock = MagicMock()
+    select_mock.eq.return_value = select_mock
+    supabase_mock.from_().select.return_value = select_mock
+
+    schedules_service.get_schedules_by_dept("HR")
+
+    select_mock.gte.assert_not_called()
+    select_mock.lte.assert_not_called()
+
+def test_format_schedules_with_window(schedules_service):
+    response = MagicMock()
+    response.data = [{'Staff_ID': 1, 'Dept': 'HR', 'Staff_FName': 'John', 'Staff_LName': 'Doe', "Position": "HR_Manager", 'schedule': [
+        {'schedule_id': 1, 'date': '2024-09-30', 'time_slot': 1},
+        {'schedule_id': 2, 'date': '2024-10-16', 'time_slot': 2},
+        {'schedule_id': 3, 'date': '2024-11-01', 'time_slot': 1}]}]
+    allnames = MagicMock()
+    allnames.data = [{'Staff_ID': 1, 'Staff_FName': 'John', 'Staff_LName': 'Doe', "Dept": "HR", "Position": "HR_Manager"}]
+
+    result, status_code = schedules_service.format_schedules(response, allnames, start="2024-10-01", end="2024-10-31")
+
+    assert status_code == 200
+    assert [slot["start"] for slot in result["schedules"]] == ["2024-10-16 14:00"]
+
+def test_get_schedules_with_window(client):
+    with patch('flaskapp.models.schedules.SchedulesService.get_ceo') as mock_get_ceo, \
+         patch('flaskapp.models.schedules.SchedulesService.get_all_employees_by_dept') as mock_get_all_employees_by_dept, \
+         patch('flaskapp.models.schedules.SchedulesService.get_schedules_by_dept') as mock_get_schedules_by_dept:
+
+        mock_get_ceo.return_value = 1
+        response = client.get('/schedules', query_string={
+            'dept': 'HR',
+            'reporting_manager': 'all',
+            'start': '2024-10-01',
+            'end': '2024-10-31'
+        })
+
+        mock_get_all_employees_by_dept.assert_called_once_with('HR')
+        mock_get_schedules_by_dept.assert_called_once_with('HR', start='2024-10-01', end='2024-10-31')
+        assert response.status_code == 200
+
+def test_get_schedules_invalid_window(client):
+    response = client.get('/schedules', query_string={
+        'dept': 'HR',
+        'reporting_manager': 'all',
+        'start': 'October'
+    })
+
+    assert response.status_code == 400
+    assert response.get_json() == {"error": "Invalid start date, expected YYYY-MM-DD"}
+
+def test_get_roster_with_schedules(schedules_service, supabase_mock):
+    select_mock = MagicMock()
+    select_mock.eq.return_value = select_mock
+    select_mock.gte.return_value = select_mock
+    select_mock.lte.return_value = select_mock
+    supabase_mock.from_().select.return_value = select_mock
+
+    schedules_service.get_roster_with_schedules(dept="HR", reporting_manager=2, start="2024-10-01", end="2024-10-31")
+
+    supabase_mock.from_().select.assert_called_once_with('Staff_ID, Staff_FName, Staff_LName, Dept, Position, schedule(schedule_id, staff_id, date, time_slot)')
+    select_mock.eq.assert_any_call("Dept", "HR")
+    select_mock.eq.assert_any_call("Reporting_Manager", 2)
+    select_mock.gte.assert_called_once_with("schedule.date", "2024-10-01")
+    select_mock.lte.assert_called_once_with("schedule.date", "2024-10-31")
+    select_mock.neq.assert_not_called()
+
+def test_format_schedules_single_result_matches_two_queries(schedules_service):
+    response, allnames = _synthetic_roster(50, 3, 5)
+    # The left-joined shape: every roster row, with an empty schedule list for staff who are in office
+    schedules_by_id = {employee["Staff_ID"]: employee["schedule"] for employee in response.data}
+    joined = MagicMock(data=[dict(employee, schedule=schedules_by_id.get(employee["Staff_ID"], [])) for employee in allnames.data])
+
+    assert schedules_service.format_schedules(joined) == schedules_service.format_schedules(response, allnames)
+
+def test_get_schedules_joined_fetch(client):
+    with patch('flaskapp.models.schedules.SchedulesService.get_roster_with_schedules') as mock_get_roster_with_schedules, \
+         patch('flaskapp.models.schedules.SchedulesService.get_all_employees_by_dept') as mock_get_all_employees_by_dept, \
+         patch('flaskapp.models.schedules.SchedulesService.get_schedules_by_dept') as mock_get_schedules_by_dept:
+
+        response = client.get('/schedules', query_string={
+            'dept': 'HR',
+            'reporting_manager': 'all',
+            'fetch': 'joined',
+            'start': '2024-10-01'
+        })
+
+        mock_get_roster_with_schedules.assert_called_once_with(dept='HR', start='2024-10-01')
+        mock_get_all_employees_by_dept.assert_not_called()
+        mock_get_schedules_by_dept.assert_not_called()
+        assert response.status_code == 200
+
+def test_stream_schedules_matches_format_schedules(schedules_service, client):
+    response, allnames = _synthetic_roster(40, 3, 4)
+
+    with client.application.app_context():
+        chunks = list(schedules_service.stream_schedules(response, allnames, start="2024-10-02"))
+
+    # One chunk per slot plus the opening and closing brackets
+    assert len(chunks) == 4 + 2
+    assert json.loads("".join(chunks)) == schedules_service.format_schedules(response, allnames, start="2024-10-02")[0]
+
+def test_stream_schedules_no_data(schedules_service, client):
+    with client.application.app_context():
+        chunks = list(schedules_service.stream_schedules(MagicMock(data=None), MagicMock(data=[])))
+
+    assert json.loads("".join(chunks)) == {"code": 404, "message": "No data or bad data"}
+
+def test_get_schedules_streamed(client):
+    response_data, allnames_data = _synthetic_roster(30, 2, 3)
+    with patch('flaskapp.models.schedules.SchedulesService.get_all_employees_by_dept', return_value=allnames_data), \
+         patch('flaskapp.models.schedules.SchedulesService.get_schedules_by_dept', return_value=response_data):
+        query_string = {'dept': 'HR', 'reporting_manager': 'all'}
+        buffered = client.get('/schedules', query_string=query_string)
+        streamed = client.get('/schedules', query_string=dict(query_string, stream='true'))
+
+        assert streamed.status_code == 200
+        assert streamed.is_streamed
+        assert streamed.mimetype == "application/json"
+        assert streamed.get_json() == buffered.get_json()
+
+def test_format_counts(schedules_service):
+    result, status_code = schedules_service.format_counts([{"date": "2024-10-16", "time_slot": 2, "count": 4}])
+
+    assert status_code == 200
+    assert result == {"schedules": [{"start": "2024-10-16 14:00", "end": "2024-10-16 18:00", "class": "PM", "count": 4, "title": 4}]}
+
+def test_get_schedules_counts_view(client):
+    with patch('flaskapp.models.occupancy_summary.OccupancySummaryService.get_counts', return_value=[{"date": "2024-10-16", "time_slot": 1, "count": 2}]) as mock_get_counts, \
+         patch('flaskapp.models.schedules.SchedulesService.get_schedules_by_dept') as mock_get_schedules_by_dept:
+        response = client.get('/schedules', query_string={
+            'dept': 'HR',
+            'reporting_manager': 'all',
+            'view': 'counts',
+            'end': '2024-10-31'
+        })
+
+        mock_get_counts.assert_called_once_with(dept='HR', end='2024-10-31')
+        mock_get_schedules_by_dept.assert_not_called()
+        assert response.get_json() == {"schedules": [{"start": "2024-10-16 09:00", "end": "2024-10-16 13:00", "class": "AM", "count": 2, "title": 2}]}
+
+def test_get_schedules_not_modified(client):
+    with patch('flaskapp.models.versioning.ChangeVersion.current', return_value=9), \
+         patch('flaskapp.models.schedules.SchedulesService.get_all_employees_by_dept') as mock_get_all_employees_by_dept, \
+         patch('flaskapp.models.schedules.SchedulesService.get_schedules_by_dept') as mock_get_schedules_by_dept:
+        query_string = {'dept': 'HR', 'reporting_manager': 'all'}
+        first = client.get('/schedules', query_string=query_string)
+        second = client.get('/schedules', query_string=query_string, headers={"If-None-Match": first.headers["ETag"]})
+
+        assert first.status_code == 200
+        assert second.status_code == 304
+        mock_get_schedules_by_dept.assert_called_once()
+
+def _decode_compact(payload):
+    # Mirrors aiowa/src/utils/decodeSchedules.js
+    roster = [dict(zip(payload["fields"], row)) for row in payload["roster"]]
+    schedules = []
+    for slot in payload["schedules"]:
+        bits = base64.b64decode(slot["inOffice"])
+        in_office = [roster[i] for i in range(payload["in_office_size"]) if (bits[i >> 3] >> (i & 7)) & 1]
+        schedules.append(dict(slot, WFH=[roster[i] for i in slot["WFH"]], inOffice=in_office))
+    return {"schedules": schedules}
+
+def test_format_schedules_compact_round_trip(schedules_service):
+    response, allnames = _synthetic_roster(203, 3, 9)
+    allnames.data = allnames.data + allnames.data[:2]
+    response.data = response.data + [{"Staff_ID": 999, "Staff_FName": "Out", "Staff_LName": "Side", "Dept": "X", "Position": "Staff", "schedule": [{"schedule_id": 1, "date": "2024-10-01", "time_slot": 2}]}]
+
+    compact, status = schedules_service.format_schedules_compact(response, allnames)
+
+    assert status == 200
+    assert compact["in_office_size"] == 205
+    assert len(compact["roster"]) == 206
+    assert _decode_compact(compact) == schedules_service.format_schedules(response, allnames)[0]
+
+def test_format_schedules_compact_is_smaller(schedules_service):
+    response, allnames = _synthetic_roster(2000, 10, 50)
+
+    compact = json.dumps(schedules_service.format_schedules_compact(response, allnames)[0])
+    full = json.dumps(schedules_service.format_schedules(response, allnames)[0])
+
+    assert len(full) > 10 * len(compact)
+
+def test_format_schedules_compact_no_data(schedules_service):
+    assert schedules_service.format_schedules_compact(MagicMock(data=None), MagicMock(data=[])) == ({"code": 404, "message": "No data or bad data"}, 404)
+
+def test_get_schedules_compact(client):
+    response_data, allnames_data = _synthetic_roster(30, 2, 3)
+    with patch('flaskapp.models.schedules.SchedulesService.get_all_employees_by_dept', return_value=allnames_data), \
+         patch('flaskapp.models.schedules.SchedulesService.get_schedules_by_dept', return_value=response_data):
+        query_string = {'dept': 'HR', 'reporting_manager': 'all'}
+        full = client.get('/schedules', query_string=query_string)
+        compact = client.get('/schedules', query_string=dict(query_string, format='compact'))
+
+        assert compact.get_json()["format"] == "compact"
+        assert _decode_compact(compact.get_json()) == full.get_json()
+
+def test_get_schedules_runs_roster_and_schedule_queries_concurrently(client):
+    # Each mocked query waits for the other, so this only completes if both are in flight together
+    barrier = threading.Barrier(2, timeout=2)
+    with patch('flaskapp.models.schedules.SchedulesService.get_all_employees_by_dept', side_effect=lambda dept: barrier.wait() and {}), \
+         patch('flaskapp.models.schedules.SchedulesService.get_schedules_by_dept', side_effect=lambda dept: barrier.wait() and {}), \
+         patch('flaskapp.models.schedules.SchedulesService.format_schedules', return_value=([], 200)):
+        response = client.get('/schedules', query_string={'dept': 'Sales', 'reporting_manager': 'all'})
+
+    assert response.status_code == 200
+
+def test_get_schedules_timeout(client):
+    with patch('flaskapp.blueprints.schedules_routes.fan_out', side_effect=TimeoutError("1 of 2 queries did not finish within 10s")):
+        response = client.get('/schedules', query_string={'dept': 'Sales', 'reporting_manager': 'all'})
+
+    assert response.status_code == 504
+    assert response.get_json() == {"error": "1 of 2 queries did not finish within 10s"}
@@ -212,4 +212,30 @@ def test_get_team_requests_no_requests_for_team_staff(client, teams_controller):
     # Assertions
     assert response.status_code == 404
     data = response.get_json()
-    assert data["error"] == "No requests found for the team"
\ No newline at end of file
+    assert data["error"] == "No requests found for the team"
+
+def test_get_teams_by_reporting_manager_looks_up_each_manager_once(teams_controller):
+    mock_staff_data = [
+        {'Staff_ID': 1, 'Staff_FName': 'John', 'Staff_LName': 'Doe', 'Dept': 'IT', 'Position': 'Developer', 'Reporting_Manager': 2},
+        {'Staff_ID': 3, 'Staff_FName': 'Amy', 'Staff_LName': 'Tan', 'Dept': 'IT', 'Position': 'Developer', 'Reporting_Manager': 2},
+        {'Staff_ID': 4, 'Staff_FName': 'Ben', 'Staff_LName': 'Lim', 'Dept': 'IT', 'Position': 'Support', 'Reporting_Manager': 5},
+    ]
+    app = Flask(__name__)
+    with app.test_request_context('/teams_by_reporting_manager?department=IT'), \
+         patch.object(teams_controller.teams_service, 'get_staff_by_department', return_value=mock_staff_data), \
+         patch.object(teams_controller.teams_service, 'get_manager_name', side_effect=lambda manager_id: f"Manager {manager_id}") as mock_get_manager_name:
+        response = teams_controller.get_teams_by_reporting_manager()
+
+    assert response.status_code == 200
+    assert sorted(call.args[0] for call in mock_get_manager_name.call_args_list) == [2, 5]
+    assert response.get_json()["dropdown_values"] == ["Manager 2's Team (Developer)", "Manager 5's Team (Support)"]
+
+def test_get_teams_by_reporting_manager_timeout(teams_controller):
+    app = Flask(__name__)
+    mock_staff_data = [{'Staff_ID': 1, 'Staff_FName': 'John', 'Staff_LName': 'Doe', 'Dept': 'IT', 'Position': 'Developer', 'Reporting_Manager': 2}]
+    with app.test_request_context('/teams_by_reporting_manager?department=IT'), \
+         patch.object(teams_controller.teams_service, 'get_staff_by_department', return_value=mock_staff_data), \
+         patch('flaskapp.models.teams.fan_out_map', side_effect=TimeoutError("timed out")):
+        response = teams_controller.get_teams_by_reporting_manager()
+
+    assert response.status_code == 504
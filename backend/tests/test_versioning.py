@@ -0,0 +1,61 @@
+import pytest
+from unittest.mock import MagicMock
+from flask import Flask, jsonify, make_response
+from flaskapp.models.versioning import ChangeVersion, not_modified, with_etag
+
+@pytest.fixture
+def supabase_mock():
+    return MagicMock()
+
+@pytest.fixture
+def change_version(supabase_mock):
+    return ChangeVersion(supabase_mock)
+
+@pytest.fixture
+def app():
+    return Flask(__name__)
+
+def test_current(change_version, supabase_mock):
+    supabase_mock.from_().select().eq().execute.return_value = MagicMock(data=[{"version": 7}])
+    assert change_version.current() == 7
+
+def test_current_unavailable(change_version, supabase_mock, app):
+    supabase_mock.from_().select().eq().execute.side_effect = Exception("relation does not exist")
+    with app.app_context():
+        assert change_version.current() is None
+
+def test_bump(change_version, supabase_mock):
+    supabase_mock.rpc().execute.return_value = MagicMock(data=8)
+    assert change_version.bump() == 8
+    supabase_mock.rpc.assert_called_with("bump_change_version", {})
+
+def test_bump_failure_is_logged_not_raised(change_version, supabase_mock, app):
+    supabase_mock.rpc().execute.side_effect = Exception("timeout")
+    with app.app_context():
+        assert change_version.bump() is None
+
+def test_etag_depends_on_version_path_and_parts(change_version, supabase_mock, app):
+    supabase_mock.from_().select().eq().execute.return_value = MagicMock(data=[{"version": 1}])
+    with app.test_request_context("/team/requests?status=0"):
+        first = change_version.etag("123")
+        assert change_version.etag("123") == first
+        assert change_version.etag("456") != first
+    with app.test_request_context("/team/requests?status=1"):
+        assert change_version.etag("123") != first
+    supabase_mock.from_().select().eq().execute.return_value = MagicMock(data=[{"version": 2}])
+    with app.test_request_context("/team/requests?status=0"):
+        assert change_version.etag("123") != first
+
+def test_not_modified(app):
+    with app.test_request_context(headers={"If-None-Match": '"abc"'}):
+        response = not_modified("abc")
+        assert response.status_code == 304
+        assert response.headers["ETag"] == '"abc"'
+        assert not_modified("def") is None
+        assert not_modified(None) is None
+
+def test_with_etag_only_on_success(app):
+    with app.test_request_context():
+        assert with_etag(make_response(jsonify([]), 200), "abc").headers["ETag"] == '"abc"'
+        assert "ETag" not in with_etag(make_response(jsonify({"error": "x"}), 404), "abc").headers
+        assert "ETag" not in with_etag(make_response(jsonify([]), 200), None).headers